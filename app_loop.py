@@ -0,0 +1,123 @@
+# app_loop.py
+
+import os
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+# Threads for the few blocking calls left on the async path (PTB's Bot API
+# methods, which also wait for the outbound queue)
+APP_LOOP_BLOCKING_WORKERS = int(os.getenv("APP_LOOP_BLOCKING_WORKERS", "16"))
+
+
+class AppLoop:
+    """
+    The process-wide asyncio event loop, on one background thread.
+
+    Update handlers, scraper calls (one shared aiohttp session), the
+    Telethon clients and subprocess waits all run on it as coroutines, so
+    a slow API response or a long ffmpeg run only parks a coroutine.
+    Threads hand work over with submit() / run(); coroutines reach blocking
+    code through to_thread().
+    """
+
+    def __init__(self, name="app-loop", blocking_workers=APP_LOOP_BLOCKING_WORKERS):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._blocking = ThreadPoolExecutor(
+            max_workers=max(1, blocking_workers), thread_name_prefix=f"{name}-blocking"
+        )
+
+    # ── lifecycle ────────────────────────────────────────────────────────
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self.loop
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            return self.loop
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self, timeout=10):
+        with self._lock:
+            if self._thread is None:
+                return
+            thread, self._thread = self._thread, None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        thread.join(timeout=timeout)
+        self._blocking.shutdown(wait=False)
+
+    def in_loop(self):
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    # ── crossing between threads and the loop ────────────────────────────
+    def submit(self, coro):
+        """
+        Schedules `coro` on the loop (started on first use). Thread-safe;
+        returns a concurrent.futures.Future with its result.
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Blocking submit() for worker threads: returns coro's result or
+        raises its exception. Must not be called from the loop itself.
+        """
+        if self.in_loop():
+            coro.close()
+            raise RuntimeError("AppLoop.run() called from the event loop; await instead")
+        return self.submit(coro).result(timeout)
+
+    async def to_thread(self, fn, *args, **kwargs):
+        """
+        Awaits the blocking `fn(*args, **kwargs)` on the bounded pool.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._blocking, lambda: fn(*args, **kwargs)
+        )
+
+    def handler(self, async_fn):
+        """
+        Adapts `async def fn(update, context)` to a PTB 13 callback: the
+        dispatcher thread only schedules the coroutine and returns at once.
+        Exceptions go to the dispatcher's error handlers as usual.
+        """
+        def callback(update, context):
+            future = self.submit(async_fn(update, context))
+
+            def _done(f):
+                if f.cancelled():
+                    return
+                error = f.exception()
+                if error is not None:
+                    # error handlers are plain blocking PTB callbacks
+                    self._blocking.submit(self._dispatch_error, context, update, error, async_fn)
+
+            future.add_done_callback(_done)
+
+        callback.__name__ = async_fn.__name__
+        return callback
+
+    @staticmethod
+    def _dispatch_error(context, update, error, async_fn):
+        try:
+            context.dispatcher.dispatch_error(update, error)
+        except Exception:
+            logger.error("Unhandled error in %s", async_fn.__name__, exc_info=error)
+
+
+app_loop = AppLoop()
+
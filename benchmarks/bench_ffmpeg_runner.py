@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# benchmarks/bench_ffmpeg_runner.py
+#
+# CPU spent in the bot process while it follows several long ffmpeg runs:
+# the old readline/poll loop (one thread per run, stat() per progress
+# line) against ffmpeg_runner.run_ffmpeg (one event loop for all). The
+# "ffmpeg" is a stand-in that prints a -progress block every half second
+# for the given time, like a slow network fetch does.
+#
+#   python benchmarks/bench_ffmpeg_runner.py [jobs] [seconds]
+
+import os
+import sys
+import time
+import resource
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ffmpeg_runner import run_ffmpeg
+
+FAKE_FFMPEG = """
+import sys, time
+seconds, out = float(sys.argv[-2]), sys.argv[-1]
+size, t0 = 0, time.time()
+while time.time() - t0 < seconds:
+    time.sleep(0.5)
+    size += 256 * 1024
+    with open(out, "ab") as f:
+        f.write(b"\\0" * 1024)
+    print(f"out_time_us={int((time.time() - t0) * 1e6)}\\ntotal_size={size}\\nprogress=continue", flush=True)
+print("progress=end", flush=True)
+"""
+
+
+def _legacy(cmd, out_path):
+    # the loop utils._run_ffmpeg used before
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+    while True:
+        line = proc.stdout.readline()
+        if not line:
+            if proc.poll() is not None:
+                break
+            continue
+        key, _, _ = line.strip().partition("=")
+        if key == "out_time_us":
+            os.path.getsize(out_path) if os.path.exists(out_path) else 0
+    return proc.wait()
+
+
+def _cpu():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _bench(name, fn, jobs, seconds, workdir):
+    cmds = [
+        # "-progress" given explicitly so the runner doesn't add its flags to python's
+        [sys.executable, "-c", FAKE_FFMPEG, "-progress", "pipe:1", str(seconds),
+         os.path.join(workdir, f"{name}-{i}.out")]
+        for i in range(jobs)
+    ]
+    cpu0, wall0 = _cpu(), time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(fn, cmds))
+    cpu, wall = _cpu() - cpu0, time.perf_counter() - wall0
+    print(f"{name:8s} {jobs} jobs × {seconds:.0f}s: {cpu:6.2f} s CPU in {wall:5.1f} s "
+          f"({cpu / wall * 100:5.1f}% of a core)")
+
+
+def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with tempfile.TemporaryDirectory() as workdir:
+        _bench("legacy", lambda cmd: _legacy(cmd, cmd[-1]), jobs, seconds, workdir)
+        _bench("runner", lambda cmd: run_ffmpeg(cmd).returncode, jobs, seconds, workdir)
+
+
+if __name__ == "__main__":
+    main()
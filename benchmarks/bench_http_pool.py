@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# benchmarks/bench_http_pool.py
+#
+# Compares cold `requests.get` calls (new TCP connection every time) with
+# calls through the shared keep-alive pool in http_client.py, against a
+# local stand-in for the AniWatch API.
+#
+#   python benchmarks/bench_http_pool.py [requests] [threads]
+
+import os
+import sys
+import json
+import time
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests
+
+import http_client
+
+# Simulated server-side work per request (seconds)
+SERVER_DELAY = 0.002
+
+FAKE_SOURCES = {
+    "data": {
+        "sources": [{"url": "https://example.invalid/master.m3u8", "type": "hls"}],
+        "tracks": [{"file": "https://example.invalid/eng-2.vtt", "label": "English"}],
+    }
+}
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real API
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def do_GET(self):
+        time.sleep(SERVER_DELAY)
+        body = json.dumps(FAKE_SOURCES).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _run(fetch, url, n, threads):
+    latencies = []
+    lock = threading.Lock()
+
+    def one(_):
+        t0 = time.perf_counter()
+        resp = fetch(url)
+        resp.raise_for_status()
+        resp.json()
+        dt = time.perf_counter() - t0
+        with lock:
+            latencies.append(dt)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(n)))
+    wall = time.perf_counter() - start
+    return wall, latencies
+
+
+def _report(label, wall, latencies):
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{label:<8} total={wall:6.2f}s  p50={p50:6.2f}ms  p95={p95:6.2f}ms  "
+          f"rps={len(latencies) / wall:7.1f}")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/episode/sources?animeEpisodeId=x"
+
+    print(f"{n} requests, {threads} thread(s), server delay {SERVER_DELAY * 1000:.0f}ms")
+
+    def cold(u):
+        # what the scraper used to do: a brand-new connection per call
+        return requests.get(u, timeout=10)
+
+    _report("cold", *_run(cold, url, n, threads))
+    _report("pooled", *_run(http_client.http_get, url, n, threads))
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# benchmarks/bench_upload_tuner.py
+#
+# Runs telethon_uploader.upload_file_adaptive() against a local fake MTProto
+# upload sink and compares it with a fixed, one-part-at-a-time upload (what
+# Telethon's send_file does). The sink charges every request a round-trip
+# time plus its share of a fixed link bandwidth, so parallel in-flight parts
+# help until the link is full.
+#
+#   python benchmarks/bench_upload_tuner.py [file_mb] [rtt_ms] [link_mb_s]
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telethon.tl.functions.upload import SaveFilePartRequest, SaveBigFilePartRequest
+
+import telethon_uploader
+from telethon_uploader import UploadTuner, upload_file_adaptive
+
+
+class FakeUploadSink:
+    """
+    Stands in for a connected TelegramClient: `await client(request)` for
+    Save(Big)FilePartRequest, with per-request RTT and a shared link whose
+    bytes are serialised at `link_bps`.
+    """
+
+    def __init__(self, rtt, link_bps):
+        self.rtt = rtt
+        self.link_bps = link_bps
+        self.parts = {}
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._link_free_at = 0.0
+
+    async def __call__(self, request):
+        assert isinstance(request, (SaveFilePartRequest, SaveBigFilePartRequest))
+        self._in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            start = max(now, self._link_free_at)
+            self._link_free_at = start + len(request.bytes) / self.link_bps
+            await asyncio.sleep(self._link_free_at - now + self.rtt)
+            self.parts[request.file_part] = len(request.bytes)
+            return True
+        finally:
+            self._in_flight -= 1
+
+
+async def _fixed_upload(client, path, part_kb):
+    part_size = part_kb * 1024
+    with open(path, "rb") as f:
+        idx = 0
+        while True:
+            data = f.read(part_size)
+            if not data:
+                break
+            await client(SaveBigFilePartRequest(1, idx, -1, data))
+            idx += 1
+
+
+def _run(label, coro_fn, sink, size):
+    t0 = time.perf_counter()
+    asyncio.run(coro_fn())
+    elapsed = time.perf_counter() - t0
+    print(f"{label:<34} {elapsed:6.2f}s  {size / elapsed / 1024 ** 2:6.2f} MB/s  "
+          f"max in flight {sink.max_in_flight}")
+
+
+def main():
+    file_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    rtt = (float(sys.argv[2]) if len(sys.argv) > 2 else 60.0) / 1000
+    link = (float(sys.argv[3]) if len(sys.argv) > 3 else 40.0) * 1024 ** 2
+
+    # small probe windows so a short benchmark file gets through the probe
+    telethon_uploader.PROBE_WINDOW_BYTES = 2 * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "Episode 1.mp4")
+        with open(path, "wb") as f:
+            f.write(os.urandom(file_mb * 1024 ** 2))
+        size = os.path.getsize(path)
+        tuner = UploadTuner(path=os.path.join(tmp, "tuning.json"))
+
+        print(f"{file_mb} MB file, RTT {rtt * 1000:.0f} ms, link {link / 1024 ** 2:.0f} MB/s\n")
+
+        sink = FakeUploadSink(rtt, link)
+        _run("fixed 512 KB, 1 in flight", lambda: _fixed_upload(sink, path, 512), sink, size)
+
+        for run in range(1, 4):
+            sink = FakeUploadSink(rtt, link)
+            _run(f"adaptive, run {run}", lambda: upload_file_adaptive(sink, path, tuner), sink, size)
+            assert sum(sink.parts.values()) == size
+
+        print("\nremembered:", tuner.stats())
+
+
+if __name__ == "__main__":
+    main()
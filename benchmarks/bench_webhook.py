@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# benchmarks/bench_webhook.py
+#
+# Posts Telegram updates to webhook_server.WebhookServer the way Telegram
+# does (JSON body + secret header, several connections at once) and
+# measures the HTTP response time and the dispatch latency: POST sent →
+# Update taken off the dispatcher's update_queue.
+#
+# Updates come from a JSON-lines file of recorded Update objects (one per
+# line, e.g. captured with getUpdates); without one, /search commands are
+# synthesised.
+#
+#   python benchmarks/bench_webhook.py [updates.jsonl] [count] [connections]
+
+import os
+import sys
+import json
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests
+
+from webhook_server import WebhookServer, SECRET_HEADER, new_secret
+
+
+def _synthetic(n):
+    now = int(time.time())
+    for i in range(n):
+        yield {
+            "update_id": 100000 + i,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "chat": {"id": 1000 + i % 50, "type": "private"},
+                "from": {"id": 1000 + i % 50, "is_bot": False, "first_name": "bench"},
+                "text": f"/search title {i}",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 7}],
+            },
+        }
+
+
+def _load(path, n):
+    with open(path) as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    # repeat with fresh update_ids so the batcher does not drop them as duplicates
+    out = []
+    for i in range(n):
+        u = dict(updates[i % len(updates)])
+        u["update_id"] = 100000 + i
+        out.append(u)
+    return out
+
+
+def _pct(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+
+def main():
+    args = sys.argv[1:]
+    path = args.pop(0) if args and not args[0].isdigit() else None
+    count = int(args[0]) if len(args) > 0 else 2000
+    connections = int(args[1]) if len(args) > 1 else 16
+    updates = _load(path, count) if path else list(_synthetic(count))
+
+    secret = new_secret()
+    update_queue = queue.Queue()
+    server = WebhookServer(None, update_queue, secret, host="127.0.0.1", port=0)
+    server.start()
+    url = f"http://127.0.0.1:{server.port}{server.path}"
+
+    sent_at = {}
+    dispatch = []
+    done = threading.Event()
+
+    def consume():
+        while len(dispatch) < count:
+            update = update_queue.get()
+            dispatch.append(time.perf_counter() - sent_at[update.update_id])
+        done.set()
+
+    threading.Thread(target=consume, daemon=True).start()
+
+    local = threading.local()
+
+    def post(payload):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        sent_at[payload["update_id"]] = t0 = time.perf_counter()
+        resp = session.post(url, json=payload, headers={SECRET_HEADER: secret}, timeout=10)
+        resp.raise_for_status()
+        return time.perf_counter() - t0
+
+    # a wrong secret must be refused
+    bad = requests.post(url, json=updates[0], headers={SECRET_HEADER: "wrong"}, timeout=10)
+    assert bad.status_code == 403, bad.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        http = list(pool.map(post, updates))
+    done.wait(30)
+    elapsed = time.perf_counter() - started
+    server.stop()
+
+    print(f"{count} updates over {connections} connections in {elapsed:.2f}s "
+          f"({count / elapsed:.0f} updates/s)")
+    print(f"HTTP response   p50 {_pct(http, 0.5):6.2f} ms  p95 {_pct(http, 0.95):6.2f} ms")
+    print(f"dispatch        p50 {_pct(dispatch, 0.5):6.2f} ms  p95 {_pct(dispatch, 0.95):6.2f} ms")
+    print("server:", server.stats())
+
+
+if __name__ == "__main__":
+    main()
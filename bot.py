@@ -2,9 +2,11 @@
 # bot.py
 
 import os
+import html
+import queue
 import threading
+import concurrent.futures
 import logging
-import asyncio
 import time
 
 from dotenv import load_dotenv
@@ -12,13 +14,32 @@ load_dotenv()
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, CallbackContext
-from telegram.error import RetryAfter
 
-from telethon import TelegramClient
-
-from utils import (
-    download_and_rename_subtitle,
-    download_and_rename_video,
+from telethon.utils import pack_bot_file_id
+
+from utils import download_and_rename_video, SOFT_SUBS
+from hianimez_scraper import STREAM_SERVER, STREAM_CATEGORY
+from video_cache import VideoCache, cache_key as video_cache_key
+from media_refs import MediaRefStore
+from subtitle_store import SubtitleStore
+from telethon_uploader import UploadService, UPLOAD_ADAPTIVE, upload_file_adaptive
+from singleflight import SingleFlight, FlightCancelled
+from cancellation import CancelToken, OperationCancelled, on_cancel
+from stream_upload import STREAM_UPLOAD, FragmentedMp4Stream, send_stream
+from app_loop import app_loop
+from http_client import close_session, close_async_session
+import metrics
+import tracing
+from tracing import TraceLog
+from metrics import observe_upload
+from webhook_server import (
+    WebhookServer, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, new_secret,
+)
+from progress_dispatcher import ProgressDispatcher
+from outbox import BotOutbox, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from scheduler import (
+    JobScheduler, FairLimiter,
+    RESOLVE_CONCURRENCY, DOWNLOAD_CONCURRENCY, UPLOAD_CONCURRENCY,
 )
 
 # ——————————————————————————————————————————————————————————————
@@ -39,6 +60,9 @@ DENIED_MESSAGE = (
     "📩 Contact @THe\\_vK\\_3 for access\\!"
 )
 
+# Users allowed to run /stats (comma-separated IDs; nobody by default)
+ADMIN_USERS = {int(x) for x in os.getenv("ADMIN_USERS", "").split(",") if x.strip()}
+
 # ——————————————————————————————————————————————————————————————
 # 1) Load environment variables
 # ——————————————————————————————————————————————————————————————
@@ -77,18 +101,82 @@ selected_anime_title = {}   # chat_id → title (for display)
 # ——————————————————————————————————————————————————————————————
 # 4) Cancellation events (per-chat)
 # ——————————————————————————————————————————————————————————————
-cancel_events = {}          # chat_id → threading.Event()
+cancel_events = {}          # chat_id → CancelToken()
+
+# How many upcoming episodes “Download All” resolves ahead of time, on the
+# shared event loop (results land in the scraper's source cache)
+SOURCE_PREFETCH = int(os.getenv("SOURCE_PREFETCH", "2"))
+
+# ——————————————————————————————————————————————————————————————
+# 4b) Shared, content-addressed video cache (all chats)
+# ——————————————————————————————————————————————————————————————
+video_cache = VideoCache()
+
+
+def episode_cache_key(episode_id: str, subtitle_path: str = None):
+    slug = episode_id.split("?", 1)[0]
+    return video_cache_key(slug, episode_id, STREAM_SERVER, STREAM_CATEGORY,
+                           tracks=SUBTITLE_VARIANT if subtitle_path else None)
+
+# ——————————————————————————————————————————————————————————————
+# 4c) Job scheduler + per-stage limits (fair across chats)
+# ——————————————————————————————————————————————————————————————
+# Taps become persisted jobs, dispatched round-robin across chats; inside a
+# job, each stage waits for a slot of its own bounded, fair limiter.
+scheduler = JobScheduler()
+resolve_limiter = FairLimiter("resolve", RESOLVE_CONCURRENCY)
+download_limiter = FairLimiter("download", DOWNLOAD_CONCURRENCY)
+upload_limiter = FairLimiter("upload", UPLOAD_CONCURRENCY)
+
+
+def enqueue_job(chat_id: int, kind: str, *args):
+    """
+    Queues a job and tells the user where it stands if it has to wait.
+    """
+    job = scheduler.submit(chat_id, kind, *args)
+    position = scheduler.position(job["id"])
+    if position and (position > 1 or scheduler.busy()):
+        msg = bot.send_message(chat_id, f"🕒 Queued – position {position}. It will start automatically.")
+        if msg:
+            scheduler.update_meta(job["id"], queue_msg_id=msg.message_id)
+    return job
+
+
+# ——————————————————————————————————————————————————————————————
+# 4d) Progress-message edits (rate-limited, latest text wins)
+# ——————————————————————————————————————————————————————————————
+# Callbacks only enqueue; one thread edits, started in __main__.
+progress_dispatcher = ProgressDispatcher()
+
+# Outbound Bot API queue; bot methods are routed through it in __main__
+outbox = BotOutbox()
+
+# Per-job trace timelines (traces.jsonl), summarised by /stats
+trace_log = TraceLog()
+
+
+def on_job_start(job):
+    chat_id = job["chat_id"]
+    # fresh cancel token per job; /cancel drops the chat's queued jobs too
+    cancel_events[chat_id] = CancelToken()
+    queue_msg_id = job["meta"].get("queue_msg_id")
+    if queue_msg_id:
+        try:
+            bot.delete_message(chat_id=chat_id, message_id=queue_msg_id)
+        except Exception:
+            pass
 
 # ——————————————————————————————————————————————————————————————
 # 5) /start handler
 # ——————————————————————————————————————————————————————————————
-def start(update: Update, context: CallbackContext):
+async def start(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
 
     # Deny access if user not in ALLOWED_USERS
     if user_id not in ALLOWED_USERS:
-        update.message.reply_text(
+        await app_loop.to_thread(
+            update.message.reply_text,
             DENIED_MESSAGE,
             parse_mode="MarkdownV2",
             disable_web_page_preview=True
@@ -111,7 +199,8 @@ def start(update: Update, context: CallbackContext):
         "☑️ Send `/cancel` at any time to abort an ongoing download\n\n"
         "📩 *Contact @THe\\_vK\\_3 if any problem or Query* "
     )
-    update.message.reply_text(
+    await app_loop.to_thread(
+        update.message.reply_text,
         welcome_text,
         parse_mode="MarkdownV2",
         disable_web_page_preview=True
@@ -120,12 +209,13 @@ def start(update: Update, context: CallbackContext):
 # ——————————————————————————————————————————————————————————————
 # 6) /search handler
 # ——————————————————————————————————————————————————————————————
-def search_command(update: Update, context: CallbackContext):
+async def search_command(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
 
     if user_id not in ALLOWED_USERS:
-        update.message.reply_text(
+        await app_loop.to_thread(
+            update.message.reply_text,
             DENIED_MESSAGE,
             parse_mode="MarkdownV2",
             disable_web_page_preview=True
@@ -133,22 +223,22 @@ def search_command(update: Update, context: CallbackContext):
         return
 
     if len(context.args) == 0:
-        update.message.reply_text("⚠️ Please provide an anime name.\nExample: /search Naruto")
+        await app_loop.to_thread(update.message.reply_text, "⚠️ Please provide an anime name.\nExample: /search Naruto")
         return
 
     query_text = " ".join(context.args).strip()
-    msg = update.message.reply_text(f"🔍 Searching for “{query_text}”…")
+    msg = await app_loop.to_thread(update.message.reply_text, f"🔍 Searching for “{query_text}”…")
 
     try:
-        from hianimez_scraper import search_anime
-        results = search_anime(query_text)
+        from hianimez_scraper import async_search_anime
+        results = await async_search_anime(query_text)
     except Exception as e:
         logger.error(f"Search error: {e}", exc_info=True)
-        msg.edit_text("❌ Search error; please try again later.")
+        await app_loop.to_thread(msg.edit_text, "❌ Search error; please try again later.")
         return
 
     if not results:
-        msg.edit_text(f"No anime found matching “{query_text}.”")
+        await app_loop.to_thread(msg.edit_text, f"No anime found matching “{query_text}.”")
         return
 
     # Store (title, slug) in search_cache
@@ -160,21 +250,22 @@ def search_command(update: Update, context: CallbackContext):
 
     reply_markup = InlineKeyboardMarkup(buttons)
     try:
-        msg.edit_text("Select the anime you want:", reply_markup=reply_markup)
+        await app_loop.to_thread(msg.edit_text, "Select the anime you want:", reply_markup=reply_markup)
     except Exception:
         pass
 
 # ——————————————————————————————————————————————————————————————
 # 7) Callback when user taps an anime button (store the title)
 # ——————————————————————————————————————————————————————————————
-def anime_callback(update: Update, context: CallbackContext):
+async def anime_callback(update: Update, context: CallbackContext):
     query = update.callback_query
     user_id = query.from_user.id
     chat_id = query.message.chat.id
 
     if user_id not in ALLOWED_USERS:
-        query.answer()
-        query.message.reply_text(
+        await app_loop.to_thread(query.answer)
+        await app_loop.to_thread(
+            query.message.reply_text,
             DENIED_MESSAGE,
             parse_mode="MarkdownV2",
             disable_web_page_preview=True
@@ -182,7 +273,7 @@ def anime_callback(update: Update, context: CallbackContext):
         return
 
     try:
-        query.answer()
+        await app_loop.to_thread(query.answer)
     except Exception:
         pass
 
@@ -192,7 +283,7 @@ def anime_callback(update: Update, context: CallbackContext):
         idx = int(idx_str)
     except Exception:
         try:
-            query.edit_message_text("❌ Internal error: invalid anime selection.")
+            await app_loop.to_thread(query.edit_message_text, "❌ Internal error: invalid anime selection.")
         except Exception:
             pass
         return
@@ -200,7 +291,7 @@ def anime_callback(update: Update, context: CallbackContext):
     anime_list = search_cache.get(chat_id, [])
     if idx < 0 or idx >= len(anime_list):
         try:
-            query.edit_message_text("❌ Internal error: anime index out of range.")
+            await app_loop.to_thread(query.edit_message_text, "❌ Internal error: anime index out of range.")
         except Exception:
             pass
         return
@@ -219,7 +310,8 @@ def anime_callback(update: Update, context: CallbackContext):
             .replace(")", "\\)")
             .replace("-", "\\-")
         )
-        query.edit_message_text(
+        await app_loop.to_thread(
+            query.edit_message_text,
             f"🔍 Fetching episodes for *{title_escaped}*…",
             parse_mode="MarkdownV2"
         )
@@ -227,19 +319,19 @@ def anime_callback(update: Update, context: CallbackContext):
         pass
 
     try:
-        from hianimez_scraper import get_episodes_list
-        episodes = get_episodes_list(anime_url)
+        from hianimez_scraper import async_get_episodes_list
+        episodes = await async_get_episodes_list(anime_url)
     except Exception as e:
         logger.error(f"Error fetching episodes: {e}", exc_info=True)
         try:
-            query.edit_message_text("❌ Failed to retrieve episodes for that anime.")
+            await app_loop.to_thread(query.edit_message_text, "❌ Failed to retrieve episodes for that anime.")
         except Exception:
             pass
         return
 
     if not episodes:
         try:
-            query.edit_message_text("No episodes found for that anime.")
+            await app_loop.to_thread(query.edit_message_text, "No episodes found for that anime.")
         except Exception:
             pass
         return
@@ -254,21 +346,22 @@ def anime_callback(update: Update, context: CallbackContext):
 
     reply_markup = InlineKeyboardMarkup(buttons)
     try:
-        query.edit_message_text("Select an episode (or Download All):", reply_markup=reply_markup)
+        await app_loop.to_thread(query.edit_message_text, "Select an episode (or Download All):", reply_markup=reply_markup)
     except Exception:
         pass
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 8a) Callback when user taps a single episode button
 # ──────────────────────────────────────────────────────────────────────────────
-def episode_callback(update: Update, context: CallbackContext):
+async def episode_callback(update: Update, context: CallbackContext):
     query = update.callback_query
     user_id = query.from_user.id
     chat_id = query.message.chat.id
 
     if user_id not in ALLOWED_USERS:
-        query.answer()
-        query.message.reply_text(
+        await app_loop.to_thread(query.answer)
+        await app_loop.to_thread(
+            query.message.reply_text,
             DENIED_MESSAGE,
             parse_mode="MarkdownV2",
             disable_web_page_preview=True
@@ -276,7 +369,7 @@ def episode_callback(update: Update, context: CallbackContext):
         return
 
     try:
-        query.answer()
+        await app_loop.to_thread(query.answer)
     except Exception:
         pass
 
@@ -286,7 +379,7 @@ def episode_callback(update: Update, context: CallbackContext):
         idx = int(idx_str)
     except Exception:
         try:
-            query.edit_message_text("❌ Invalid episode selection.")
+            await app_loop.to_thread(query.edit_message_text, "❌ Invalid episode selection.")
         except Exception:
             pass
         return
@@ -294,7 +387,7 @@ def episode_callback(update: Update, context: CallbackContext):
     ep_list = episode_cache.get(chat_id, [])
     if idx < 0 or idx >= len(ep_list):
         try:
-            query.edit_message_text("❌ Episode index out of range.")
+            await app_loop.to_thread(query.edit_message_text, "❌ Episode index out of range.")
         except Exception:
             pass
         return
@@ -317,38 +410,31 @@ def episode_callback(update: Update, context: CallbackContext):
             "🔢 *Episode:* " + str(ep_num)
         )
         try:
-            query.edit_message_text(details_text, parse_mode="MarkdownV2")
+            await app_loop.to_thread(query.edit_message_text, details_text, parse_mode="MarkdownV2")
         except Exception:
             pass
     else:
         queued_text = f"⏳ Episode {ep_num} queued for download… You’ll receive it shortly."
         try:
-            query.edit_message_text(queued_text)
+            await app_loop.to_thread(query.edit_message_text, queued_text)
         except Exception:
             pass
 
-    # Reset (or create) the cancel event for this chat
-    cancel_events[chat_id] = threading.Event()
-
-    # Start a background thread for download → upload → subtitle
-    thread = threading.Thread(
-        target=download_and_send_episode,
-        args=(chat_id, ep_num, episode_id),
-        daemon=True
-    )
-    thread.start()
+    # Queue download → upload → subtitle on the shared scheduler
+    await app_loop.to_thread(enqueue_job, chat_id, "episode", chat_id, ep_num, episode_id)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 8b) Callback when user taps “Download All”
 # ──────────────────────────────────────────────────────────────────────────────
-def episodes_all_callback(update: Update, context: CallbackContext):
+async def episodes_all_callback(update: Update, context: CallbackContext):
     query = update.callback_query
     user_id = query.from_user.id
     chat_id = query.message.chat.id
 
     if user_id not in ALLOWED_USERS:
-        query.answer()
-        query.message.reply_text(
+        await app_loop.to_thread(query.answer)
+        await app_loop.to_thread(
+            query.message.reply_text,
             DENIED_MESSAGE,
             parse_mode="MarkdownV2",
             disable_web_page_preview=True
@@ -356,14 +442,14 @@ def episodes_all_callback(update: Update, context: CallbackContext):
         return
 
     try:
-        query.answer()
+        await app_loop.to_thread(query.answer)
     except Exception:
         pass
 
     ep_list = episode_cache.get(chat_id, [])
     if not ep_list:
         try:
-            query.edit_message_text("❌ No episodes available to download.")
+            await app_loop.to_thread(query.edit_message_text, "❌ No episodes available to download.")
         except Exception:
             pass
         return
@@ -384,58 +470,118 @@ def episodes_all_callback(update: Update, context: CallbackContext):
             "🔢 *Episode:* All"
         )
         try:
-            query.edit_message_text(all_text, parse_mode="MarkdownV2")
+            await app_loop.to_thread(query.edit_message_text, all_text, parse_mode="MarkdownV2")
         except Exception:
             pass
     else:
         queued_all_text = "⏳ Queued all episodes for download… You’ll receive them one by one."
         try:
-            query.edit_message_text(queued_all_text)
+            await app_loop.to_thread(query.edit_message_text, queued_all_text)
         except Exception:
             pass
 
-    # Reset (or create) the cancel event for this chat
-    cancel_events[chat_id] = threading.Event()
-
-    thread = threading.Thread(
-        target=download_and_send_all_episodes,
-        args=(chat_id, ep_list),
-        daemon=True
-    )
-    thread.start()
+    await app_loop.to_thread(enqueue_job, chat_id, "all", chat_id, ep_list)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 9) /cancel handler
 # ──────────────────────────────────────────────────────────────────────────────
-def cancel_command(update: Update, context: CallbackContext):
+async def cancel_command(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
     event = cancel_events.get(chat_id)
-    if event:
-        event.set()
-        update.message.reply_text("❌ All ongoing operations have been cancelled.")
+    # rewrites the persisted queue: keep the file I/O off the loop
+    dropped = await app_loop.to_thread(scheduler.cancel_chat, chat_id)
+    for job in dropped:
+        queue_msg_id = job["meta"].get("queue_msg_id")
+        if queue_msg_id:
+            try:
+                await app_loop.to_thread(bot.delete_message, chat_id=chat_id, message_id=queue_msg_id)
+            except Exception:
+                pass
+    if event or dropped:
+        if event:
+            event.set()
+        await app_loop.to_thread(update.message.reply_text, "❌ All ongoing operations have been cancelled.")
     else:
-        update.message.reply_text("ℹ️ There was nothing to cancel.")
+        await app_loop.to_thread(update.message.reply_text, "ℹ️ There was nothing to cancel.")
 
 # ──────────────────────────────────────────────────────────────────────────────
-# 10) Helper: Telethon upload with real‐time progress → send as “document”
+# 9b) /stats handler (admins only): stage timings over the last N jobs
 # ──────────────────────────────────────────────────────────────────────────────
-async def telethon_send_with_progress(chat_id: int, file_path: str, caption: str, status_message_id: int):
-    session_name = f"telethon_bot_session_{chat_id}"
-    client = TelegramClient(session_name, int(TELETHON_API_ID), TELETHON_API_HASH)
+STATS_DEFAULT_JOBS = 50
+
+
+def _fmt_seconds(value):
+    if value is None:
+        return "–"
+    return f"{value:.1f}s" if value < 120 else f"{int(value // 60)}m{int(value % 60):02d}s"
+
+
+def format_stats(last_n: int) -> str:
+    summary = trace_log.summary(last_n)
+    lines = [
+        f"Last {summary['jobs']} jobs ({summary['failed']} failed), "
+        f"p50 {_fmt_seconds(summary['job_p50'])}, p95 {_fmt_seconds(summary['job_p95'])}",
+        "",
+        f"{'stage':<9}{'n':>5}{'fail':>5}{'p50':>9}{'p95':>9}{'MB/s':>7}",
+    ]
+    for name in ("resolve", "probe", "download", "remux", "stream", "upload", "subtitle"):
+        st = summary["stages"].get(name)
+        if not st:
+            continue
+        mbps = f"{st['mbps_p50']:.1f}" if st["mbps_p50"] is not None else "–"
+        lines.append(
+            f"{name:<9}{st['count']:>5}{st['failed']:>5}"
+            f"{_fmt_seconds(st['p50']):>9}{_fmt_seconds(st['p95']):>9}{mbps:>7}"
+        )
+    if summary["tiers"]:
+        lines += ["", "tiers: " + ", ".join(f"{k} ×{v}" for k, v in sorted(summary["tiers"].items()))]
+    tuned = upload_service.tuner.stats()
+    if tuned:
+        lines += ["", f"{'tuning':<9}{'part':>7}{'par':>5}{'MB/s':>7}{'n':>5}"]
+        for bucket, best in tuned.items():
+            part = f"{best['part_kb']}K" if "part_kb" in best else "–"
+            mbps = f"{best['mbps']:.1f}" if "mbps" in best else "–"
+            lines.append(f"{bucket:<9}{part:>7}{best.get('parallel', '–'):>5}{mbps:>7}{best['uploads']:>5}")
+    sched = scheduler.stats()
+    depth = outbox.stats()["depth"]
+    lines += [
+        "",
+        f"jobs running {sched['running']}, queued {sched['queued']}; "
+        f"Bot API queue {sum(depth.values())}",
+    ]
+    return "<pre>" + html.escape("\n".join(lines)) + "</pre>"
+
+
+async def stats_command(update: Update, context: CallbackContext):
+    if update.effective_user.id not in ADMIN_USERS:
+        await app_loop.to_thread(update.message.reply_text, "🚫 /stats is for admins only.")
+        return
     try:
-        await client.start(bot_token=BOT_TOKEN)
+        last_n = max(1, int(context.args[0])) if context.args else STATS_DEFAULT_JOBS
+    except ValueError:
+        last_n = STATS_DEFAULT_JOBS
+    await app_loop.to_thread(update.message.reply_text, format_stats(last_n), parse_mode="HTML")
 
-        total_bytes = os.path.getsize(file_path)
+# ──────────────────────────────────────────────────────────────────────────────
+# 10) Helper: Telethon upload with real‐time progress → send as “document”
+# ──────────────────────────────────────────────────────────────────────────────
+# One long-lived, logged-in Telethon client on the shared event loop, used
+# by every upload (started on first use).
+upload_service = UploadService(TELETHON_API_ID, TELETHON_API_HASH, BOT_TOKEN)
+
+
+async def telethon_send_with_progress(client, chat_id: int, file_path: str, caption: str, status_message_id: int,
+                                      on_progress_text=None):
+    """
+    Runs on the upload service loop with its shared `client`.
+    Progress goes to `status_message_id`, or to `on_progress_text(text)`
+    when given. Returns the sent Telethon Message, or None if the upload failed.
+    """
+    try:
         start_time = time.time()
-        last_upd = 0.0
 
         def progress_callback(uploaded_bytes: int, total_bytes_inner: int):
-            nonlocal last_upd
             now = time.time()
-            if now - last_upd < 3.0:
-                return
-            last_upd = now
-
             elapsed = now - start_time
             uploaded_mb = uploaded_bytes / (1024 * 1024)
             total_mb = total_bytes_inner / (1024 * 1024)
@@ -462,79 +608,428 @@ async def telethon_send_with_progress(chat_id: int, file_path: str, caption: str
                 f"⏳ETA: {eta_str}\n"
                 f"📈Progress: {percent:.1f}%"
             )
-            try:
-                bot.edit_message_text(
-                    text=text,
-                    chat_id=chat_id,
-                    message_id=status_message_id,
-                    parse_mode="HTML",
-                )
-            except Exception:
-                pass
-
-        await client.send_file(
+            # non-blocking: never stalls the shared upload loop
+            if on_progress_text is not None:
+                on_progress_text(text)
+            else:
+                progress_dispatcher.update(chat_id, status_message_id, text)
+
+        if UPLOAD_ADAPTIVE:
+            # tuned part size + parallel in-flight parts, then send the handle
+            file = await upload_file_adaptive(client, file_path, upload_service.tuner, progress_callback)
+            observe_upload("adaptive", os.path.getsize(file_path), time.time() - start_time)
+            return await client.send_file(
+                entity=chat_id,
+                file=file,
+                caption=caption,
+                force_document=True,
+            )
+        sent = await client.send_file(
             entity=chat_id,
             file=file_path,
             caption=caption,
             force_document=True,
             progress_callback=progress_callback,
-            part_size_kb=2048,
-            max_connections=16,
         )
+        observe_upload("send_file", os.path.getsize(file_path), time.time() - start_time)
+        return sent
     except Exception as e:
         logger.error(f"[Telethon] Failed to send {file_path} to chat {chat_id}: {e}", exc_info=True)
-    finally:
-        await client.disconnect()
+        return None
+
+def send_file_via_telethon_with_progress(chat_id: int, file_path: str, caption: str, status_message_id: int,
+                                        on_progress_text=None, cancel=None):
+    """
+    Blocking upload through the upload service. Returns the sent message or
+    None; raises OperationCancelled when `cancel` fires, which cancels the
+    Telethon upload task itself.
+    """
+    try:
+        future = upload_service.submit(
+            telethon_send_with_progress,
+            chat_id=chat_id,
+            file_path=file_path,
+            caption=caption,
+            status_message_id=status_message_id,
+            on_progress_text=on_progress_text,
+        )
+        with on_cancel(cancel, future.cancel):
+            return future.result()
+    except concurrent.futures.CancelledError:
+        raise OperationCancelled(f"upload of {file_path} cancelled") from None
+    except Exception as e:
+        logger.error(f"[Telethon sync] Exception while sending {file_path} to chat {chat_id}: {e}", exc_info=True)
+        return None
+
+# ──────────────────────────────────────────────────────────────────────────────
+# 10b) Re-send already uploaded media by reference (zero bytes uploaded)
+# ──────────────────────────────────────────────────────────────────────────────
+media_refs = MediaRefStore()
+# Shared .vtt files (ETag-revalidated, size-bounded)
+subtitle_store = SubtitleStore()
+
+VIDEO_VARIANT = f"{STREAM_SERVER}-{STREAM_CATEGORY}-mp4"
+SUBTITLE_VARIANT = "eng-vtt"
+# the MP4 with the subtitle muxed in (SOFT_SUBS)
+SOFT_SUB_VARIANT = f"{VIDEO_VARIANT}+{SUBTITLE_VARIANT}"
+
+
+def video_variant(subtitle_path: str = None) -> str:
+    return SOFT_SUB_VARIANT if subtitle_path else VIDEO_VARIANT
+
+
+def send_by_reference(chat_id: int, episode_id: str, variant: str, caption: str) -> bool:
+    """
+    If this (episode, variant) was delivered before, copy that message (or
+    re-send its file_id) to `chat_id`. Returns False if there is no usable
+    reference; a stale one is forgotten.
+    """
+    ref = media_refs.get(episode_id, variant)
+    if not ref:
+        return False
+    try:
+        bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=ref["chat_id"],
+            message_id=ref["message_id"],
+            caption=caption,
+        )
+        return True
+    except Exception as e:
+        logger.info(f"copy_message for {episode_id} ({variant}) failed: {e}")
+    if ref.get("file_id"):
+        try:
+            bot.send_document(chat_id=chat_id, document=ref["file_id"], caption=caption)
+            return True
+        except Exception as e:
+            logger.info(f"Re-send by file_id for {episode_id} ({variant}) failed: {e}")
+    media_refs.forget(episode_id, variant)
+    return False
+
+
+def remember_uploaded_video(episode_id: str, msg, variant: str = VIDEO_VARIANT):
+    """
+    Stores the Telethon message returned by send_file() for later reuse.
+    """
+    try:
+        file_id = pack_bot_file_id(msg.media)
+    except Exception:
+        file_id = None
+    media_refs.put(episode_id, variant, msg.chat_id, msg.id, file_id)
+
+
+def soft_subtitle_path(episode_id: str, subtitle_url: str):
+    """
+    With SOFT_SUBS, the shared .vtt to mux into the episode's MP4 as a
+    mov_text track, so video and subtitle go out as one upload. None means
+    the subtitle (if any) is sent as a separate document, as without it.
+    """
+    if not (SOFT_SUBS and subtitle_url):
+        return None
+    try:
+        path = subtitle_store.fetch(subtitle_url, episode_id)
+        with open(path, "rb") as fh:
+            head = fh.read(16)
+    except Exception as e:
+        logger.warning(f"Subtitle for {episode_id} unavailable, not muxing it: {e}")
+        return None
+    # an error page would make every remux tier fail
+    if not head.lstrip(b"\xef\xbb\xbf").startswith(b"WEBVTT"):
+        logger.warning(f"Subtitle for {episode_id} is not WebVTT, not muxing it")
+        return None
+    return path
+
+
+def prefetch_subtitle(episode_id: str, subtitle_url: str):
+    """
+    Starts fetching the .vtt into the shared store alongside the video, so
+    it is ready when the MP4 upload ends. No-op if it can go by reference.
+    """
+    if subtitle_url and not media_refs.has(episode_id, SUBTITLE_VARIANT):
+        subtitle_store.prefetch(subtitle_url, episode_id)
+
+
+def send_subtitle(chat_id: int, ep_num: str, episode_id: str, subtitle_url: str) -> bool:
+    """
+    Sends the .vtt for an episode, by reference if it was sent before,
+    otherwise from the shared subtitle store, remembering the file_id.
+    """
+    with tracing.span("subtitle", ep=ep_num) as sp:
+        sp["ok"] = _send_subtitle(chat_id, ep_num, episode_id, subtitle_url)
+        return sp["ok"]
+
+
+def _send_subtitle(chat_id, ep_num, episode_id, subtitle_url):
+    caption = f"Here is the subtitle for Episode {ep_num}"
+    if send_by_reference(chat_id, episode_id, SUBTITLE_VARIANT, caption):
+        return True
 
-def send_file_via_telethon_with_progress(chat_id: int, file_path: str, caption: str, status_message_id: int):
     try:
-        asyncio.run(
-            telethon_send_with_progress(
+        # joins the prefetch if it is still running
+        local_vtt = subtitle_store.fetch(subtitle_url, episode_id)
+    except Exception as e:
+        logger.error(f"[Thread] Error downloading subtitle (Episode {ep_num}): {e}", exc_info=True)
+        bot.send_message(chat_id, f"⚠️ Found a subtitle URL but failed to download for Episode {ep_num}.")
+        return False
+
+    status_sub = bot.send_message(chat_id, f"✅ Subtitle downloaded as “Episode {ep_num}.vtt.”")
+    try:
+        with open(local_vtt, "rb") as fh:
+            sent = bot.send_document(
+                chat_id=chat_id,
+                document=InputFile(fh, filename=f"Episode {ep_num}.vtt"),
+                caption=caption
+            )
+        if sent is not None and sent.document:
+            media_refs.put(episode_id, SUBTITLE_VARIANT, sent.chat_id, sent.message_id, sent.document.file_id)
+    except Exception as e:
+        logger.error(f"[Thread] Error sending subtitle (Episode {ep_num}): {e}", exc_info=True)
+        bot.send_message(chat_id, f"⚠️ Could not send subtitle for Episode {ep_num}.")
+        return False
+
+    if status_sub:
+        try:
+            bot.delete_message(chat_id=chat_id, message_id=status_sub.message_id)
+        except Exception:
+            pass
+    return True
+
+# ──────────────────────────────────────────────────────────────────────────────
+# 10c) Coalesced resolve / download / upload (one chain per episode)
+# ──────────────────────────────────────────────────────────────────────────────
+# Identical work requested by several chats at once runs once: the first
+# job leads, the others follow its progress and reuse its file / message.
+resolve_flight = SingleFlight("resolve")
+download_flight = SingleFlight("download")
+upload_flight = SingleFlight("upload")
+
+
+def resolve_episode(chat_id: int, episode_id: str):
+    """
+    Returns (hls_link, subtitle_url).
+    """
+    from hianimez_scraper import async_extract_episode_stream_and_subtitle
+
+    def _resolve(report, cancel):
+        with resolve_limiter.slot(chat_id):
+            return app_loop.run(async_extract_episode_stream_and_subtitle(episode_id))
+
+    with tracing.span("resolve", episode=episode_id):
+        return resolve_flight.do(episode_id, _resolve)[0]
+
+
+def fetch_episode_video(chat_id: int, ep_num: str, episode_id: str, hls_link: str, cache_key: str,
+                        progress_cb, cancel_event, subtitle_path: str = None):
+    """
+    Downloads the episode into the shared cache (or waits for the chat that
+    already is) and returns the file path, pinned for this caller. The
+    cache key must match `subtitle_path` (episode_cache_key).
+    """
+    def _download(report, cancel):
+        with download_limiter.slot(chat_id, cancel_event) as granted:
+            if not granted:
+                raise FlightCancelled("cancelled while waiting for a download slot")
+            path, _ = video_cache.fetch(
+                cache_key,
+                lambda entry_dir: download_and_rename_video(
+                    hls_link,
+                    ep_num,
+                    cache_dir=entry_dir,
+                    progress_callback=report,
+                    cancel=cancel,
+                    subtitle_path=subtitle_path,
+                ),
+                meta={"episode_id": episode_id, "ep_num": ep_num},
+            )
+            return path
+
+    path, leader = download_flight.do(cache_key, _download, on_progress=progress_cb, cancel_event=cancel_event)
+    if leader:
+        return path
+    # the leader's pin is its own; take ours
+    path = video_cache.acquire(cache_key)
+    if path is None:
+        raise RuntimeError(f"shared download of Episode {ep_num} is no longer cached")
+    return path
+
+
+def deliver_episode_video(chat_id: int, ep_num: str, episode_id: str, file_path: str,
+                          status_message_id: int, cancel_event, subtitle_path: str = None):
+    """
+    Uploads the episode to `chat_id`. If another chat is uploading it right
+    now, waits for that upload and copies the resulting message instead.
+    `subtitle_path` says the file has the subtitle muxed in. Raises on failure.
+    """
+    caption = f"Episode {ep_num}.mp4"
+    variant = video_variant(subtitle_path)
+
+    def _show_progress(text):
+        progress_dispatcher.update(chat_id, status_message_id, text)
+
+    def _upload(report, cancel):
+        with upload_limiter.slot(chat_id, cancel_event) as granted:
+            if not granted:
+                raise FlightCancelled("cancelled while waiting for an upload slot")
+            sent = send_file_via_telethon_with_progress(
                 chat_id=chat_id,
                 file_path=file_path,
                 caption=caption,
                 status_message_id=status_message_id,
+                on_progress_text=report,
+                cancel=cancel,
             )
-        )
+        if sent is None:
+            raise RuntimeError("Telethon upload returned no message")
+        remember_uploaded_video(episode_id, sent, variant)
+
+    with tracing.span("upload", ep=ep_num, bytes=os.path.getsize(file_path)) as sp:
+        _, leader = upload_flight.do((episode_id, variant), _upload, on_progress=_show_progress,
+                                     cancel_event=cancel_event)
+        sp["shared"] = not leader
+    if not leader and not send_by_reference(chat_id, episode_id, variant, caption):
+        raise RuntimeError(f"could not copy the shared upload of Episode {ep_num}")
+
+
+def stream_episode_video(chat_id: int, ep_num: str, episode_id: str, hls_link: str,
+                         status_message_id: int, cancel_event):
+    """
+    Streaming mode: remux to fragmented MP4 through a pipe and upload the
+    pieces while ffmpeg produces them, so nothing is staged on disk. Shares
+    the upload flight with deliver_episode_video(). Raises on failure.
+    """
+    caption = f"Episode {ep_num}.mp4"
+
+    def _show_progress(text):
+        progress_dispatcher.update(chat_id, status_message_id, text)
+
+    def _stream(report, cancel):
+        # latest remux figures and bytes uploaded; the upload trails the remux
+        # by up to the ring buffer, and keeps going after ffmpeg is done
+        state = {"remux": (0.0, 0.0, 0.0, 0.0, None), "uploaded": 0}
+
+        def _render():
+            downloaded_mb, percent, speed_mb_s, elapsed_s, eta_s = state["remux"]
+            elapsed_str = f"{int(elapsed_s//60)}m {int(elapsed_s%60)}s"
+            eta_str = f"{int(eta_s//60)}m {int(eta_s%60)}s" if (eta_s is not None and eta_s > 0) else "–"
+            report(
+                f"📡 <b>Streaming Episode {ep_num}</b>\n\n"
+                f"📊Size: {downloaded_mb:.2f} MB\n"
+                f"📤Uploaded: {state['uploaded'] / (1024 * 1024):.2f} MB\n"
+                f"⚡️Speed: {speed_mb_s:.2f} MB/s\n"
+                f"⏱️Time Elapsed: {elapsed_str}\n"
+                f"⏳ETA: {eta_str}\n"
+                f"📈Progress: {percent:.1f}%"
+            )
+
+        def progress_cb(downloaded_mb, total_duration_s, percent, speed_mb_s, elapsed_s, eta_s):
+            state["remux"] = (downloaded_mb, percent, speed_mb_s, elapsed_s, eta_s)
+            _render()
+
+        def upload_cb(uploaded_bytes, total_bytes):
+            state["uploaded"] = uploaded_bytes
+            _render()
+
+        with download_limiter.slot(chat_id, cancel_event) as granted:
+            if not granted:
+                raise FlightCancelled("cancelled while waiting for a download slot")
+            with upload_limiter.slot(chat_id, cancel_event) as granted:
+                if not granted:
+                    raise FlightCancelled("cancelled while waiting for an upload slot")
+                stream = FragmentedMp4Stream(hls_link, progress_callback=progress_cb).start()
+                upload = upload_service.submit(send_stream, chat_id, stream, caption, caption,
+                                               progress_callback=upload_cb)
+                # kill ffmpeg and the segment feed, and abort the upload task
+                with on_cancel(cancel, stream.cancel), on_cancel(cancel, upload.cancel):
+                    try:
+                        sent = upload.result()
+                    except concurrent.futures.CancelledError:
+                        raise OperationCancelled(f"streaming Episode {ep_num} cancelled") from None
+                span_attrs["bytes"] = stream.buffer.total_written
+        remember_uploaded_video(episode_id, sent)
+
+    with tracing.span("stream", ep=ep_num) as span_attrs:
+        _, leader = upload_flight.do((episode_id, VIDEO_VARIANT), _stream, on_progress=_show_progress,
+                                     cancel_event=cancel_event)
+        span_attrs["shared"] = not leader
+    if not leader and not send_by_reference(chat_id, episode_id, VIDEO_VARIANT, caption):
+        raise RuntimeError(f"could not copy the shared upload of Episode {ep_num}")
+
+
+def try_stream_episode(chat_id: int, ep_num: str, episode_id: str, hls_link: str, cancel_event) -> bool:
+    """
+    stream_episode_video() with its own status message. False means the
+    caller should fall back to download-then-upload (unless cancelled).
+    """
+    status_stream = bot.send_message(chat_id, f"📡 Streaming Episode {ep_num}...\nProgress: 0%")
+    try:
+        stream_episode_video(chat_id, ep_num, episode_id, hls_link, status_stream.message_id, cancel_event)
+        return True
     except Exception as e:
-        logger.error(f"[Telethon sync] Exception while sending {file_path} to chat {chat_id}: {e}", exc_info=True)
+        logger.warning(f"Streaming Episode {ep_num} failed, falling back to download: {e}")
+        return False
+    finally:
+        try:
+            bot.delete_message(chat_id=chat_id, message_id=status_stream.message_id)
+        except Exception:
+            pass
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 11) Background task for sending a single episode (download → upload → subtitle)
 # ──────────────────────────────────────────────────────────────────────────────
+@trace_log.job("episode")
 def download_and_send_episode(chat_id: int, ep_num: str, episode_id: str):
     cancel_event = cancel_events.get(chat_id)
     if cancel_event and cancel_event.is_set():
         return
 
-    from hianimez_scraper import extract_episode_stream_and_subtitle
     try:
-        hls_link, subtitle_url = extract_episode_stream_and_subtitle(episode_id)
+        hls_link, subtitle_url = resolve_episode(chat_id, episode_id)
     except Exception as e:
         logger.error(f"[Thread] Error extracting Episode {ep_num}: {e}", exc_info=True)
+        tracing.fail(f"resolve failed for episode {ep_num}")
         bot.send_message(chat_id, f"❌ Failed to extract data for Episode {ep_num}.")
         return
 
+    # SOFT_SUBS: the subtitle travels inside the MP4, otherwise it is sent after it
+    soft_sub = soft_subtitle_path(episode_id, subtitle_url)
+    if soft_sub is None:
+        prefetch_subtitle(episode_id, subtitle_url)
+
+    # Already delivered to some chat → re-send by reference, nothing uploaded
+    if send_by_reference(chat_id, episode_id, video_variant(soft_sub), f"Episode {ep_num}.mp4"):
+        if subtitle_url and not soft_sub:
+            send_subtitle(chat_id, ep_num, episode_id, subtitle_url)
+        return
+
     if not hls_link:
+        tracing.fail(f"no stream for episode {ep_num}")
         bot.send_message(chat_id, f"😔 Could not find a SUB-HD2 video stream for Episode {ep_num}.")
         return
 
-    video_cache_dir = os.path.join("videos_cache", str(chat_id))
-    subtitle_cache_dir = os.path.join("subtitles_cache", str(chat_id))
-    os.makedirs(video_cache_dir, exist_ok=True)
-    os.makedirs(subtitle_cache_dir, exist_ok=True)
+    # Shared cache hit → straight to upload
+    cache_key = episode_cache_key(episode_id, soft_sub)
+    raw_mp4 = video_cache.acquire(cache_key)
 
-    status_download = bot.send_message(chat_id, "📥 Downloading File\nProgress: 0%")
-    last_dl_update = [0.0]
+    # Not on disk: in streaming mode remux straight into the upload (not with
+    # a soft subtitle: fragmented MP4 loses the mov_text cue durations)
+    if raw_mp4 is None and STREAM_UPLOAD and not soft_sub:
+        if try_stream_episode(chat_id, ep_num, episode_id, hls_link, cancel_event):
+            if subtitle_url:
+                send_subtitle(chat_id, ep_num, episode_id, subtitle_url)
+            else:
+                bot.send_message(chat_id, "❗ No English subtitle (.vtt) found.")
+            return
+        if cancel_event and cancel_event.is_set():
+            bot.send_message(chat_id, f"❌ Download of Episode {ep_num} cancelled.")
+            return
+
+    status_download = None
+    if raw_mp4 is None:
+        status_download = bot.send_message(chat_id, "📥 Downloading File\nProgress: 0%")
 
     def download_progress_cb(downloaded_mb, total_duration_s, percent, speed_mb_s, elapsed_s, eta_s):
         if cancel_event and cancel_event.is_set():
             return
-        now = time.time()
-        if now - last_dl_update[0] < 3.0:
-            return
-        last_dl_update[0] = now
-
         elapsed_str = f"{int(elapsed_s//60)}m {int(elapsed_s%60)}s"
         eta_str = (
             f"{int(eta_s//60)}m {int(eta_s%60)}s"
@@ -550,23 +1045,14 @@ def download_and_send_episode(chat_id: int, ep_num: str, episode_id: str):
             f"⏳ETA: {eta_str}\n"
             f"📈Progress: {percent:.1f}%"
         )
-        try:
-            bot.edit_message_text(
-                text=text,
-                chat_id=chat_id,
-                message_id=status_download.message_id,
-                parse_mode="HTML",
-            )
-        except Exception:
-            pass
+        progress_dispatcher.update(chat_id, status_download.message_id, text)
 
     try:
-        raw_mp4 = download_and_rename_video(
-            hls_link,
-            ep_num,
-            cache_dir=video_cache_dir,
-            progress_callback=download_progress_cb
-        )
+        if raw_mp4 is None:
+            raw_mp4 = fetch_episode_video(
+                chat_id, ep_num, episode_id, hls_link, cache_key, download_progress_cb, cancel_event,
+                soft_sub,
+            )
     except Exception as e:
         logger.error(f"[Thread] Error downloading video (Episode {ep_num}): {e}", exc_info=True)
         try:
@@ -578,50 +1064,30 @@ def download_and_send_episode(chat_id: int, ep_num: str, episode_id: str):
             bot.send_message(chat_id, f"❌ Download of Episode {ep_num} cancelled.")
             return
 
+        tracing.fail(f"download failed for episode {ep_num}")
         bot.send_message(
             chat_id,
             f"⚠️ Failed to convert Episode {ep_num} to MP4. Here’s the HLS link instead:\n\n{hls_link}"
         )
         if subtitle_url:
-            try:
-                local_vtt = download_and_rename_subtitle(subtitle_url, ep_num, cache_dir=subtitle_cache_dir)
-                status_sub = bot.send_message(chat_id, f"✅ Subtitle downloaded as “Episode {ep_num}.vtt”.")
-                bot.send_document(
-                    chat_id=chat_id,
-                    document=InputFile(open(local_vtt, "rb"), filename=f"Episode {ep_num}.vtt"),
-                    caption=f"Here is the subtitle for Episode {ep_num}"
-                )
-                os.remove(local_vtt)
-                try:
-                    bot.delete_message(chat_id=chat_id, message_id=status_sub.message_id)
-                except Exception:
-                    pass
-            except Exception as se:
-                logger.error(f"[Thread] Error sending subtitle (Episode {ep_num}): {se}", exc_info=True)
-                bot.send_message(chat_id, f"⚠️ Could not download/send subtitle for Episode {ep_num}.")
+            send_subtitle(chat_id, ep_num, episode_id, subtitle_url)
         return
 
-    try:
-        bot.delete_message(chat_id=chat_id, message_id=status_download.message_id)
-    except Exception:
-        pass
+    if status_download:
+        try:
+            bot.delete_message(chat_id=chat_id, message_id=status_download.message_id)
+        except Exception:
+            pass
 
     if cancel_event and cancel_event.is_set():
         bot.send_message(chat_id, f"❌ Download of Episode {ep_num} was cancelled before upload.")
-        try:
-            os.remove(raw_mp4)
-        except OSError:
-            pass
+        video_cache.release(cache_key)
         return
 
     status_upload = bot.send_message(chat_id, "📤 Uploading File\nProgress: 0%")
     try:
-        send_file_via_telethon_with_progress(
-            chat_id=chat_id,
-            file_path=raw_mp4,
-            caption=f"Episode {ep_num}.mp4",
-            status_message_id=status_upload.message_id
-        )
+        deliver_episode_video(chat_id, ep_num, episode_id, raw_mp4, status_upload.message_id, cancel_event,
+                              soft_sub)
     except Exception as e:
         logger.error(f"[Thread] Telethon upload failed for Episode {ep_num}: {e}", exc_info=True)
         try:
@@ -631,41 +1097,17 @@ def download_and_send_episode(chat_id: int, ep_num: str, episode_id: str):
 
         if cancel_event and cancel_event.is_set():
             bot.send_message(chat_id, f"❌ Upload of Episode {ep_num} cancelled.")
-            try:
-                os.remove(raw_mp4)
-            except OSError:
-                pass
             return
 
+        tracing.fail(f"upload failed for episode {ep_num}")
         bot.send_message(chat_id, f"⚠️ Could not send Episode {ep_num} via Telethon. Here’s the HLS link:\n\n{hls_link}")
-        try:
-            os.remove(raw_mp4)
-        except OSError:
-            pass
 
         if subtitle_url:
-            try:
-                local_vtt = download_and_rename_subtitle(subtitle_url, ep_num, cache_dir=subtitle_cache_dir)
-                status_sub = bot.send_message(chat_id, f"✅ Subtitle downloaded as “Episode {ep_num}.vtt.”")
-                bot.send_document(
-                    chat_id=chat_id,
-                    document=InputFile(open(local_vtt, "rb"), filename=f"Episode {ep_num}.vtt"),
-                    caption=f"Here is the subtitle for Episode {ep_num}"
-                )
-                os.remove(local_vtt)
-                try:
-                    bot.delete_message(chat_id=chat_id, message_id=status_sub.message_id)
-                except Exception:
-                    pass
-            except Exception as se:
-                logger.error(f"[Thread] Error sending subtitle (Episode {ep_num}): {se}", exc_info=True)
-                bot.send_message(chat_id, f"⚠️ Could not download/send subtitle for Episode {ep_num}.")
+            send_subtitle(chat_id, ep_num, episode_id, subtitle_url)
         return
     finally:
-        try:
-            os.remove(raw_mp4)
-        except OSError:
-            pass
+        # unpin; the file stays in the shared cache for the next request
+        video_cache.release(cache_key)
 
     try:
         bot.delete_message(chat_id=chat_id, message_id=status_upload.message_id)
@@ -676,243 +1118,366 @@ def download_and_send_episode(chat_id: int, ep_num: str, episode_id: str):
         bot.send_message(chat_id, "❗ No English subtitle (.vtt) found.")
         return
 
+    if soft_sub:
+        return      # already in the MP4
+
     if cancel_events.get(chat_id, threading.Event()).is_set():
         bot.send_message(chat_id, f"❌ Subtitle download for Episode {ep_num} cancelled.")
         return
 
-    try:
-        local_vtt = download_and_rename_subtitle(subtitle_url, ep_num, cache_dir=subtitle_cache_dir)
-    except Exception as e:
-        logger.error(f"[Thread] Error downloading subtitle (Episode {ep_num}): {e}", exc_info=True)
-        bot.send_message(chat_id, f"⚠️ Found a subtitle URL but failed to download for Episode {ep_num}.")
-        return
-
-    status_sub = bot.send_message(chat_id, f"✅ Subtitle downloaded as “Episode {ep_num}.vtt.”")
-    try:
-        bot.send_document(
-            chat_id=chat_id,
-            document=InputFile(open(local_vtt, "rb"), filename=f"Episode {ep_num}.vtt"),
-            caption=f"Here is the subtitle for Episode {ep_num}"
-        )
-    except Exception as e:
-        logger.error(f"[Thread] Error sending subtitle (Episode {ep_num}): {e}", exc_info=True)
-        bot.send_message(chat_id, f"⚠️ Could not send subtitle for Episode {ep_num}.")
-    finally:
-        try:
-            os.remove(local_vtt)
-        except OSError:
-            pass
-
-    try:
-        bot.delete_message(chat_id=chat_id, message_id=status_sub.message_id)
-    except Exception:
-        pass
+    send_subtitle(chat_id, ep_num, episode_id, subtitle_url)
 
 # ──────────────────────────────────────────────────────────────────────────────
-# 12) Background task for “Download All” episodes
+# 12) Background task for “Download All” episodes (pipelined)
 # ──────────────────────────────────────────────────────────────────────────────
+# Episodes downloaded ahead of the one being uploaded, and the disk they may
+# occupy while waiting (at least one is always allowed)
+DOWNLOAD_ALL_PREFETCH = int(os.getenv("DOWNLOAD_ALL_PREFETCH", "2"))
+DOWNLOAD_ALL_DISK_BUDGET = int(os.getenv("DOWNLOAD_ALL_DISK_BUDGET", str(4 * 1024 ** 3)))   # 4 GiB
+
+
+@trace_log.job("all")
 def download_and_send_all_episodes(chat_id: int, ep_list: list):
+    """
+    Producer/consumer pipeline: a producer thread resolves and downloads
+    episodes into a bounded queue while this thread uploads them (with
+    subtitles) in order, so the download of episode N+1 overlaps the upload
+    of episode N. The chat's cancel event stops both sides.
+    """
     cancel_event = cancel_events.get(chat_id)
+    stop = threading.Event()            # consumer gave up → producer stops too
 
-    from hianimez_scraper import extract_episode_stream_and_subtitle
+    def cancelled():
+        return stop.is_set() or (cancel_event is not None and cancel_event.is_set())
 
-    video_cache_dir = os.path.join("videos_cache", str(chat_id))
-    subtitle_cache_dir = os.path.join("subtitles_cache", str(chat_id))
-    os.makedirs(video_cache_dir, exist_ok=True)
-    os.makedirs(subtitle_cache_dir, exist_ok=True)
+    ready = queue.Queue(maxsize=max(1, DOWNLOAD_ALL_PREFETCH))
+    budget = threading.Condition()
+    pending_bytes = [0]                 # downloaded, pinned and not yet uploaded
 
-    for ep_num, episode_id in ep_list:
-        if cancel_event and cancel_event.is_set():
-            bot.send_message(chat_id, f"❌ Download‐All cancelled at Episode {ep_num}.")
+    def put(item):
+        while not cancelled():
+            try:
+                ready.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    trace = tracing.current()
+
+    def producer():
+        try:
+            with tracing.activate(trace):
+                _produce_episodes(chat_id, ep_list, cancel_event, cancelled, put, budget, pending_bytes)
+        except Exception as e:
+            logger.error(f"[Pipeline] Producer for chat {chat_id} crashed: {e}", exc_info=True)
+            if trace is not None:
+                trace.fail("producer crashed")
+        finally:
+            # end-of-stream; blocks only until the consumer drains or cancels
+            while True:
+                try:
+                    ready.put(None, timeout=0.5)
+                    break
+                except queue.Full:
+                    if stop.is_set():
+                        break
+
+    producer_thread = threading.Thread(target=producer, name=f"download-all-{chat_id}", daemon=True)
+    producer_thread.start()
+
+    try:
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+            _upload_pipeline_item(chat_id, item, cancel_event)
+            if item.get("cache_key"):
+                video_cache.release(item["cache_key"])
+                with budget:
+                    pending_bytes[0] -= item["size"]
+                    budget.notify_all()
+            if cancel_event and cancel_event.is_set():
+                bot.send_message(chat_id, f"❌ Download‐All cancelled after Episode {item['ep_num']}.")
+                break
+    finally:
+        stop.set()
+        with budget:
+            budget.notify_all()
+        producer_thread.join()
+        # unpin whatever was downloaded but never uploaded
+        while True:
+            try:
+                item = ready.get_nowait()
+            except queue.Empty:
+                break
+            if item and item.get("cache_key"):
+                video_cache.release(item["cache_key"])
+
+
+def _produce_episodes(chat_id, ep_list, cancel_event, cancelled, put, budget, pending_bytes):
+    from hianimez_scraper import async_resolve_sources
+
+    for idx, (ep_num, episode_id) in enumerate(ep_list):
+        if cancelled():
             return
 
         try:
-            hls_link, subtitle_url = extract_episode_stream_and_subtitle(episode_id)
+            hls_link, subtitle_url = resolve_episode(chat_id, episode_id)
         except Exception as e:
-            logger.error(f"[Thread] Error extracting Episode {ep_num}: {e}", exc_info=True)
-            bot.send_message(chat_id, f"❌ Failed to extract data for Episode {ep_num}. Skipping.")
+            logger.error(f"[Pipeline] Error extracting Episode {ep_num}: {e}", exc_info=True)
+            tracing.fail(f"resolve failed for episode {ep_num}")
+            if not put({"ep_num": ep_num, "notice": f"❌ Failed to extract data for Episode {ep_num}. Skipping."}):
+                return
+            continue
+
+        soft_sub = soft_subtitle_path(episode_id, subtitle_url)
+        item = {"ep_num": ep_num, "episode_id": episode_id, "hls_link": hls_link, "subtitle_url": subtitle_url,
+                "soft_sub": soft_sub}
+        if soft_sub is None:
+            prefetch_subtitle(episode_id, subtitle_url)
+
+        # Already delivered to some chat → the consumer re-sends it by reference
+        if media_refs.has(episode_id, video_variant(soft_sub)):
+            item["by_reference"] = True
+            if not put(item):
+                return
             continue
 
         if not hls_link:
-            bot.send_message(chat_id, f"😔 Episode {ep_num}: No SUB-HD2 stream found. Skipping.")
+            tracing.fail(f"no stream for episode {ep_num}")
+            if not put({"ep_num": ep_num, "notice": f"😔 Episode {ep_num}: No SUB-HD2 stream found. Skipping."}):
+                return
             continue
 
-        status_download = bot.send_message(chat_id, f"📥 Downloading Episode {ep_num}...\nProgress: 0%")
-        last_dl_update = [0.0]
+        # Resolve the next episodes' HLS/subtitle URLs while this one downloads
+        upcoming = [eid for _, eid in ep_list[idx + 1: idx + 1 + SOURCE_PREFETCH]]
+        if upcoming:
+            app_loop.submit(async_resolve_sources(upcoming))
 
-        def download_progress_cb(downloaded_mb, total_duration_s, percent, speed_mb_s, elapsed_s, eta_s):
-            if cancel_event and cancel_event.is_set():
-                return
-            now = time.time()
-            if now - last_dl_update[0] < 3.0:
+        # Disk budget: wait until earlier downloads have been uploaded
+        with budget:
+            while pending_bytes[0] > 0 and pending_bytes[0] >= DOWNLOAD_ALL_DISK_BUDGET and not cancelled():
+                budget.wait(0.5)
+        if cancelled():
+            return
+
+        cache_key = episode_cache_key(episode_id, soft_sub)
+        raw_mp4 = video_cache.acquire(cache_key)
+        if raw_mp4 is None and STREAM_UPLOAD and not soft_sub:
+            # streamed by the consumer; nothing to stage here
+            item["stream"] = True
+            if not put(item):
                 return
-            last_dl_update[0] = now
+            continue
+        if raw_mp4 is None:
+            raw_mp4 = _download_pipeline_episode(chat_id, ep_num, episode_id, hls_link, cache_key, cancel_event,
+                                                 soft_sub)
+            if raw_mp4 is None:
+                if cancelled():
+                    bot.send_message(chat_id, f"❌ Download‐All cancelled during Episode {ep_num}.")
+                    return
+                item["failed"] = True
+                if not put(item):
+                    return
+                continue
+
+        item["cache_key"] = cache_key
+        item["path"] = raw_mp4
+        item["size"] = os.path.getsize(raw_mp4)
+        with budget:
+            pending_bytes[0] += item["size"]
+        if not put(item):
+            video_cache.release(cache_key)
+            return
 
-            elapsed_str = f"{int(elapsed_s//60)}m {int(elapsed_s%60)}s"
-            eta_str = (
-                f"{int(eta_s//60)}m {int(eta_s%60)}s"
-                if (eta_s is not None and eta_s >= 0)
-                else "–"
-            )
-            text = (
-                f"📥 <b>Downloading Episode {ep_num}</b>\n\n"
-                f"📊Size: {downloaded_mb:.2f} MB\n"
-                f"⚡️Speed: {speed_mb_s:.2f} MB/s\n"
-                f"⏱️Time Elapsed: {elapsed_str}\n"
-                f"⏳ETA: {eta_str}\n"
-                f"📈Progress: {percent:.1f}%"
-            )
-            try:
-                bot.edit_message_text(text, chat_id=chat_id, message_id=status_download.message_id, parse_mode="HTML")
-            except Exception:
-                pass
 
-        try:
-            raw_mp4 = download_and_rename_video(
-                hls_link,
-                ep_num,
-                cache_dir=video_cache_dir,
-                progress_callback=download_progress_cb
-            )
-        except Exception as e:
-            logger.error(f"[Thread] Error downloading Episode {ep_num}: {e}", exc_info=True)
+def _download_pipeline_episode(chat_id, ep_num, episode_id, hls_link, cache_key, cancel_event,
+                               subtitle_path=None):
+    """
+    Downloads one episode into the shared cache with a progress message.
+    Returns the pinned path, or None on failure / cancellation.
+    """
+    status_download = bot.send_message(chat_id, f"📥 Downloading Episode {ep_num}...\nProgress: 0%")
+
+    def download_progress_cb(downloaded_mb, total_duration_s, percent, speed_mb_s, elapsed_s, eta_s):
+        if cancel_event and cancel_event.is_set():
+            return
+        elapsed_str = f"{int(elapsed_s//60)}m {int(elapsed_s%60)}s"
+        eta_str = (
+            f"{int(eta_s//60)}m {int(eta_s%60)}s"
+            if (eta_s is not None and eta_s >= 0)
+            else "–"
+        )
+        text = (
+            f"📥 <b>Downloading Episode {ep_num}</b>\n\n"
+            f"📊Size: {downloaded_mb:.2f} MB\n"
+            f"⚡️Speed: {speed_mb_s:.2f} MB/s\n"
+            f"⏱️Time Elapsed: {elapsed_str}\n"
+            f"⏳ETA: {eta_str}\n"
+            f"📈Progress: {percent:.1f}%"
+        )
+        progress_dispatcher.update(chat_id, status_download.message_id, text)
+
+    try:
+        return fetch_episode_video(
+            chat_id, ep_num, episode_id, hls_link, cache_key, download_progress_cb, cancel_event,
+            subtitle_path,
+        )
+    except Exception as e:
+        logger.error(f"[Pipeline] Error downloading Episode {ep_num}: {e}", exc_info=True)
+        return None
+    finally:
+        if status_download:
             try:
                 bot.delete_message(chat_id=chat_id, message_id=status_download.message_id)
             except Exception:
                 pass
 
-            if cancel_event and cancel_event.is_set():
-                bot.send_message(chat_id, f"❌ Download‐All cancelled during Episode {ep_num}.")
-                return
 
-            bot.send_message(
-                chat_id,
-                f"⚠️ Could not convert Episode {ep_num} to MP4. Here’s the HLS link:\n\n{hls_link}"
-            )
-            if subtitle_url:
-                try:
-                    local_vtt = download_and_rename_subtitle(subtitle_url, ep_num, cache_dir=subtitle_cache_dir)
-                    status_sub = bot.send_message(chat_id, f"✅ Subtitle downloaded as “Episode {ep_num}.vtt.”")
-                    bot.send_document(
-                        chat_id=chat_id,
-                        document=InputFile(open(local_vtt, "rb"), filename=f"Episode {ep_num}.vtt"),
-                        caption=f"Here is the subtitle for Episode {ep_num}"
-                    )
-                    os.remove(local_vtt)
-                    try:
-                        bot.delete_message(chat_id=chat_id, message_id=status_sub.message_id)
-                    except Exception:
-                        pass
-                except Exception as se:
-                    logger.error(f"[Thread] Error sending subtitle (Episode {ep_num}): {se}", exc_info=True)
-                    bot.send_message(chat_id, f"⚠️ Could not send subtitle for Episode {ep_num}.")
-            continue
+def _upload_pipeline_item(chat_id, item, cancel_event):
+    """
+    Consumer side of the Download All pipeline: delivers one queued episode.
+    """
+    ep_num = item["ep_num"]
+    if "notice" in item:
+        bot.send_message(chat_id, item["notice"])
+        return
 
-        try:
-            bot.delete_message(chat_id=chat_id, message_id=status_download.message_id)
-        except Exception:
-            pass
+    episode_id = item["episode_id"]
+    hls_link = item["hls_link"]
+    subtitle_url = item["subtitle_url"]
+    soft_sub = item["soft_sub"]
+
+    delivered = False
+    if item.get("by_reference"):
+        delivered = send_by_reference(chat_id, episode_id, video_variant(soft_sub), f"Episode {ep_num}.mp4")
+    elif item.get("stream"):
+        delivered = try_stream_episode(chat_id, ep_num, episode_id, hls_link, cancel_event)
+        if not delivered and cancel_event and cancel_event.is_set():
+            return
 
-        if cancel_event and cancel_event.is_set():
-            bot.send_message(chat_id, f"❌ Download‐All cancelled before uploading Episode {ep_num}.")
-            try:
-                os.remove(raw_mp4)
-            except OSError:
-                pass
+    if not delivered and (item.get("by_reference") or item.get("stream")):
+        # stale reference / failed stream: download it here after all
+        if not hls_link:
+            tracing.fail(f"no stream for episode {ep_num}")
+            bot.send_message(chat_id, f"😔 Episode {ep_num}: No SUB-HD2 stream found. Skipping.")
             return
+        cache_key = episode_cache_key(episode_id, soft_sub)
+        path = video_cache.acquire(cache_key) or _download_pipeline_episode(
+            chat_id, ep_num, episode_id, hls_link, cache_key, cancel_event, soft_sub
+        )
+        if path is None:
+            item["failed"] = True
+        else:
+            # the consumer loop unpins it; it never counted against the budget
+            item.update(cache_key=cache_key, path=path, size=0)
+
+    if item.get("failed"):
+        tracing.fail(f"download failed for episode {ep_num}")
+        bot.send_message(
+            chat_id,
+            f"⚠️ Could not convert Episode {ep_num} to MP4. Here’s the HLS link:\n\n{hls_link}"
+        )
+        if subtitle_url:
+            send_subtitle(chat_id, ep_num, episode_id, subtitle_url)
+        return
 
+    if cancel_event and cancel_event.is_set():
+        return
+
+    if not delivered:
         status_upload = bot.send_message(chat_id, f"📤 Uploading Episode {ep_num}...\nProgress: 0%")
         try:
-            send_file_via_telethon_with_progress(
-                chat_id=chat_id,
-                file_path=raw_mp4,
-                caption=f"Episode {ep_num}.mp4",
-                status_message_id=status_upload.message_id
-            )
+            deliver_episode_video(chat_id, ep_num, episode_id, item["path"], status_upload.message_id, cancel_event,
+                                  soft_sub)
         except Exception as e:
-            logger.error(f"[Thread] Telethon upload failed for Episode {ep_num}: {e}", exc_info=True)
+            logger.error(f"[Pipeline] Telethon upload failed for Episode {ep_num}: {e}", exc_info=True)
             try:
                 bot.delete_message(chat_id=chat_id, message_id=status_upload.message_id)
             except Exception:
                 pass
 
-            if cancel_event and cancel_events[chat_id].is_set():
-                bot.send_message(chat_id, f"❌ Download‐All cancelled during upload of Episode {ep_num}.")
-                try:
-                    os.remove(raw_mp4)
-                except OSError:
-                    pass
+            if cancel_event and cancel_event.is_set():
                 return
 
+            tracing.fail(f"upload failed for episode {ep_num}")
             bot.send_message(chat_id, f"⚠️ Could not send Episode {ep_num} via Telethon. Here’s the HLS link:\n\n{hls_link}")
-            try:
-                os.remove(raw_mp4)
-            except OSError:
-                pass
             if subtitle_url:
-                try:
-                    local_vtt = download_and_rename_subtitle(subtitle_url, ep_num, cache_dir=subtitle_cache_dir)
-                    status_sub = bot.send_message(chat_id, f"✅ Subtitle downloaded as “Episode {ep_num}.vtt.”")
-                    bot.send_document(
-                        chat_id=chat_id,
-                        document=InputFile(open(local_vtt, "rb"), filename=f"Episode {ep_num}.vtt"),
-                        caption=f"Here is the subtitle for Episode {ep_num}"
-                    )
-                    os.remove(local_vtt)
-                    try:
-                        bot.delete_message(chat_id=chat_id, message_id=status_sub.message_id)
-                    except Exception:
-                        pass
-                except Exception as se:
-                    logger.error(f"[Thread] Error sending subtitle (Episode {ep_num}): {se}", exc_info=True)
-                    bot.send_message(chat_id, f"⚠️ Could not send subtitle for Episode {ep_num}.")
-            continue
-        finally:
-            try:
-                os.remove(raw_mp4)
-            except OSError:
-                pass
+                send_subtitle(chat_id, ep_num, episode_id, subtitle_url)
+            return
 
         try:
             bot.delete_message(chat_id=chat_id, message_id=status_upload.message_id)
         except Exception:
             pass
 
-        if not subtitle_url:
-            bot.send_message(chat_id, f"❗ No English subtitle found for Episode {ep_num}.")
-            continue
-
-        if cancel_event and cancel_events[chat_id].is_set():
-            bot.send_message(chat_id, f"❌ Download‐All cancelled before subtitle of Episode {ep_num}.")
-            return
+    if not subtitle_url:
+        bot.send_message(chat_id, f"❗ No English subtitle found for Episode {ep_num}.")
+        return
 
-        try:
-            local_vtt = download_and_rename_subtitle(subtitle_url, ep_num, cache_dir=subtitle_cache_dir)
-        except Exception as e:
-            logger.error(f"[Thread] Error downloading subtitle (Episode {ep_num}): {e}", exc_info=True)
-            bot.send_message(chat_id, f"⚠️ Could not download subtitle for Episode {ep_num}.")
-            continue
+    if soft_sub or (cancel_event and cancel_event.is_set()):
+        return
 
-        status_sub = bot.send_message(chat_id, f"✅ Subtitle downloaded as “Episode {ep_num}.vtt.”")
-        try:
-            bot.send_document(
-                chat_id=chat_id,
-                document=InputFile(open(local_vtt, "rb"), filename=f"Episode {ep_num}.vtt"),
-                caption=f"Here is the subtitle for Episode {ep_num}"
-            )
-        except Exception as e:
-            logger.error(f"[Thread] Error sending subtitle (Episode {ep_num}): {e}", exc_info=True)
-            bot.send_message(chat_id, f"⚠️ Could not send subtitle for Episode {ep_num}.")
-        finally:
-            try:
-                os.remove(local_vtt)
-            except OSError:
-                pass
+    send_subtitle(chat_id, ep_num, episode_id, subtitle_url)
 
-        try:
-            bot.delete_message(chat_id=chat_id, message_id=status_sub.message_id)
-        except Exception:
-            pass
+# ──────────────────────────────────────────────────────────────────────────────
+# 12b) Metrics: gauges read from each component's stats() at scrape time
+# ──────────────────────────────────────────────────────────────────────────────
+def collect_metrics():
+    from hianimez_scraper import cache_stats
+    from hls_downloader import probe_cache
+
+    samples = []
+    sched = scheduler.stats()
+    samples += [
+        ("jobs_running", "Jobs currently running.", {}, sched["running"]),
+        ("jobs_queued", "Jobs waiting for a worker.", {}, sched["queued"]),
+        ("jobs_completed", "Jobs finished since start.", {}, sched["completed"]),
+        ("jobs_failed", "Jobs that raised since start.", {}, sched["failed"]),
+    ]
+    for limiter in (resolve_limiter, download_limiter, upload_limiter):
+        st = limiter.stats()
+        samples += [
+            ("stage_active", "Slots in use per pipeline stage.", {"stage": limiter.name}, st["active"]),
+            ("stage_waiting", "Jobs waiting for a stage slot.", {"stage": limiter.name}, st["waiting"]),
+        ]
+    for priority, depth in outbox.stats()["depth"].items():
+        samples.append(("bot_api_queue_depth", "Queued outbound Bot API calls.", {"priority": priority}, depth))
+    samples.append(("progress_edits_pending", "Progress edits waiting to be sent.", {},
+                    progress_dispatcher.stats()["pending"]))
+    for flight in (resolve_flight, download_flight, upload_flight):
+        samples.append(("singleflight_in_flight", "Coalesced calls in flight.", {"stage": flight.name},
+                        flight.stats()["in_flight"]))
+
+    for cache, st in (("scraper", cache_stats()), ("video", video_cache.stats()),
+                      ("subtitle", subtitle_store.stats())):
+        samples += [
+            ("cache_hit_ratio", "Cache hit ratio since start.", {"cache": cache}, st["hit_rate"]),
+            ("cache_entries", "Cache entries.", {"cache": cache}, st["entries"]),
+            ("cache_bytes", "Cache size in bytes.", {"cache": cache}, st["bytes"]),
+        ]
+    refs = media_refs.stats()
+    lookups = refs["hits"] + refs["misses"]
+    samples.append(("cache_hit_ratio", "Cache hit ratio since start.", {"cache": "media_refs"},
+                    refs["hits"] / lookups if lookups else 0.0))
+    probes = probe_cache.stats()
+    samples += [
+        ("cache_hit_ratio", "Cache hit ratio since start.", {"cache": "probe"}, probes["hit_rate"]),
+        ("cache_entries", "Cache entries.", {"cache": "probe"}, probes["entries"]),
+    ]
+    for bucket, best in upload_service.tuner.stats().items():
+        if "part_kb" not in best:
+            continue
+        samples += [
+            ("upload_tuned_part_kb", "Best upload part size per file-size bucket.", {"bucket": bucket},
+             best["part_kb"]),
+            ("upload_tuned_parallel", "Best parallel in-flight parts per file-size bucket.", {"bucket": bucket},
+             best["parallel"]),
+            ("upload_tuned_mbps", "Throughput of the best upload settings per file-size bucket.",
+             {"bucket": bucket}, best["mbps"]),
+        ]
+    return samples
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 13) Error handler
@@ -926,7 +1491,7 @@ def error_handler(update: object, context: CallbackContext):
             pass
 
 # ──────────────────────────────────────────────────────────────────────────────
-# 14) Main: set up Updater + flood-control patch + start polling
+# 14) Main: set up Updater + flood-control patch + webhook / polling
 # ──────────────────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
     updater = Updater(token=BOT_TOKEN, use_context=True)
@@ -935,44 +1500,91 @@ if __name__ == "__main__":
     global bot
     bot = updater.bot
 
-    # ── Flood‐control patch ─────────────────────────────────────────────────
-    _orig_send = bot.send_message
-    def safe_send(*args, **kwargs):
-        try:
-            return _orig_send(*args, **kwargs)
-        except RetryAfter as e:
-            chat = kwargs.get("chat_id") or (args[0] if args else None)
-            if chat:
-                txt = f"⏱️ Too many requests. Try again in {int(e.retry_after)}s."
-                try:
-                    return _orig_send(chat_id=chat, text=txt)
-                except RetryAfter:
-                    pass
-        return None
-    bot.send_message = safe_send
-
+    # ── Outbound Bot API queue (flood control) ──────────────────────────────
+    # Every send/edit/delete waits for Telegram's global and per-chat rate,
+    # in priority order; RetryAfter re-queues it instead of dropping it.
     _orig_edit = bot.edit_message_text
-    def safe_edit(*args, **kwargs):
-        try:
-            return _orig_edit(*args, **kwargs)
-        except RetryAfter:
-            return None
-    bot.edit_message_text = safe_edit
+    bot.send_document = outbox.wrap(bot.send_document, PRIORITY_HIGH)
+    bot.copy_message = outbox.wrap(bot.copy_message, PRIORITY_HIGH)
+    bot.send_message = outbox.wrap(bot.send_message, PRIORITY_NORMAL)
+    bot.delete_message = outbox.wrap(bot.delete_message, PRIORITY_NORMAL)
+    # edit_message_text(text, chat_id=…): the chat is never positional
+    bot.edit_message_text = outbox.wrap(_orig_edit, PRIORITY_NORMAL, chat_arg=None)
+    outbox.start()
+
+    # progress edits: lowest priority, and a RetryAfter goes back to the
+    # dispatcher, which drops the text in favour of a newer one. Queued, not
+    # awaited: the dispatcher's one thread must never wait on a chat's queue
+    def progress_edit(**kwargs):
+        return outbox.submit(_orig_edit, kwargs=kwargs, chat_id=kwargs["chat_id"],
+                             priority=PRIORITY_LOW, retry=False)
+
+    progress_dispatcher.start(progress_edit)
 
     # ── Register handlers ───────────────────────────────────────────────────
-    dp.add_handler(CommandHandler("start", start))
-    dp.add_handler(CommandHandler("search", search_command))
-    dp.add_handler(CommandHandler("cancel", cancel_command))
-    dp.add_handler(CallbackQueryHandler(anime_callback, pattern=r"^anime_idx:"))
-    dp.add_handler(CallbackQueryHandler(episode_callback, pattern=r"^episode_idx:"))
-    dp.add_handler(CallbackQueryHandler(episodes_all_callback, pattern=r"^episode_all$"))
+    # handlers are coroutines on the shared loop; the dispatcher thread only
+    # schedules them, so a slow scraper call never holds up other chats
+    app_loop.start()
+    dp.add_handler(CommandHandler("start", app_loop.handler(start)))
+    dp.add_handler(CommandHandler("search", app_loop.handler(search_command)))
+    dp.add_handler(CommandHandler("cancel", app_loop.handler(cancel_command)))
+    dp.add_handler(CommandHandler("stats", app_loop.handler(stats_command)))
+    dp.add_handler(CallbackQueryHandler(app_loop.handler(anime_callback), pattern=r"^anime_idx:"))
+    dp.add_handler(CallbackQueryHandler(app_loop.handler(episode_callback), pattern=r"^episode_idx:"))
+    dp.add_handler(CallbackQueryHandler(app_loop.handler(episodes_all_callback), pattern=r"^episode_all$"))
     dp.add_error_handler(error_handler)
 
+    # ── Job scheduler (restores jobs persisted before a restart) ────────────
+    scheduler.register("episode", download_and_send_episode)
+    scheduler.register("all", download_and_send_all_episodes)
+    scheduler.on_start(on_job_start)
+    scheduler.start()
+
     # ── Ensure cache dirs exist ─────────────────────────────────────────────
     os.makedirs("subtitles_cache", exist_ok=True)
     os.makedirs("videos_cache", exist_ok=True)
 
-    # ── Start polling (drop old updates) ────────────────────────────────────
-    updater.start_polling(drop_pending_updates=True)
-    logger.info("Bot started with long polling (flood-control patched).")
+    # ── HTTP server on :8080: /metrics, /healthz and, if configured, the webhook ──
+    secret = (WEBHOOK_SECRET or new_secret()) if WEBHOOK_URL else None
+    http_server = WebhookServer(bot, dp.update_queue, secret)
+    http_server.app.add_url_rule("/metrics", "metrics", metrics.flask_view)
+    metrics.REGISTRY.register_collector(collect_metrics)
+    try:
+        http_server.start()
+    except OSError as e:
+        logger.error(f"Could not start the HTTP server on :{http_server.port} ({e}); "
+                     "no /metrics, and no webhook.")
+        http_server = None
+
+    webhook = False
+    if secret and http_server is not None:
+        try:
+            bot.set_webhook(
+                url=WEBHOOK_URL + WEBHOOK_PATH,
+                secret_token=secret,
+                drop_pending_updates=True,
+            )
+            # what start_webhook() would do, minus PTB's own tornado server
+            threading.Thread(target=dp.start, name="dispatcher", daemon=True).start()
+            updater.running = True
+            webhook = True
+            logger.info("Bot started with webhook %s%s.", WEBHOOK_URL, WEBHOOK_PATH)
+        except Exception as e:
+            logger.error(f"Webhook setup failed ({e}); falling back to long polling.", exc_info=True)
+
+    if not webhook:
+        # start_polling() removes any webhook left registered
+        updater.start_polling(drop_pending_updates=True)
+        logger.info("Bot started with long polling.")
+
     updater.idle()
+    if http_server is not None:
+        http_server.stop()
+    upload_service.stop()
+    # close the pooled keep-alive connections (aiohttp's on the loop, so first)
+    try:
+        app_loop.run(close_async_session(), timeout=5)
+    except Exception as e:
+        logger.warning(f"Closing the aiohttp session failed: {e}")
+    close_session()
+    app_loop.stop()
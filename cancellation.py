@@ -0,0 +1,96 @@
+# cancellation.py
+
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class OperationCancelled(Exception):
+    """
+    Raised by work whose CancelToken fired. A coalesced call (singleflight)
+    ending with it does not fail its followers.
+    """
+
+
+class CancelToken:
+    """
+    A threading.Event (set / is_set / wait, so it works wherever the bot
+    used one) that also runs callbacks when it is set. Blocking work
+    registers how to interrupt itself – kill a process, cancel a future,
+    close a socket – so /cancel takes effect at once instead of at the
+    next progress report.
+
+    Callbacks run once, on the thread calling set(), and must not block.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = {}        # handle → fn
+        self._next_handle = 0
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def set(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for fn in callbacks:
+            _run_callback(fn)
+
+    cancel = set
+
+    def add_callback(self, fn):
+        """
+        Calls `fn()` when the token is set – right away if it already is.
+        Returns a handle for remove_callback().
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._next_handle += 1
+                self._callbacks[self._next_handle] = fn
+                return self._next_handle
+        _run_callback(fn)
+        return None
+
+    def remove_callback(self, handle):
+        if handle is not None:
+            with self._lock:
+                self._callbacks.pop(handle, None)
+
+
+def _run_callback(fn):
+    try:
+        fn()
+    except Exception as e:
+        logger.warning("Cancel callback %r failed: %s", fn, e)
+
+
+@contextmanager
+def on_cancel(token, fn):
+    """
+    `fn()` is called if `token` fires while the `with` block runs. A None
+    token (work nobody can cancel) makes this a no-op.
+    """
+    if token is None:
+        yield
+        return
+    handle = token.add_callback(fn)
+    try:
+        yield
+    finally:
+        token.remove_callback(handle)
+
+
+def raise_if_cancelled(token, what="operation"):
+    if token is not None and token.is_set():
+        raise OperationCancelled(f"{what} cancelled")
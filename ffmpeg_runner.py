@@ -0,0 +1,182 @@
+# ffmpeg_runner.py
+
+import os
+import time
+import asyncio
+import logging
+import subprocess
+import concurrent.futures
+
+from app_loop import app_loop
+from cancellation import OperationCancelled, on_cancel
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", "10800"))             # wall clock per run; 0 = none
+FFMPEG_STALL_TIMEOUT = float(os.getenv("FFMPEG_STALL_TIMEOUT", "120"))    # no progress this long = stuck
+FFMPEG_PROGRESS_INTERVAL = float(os.getenv("FFMPEG_PROGRESS_INTERVAL", "3"))   # between callbacks
+
+PROGRESS_ARGS = ["-progress", "pipe:1", "-nostats"]
+
+
+class FfmpegResult:
+    """
+    How an ffmpeg run ended:
+
+      returncode – ffmpeg's exit code (negative when it was killed)
+      reason     – None, or "timeout" / "stalled" when the runner killed it
+      out_time   – seconds of media written
+      total_size – bytes written, as reported by ffmpeg
+      elapsed    – wall-clock seconds
+    """
+
+    __slots__ = ("returncode", "reason", "out_time", "total_size", "elapsed")
+
+    def __init__(self, returncode, reason, out_time, total_size, elapsed):
+        self.returncode = returncode
+        self.reason = reason
+        self.out_time = out_time
+        self.total_size = total_size
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def __repr__(self):
+        return (f"FfmpegResult(returncode={self.returncode}, reason={self.reason}, "
+                f"out_time={self.out_time:.1f}, total_size={self.total_size})")
+
+
+def _with_progress(cmd):
+    # -progress is a global option, so it can go right after the binary
+    if "-progress" in cmd:
+        return list(cmd)
+    return [cmd[0]] + PROGRESS_ARGS + list(cmd[1:])
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None         # "N/A" before the first packet
+
+
+async def _kill(proc):
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+
+
+async def run_ffmpeg_async(cmd, duration=None, progress_callback=None, timeout=FFMPEG_TIMEOUT,
+                           stall_timeout=FFMPEG_STALL_TIMEOUT):
+    """
+    Runs ffmpeg with `-progress pipe:1` and follows the key=value blocks
+    it prints, waking only when a line arrives or a deadline is due.
+
+    Size comes from ffmpeg's own total_size and position from out_time_us,
+    so nothing is stat()ed. progress_callback(downloaded_mb,
+    total_duration_s, percent, speed_mb_s, elapsed_s, eta_s) is called at
+    most every FFMPEG_PROGRESS_INTERVAL seconds, on the event loop, so it
+    must not block; percent and ETA need the media `duration`.
+
+    The process is killed when it runs past `timeout`, when neither
+    position nor size moves for `stall_timeout` seconds, and when the
+    awaiting task is cancelled.
+    """
+    cmd = _with_progress(cmd)
+    started = time.monotonic()
+    deadline = started + timeout if timeout > 0 else None
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+
+    out_us = 0
+    total_size = 0
+    last_advance = started
+    last_report = 0.0
+    reason = None
+    try:
+        while True:
+            now = time.monotonic()
+            waits = []
+            if deadline is not None:
+                waits.append(deadline - now)
+            if stall_timeout > 0:
+                waits.append(last_advance + stall_timeout - now)
+            wait = min(waits) if waits else None
+            if wait is not None and wait <= 0:
+                reason = "timeout" if deadline is not None and now >= deadline else "stalled"
+                break
+            try:
+                raw = await asyncio.wait_for(proc.stdout.readline(), wait)
+            except asyncio.TimeoutError:
+                continue        # the top of the loop tells timeout from stall
+            if not raw:
+                break
+
+            key, _, value = raw.decode("ascii", "replace").strip().partition("=")
+            if key in ("out_time_us", "out_time_ms"):
+                # both are microseconds (out_time_ms is misnamed in ffmpeg)
+                us = _to_int(value)
+                if us is not None and us > out_us:
+                    out_us = us
+                    last_advance = time.monotonic()
+            elif key == "total_size":
+                size = _to_int(value)
+                if size is not None and size > total_size:
+                    total_size = size
+                    last_advance = time.monotonic()
+            elif key == "progress" and progress_callback:
+                now = time.monotonic()
+                if now - last_report >= FFMPEG_PROGRESS_INTERVAL or value == "end":
+                    last_report = now
+                    _report(progress_callback, out_us / 1e6, total_size, duration, now - started)
+    except asyncio.CancelledError:
+        await _kill(proc)
+        raise
+
+    if reason is not None:
+        logger.warning("Killing ffmpeg writing %s: %s after %.0fs, %.0fs of media written",
+                       cmd[-1], reason, time.monotonic() - started, out_us / 1e6)
+        await _kill(proc)
+    else:
+        await proc.wait()
+    return FfmpegResult(proc.returncode, reason, out_us / 1e6, total_size, time.monotonic() - started)
+
+
+def _report(progress_callback, out_s, total_size, duration, elapsed):
+    size_mb = total_size / (1024 * 1024)
+    pct = min(100.0, out_s / duration * 100) if (duration and duration > 0) else 0.0
+    speed = (size_mb / elapsed) if elapsed > 0 else 0.0
+    eta = (elapsed * (100 - pct) / pct) if pct > 0 else 0.0
+    try:
+        progress_callback(size_mb, duration or 0.0, pct, speed, elapsed, eta)
+    except Exception as e:
+        logger.warning("ffmpeg progress callback failed: %s", e)
+
+
+def run_ffmpeg(cmd, duration=None, progress_callback=None, timeout=FFMPEG_TIMEOUT,
+               stall_timeout=FFMPEG_STALL_TIMEOUT, cancel=None):
+    """
+    Blocking run_ffmpeg_async() for worker threads; the process is awaited
+    on the shared event loop, so a waiting job holds no thread busy.
+    Returns an FfmpegResult; raises OperationCancelled (ffmpeg killed and
+    reaped) when the `cancel` token fires.
+    """
+    future = app_loop.submit(run_ffmpeg_async(cmd, duration, progress_callback, timeout, stall_timeout))
+    try:
+        with on_cancel(cancel, future.cancel):
+            return future.result()
+    except concurrent.futures.CancelledError:
+        raise OperationCancelled(f"ffmpeg writing {cmd[-1]} cancelled") from None
+    except BaseException:
+        # e.g. KeyboardInterrupt in the waiting thread: don't leave ffmpeg running
+        future.cancel()
+        raise
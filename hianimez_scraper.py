@@ -1,8 +1,16 @@
 # hianimez_scraper.py
 
 import os
-import requests
+import sys
+import time
+import asyncio
+import threading
 import logging
+from collections import OrderedDict
+
+from http_client import http_get, async_http_get_json
+from metrics import SCRAPER_SECONDS
+from singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +21,225 @@ ANIWATCH_API_BASE = os.getenv(
     "http://localhost:4000/api/v2/hianime"
 )
 
+# The rendition we always ask /episode/sources for
+STREAM_SERVER = "hd-2"      # SUB HD-2 (1080p)
+STREAM_CATEGORY = "sub"
+
+# ——————————————————————————————————————————————————————————————
+# Response cache tunables (seconds / bytes; override through the environment)
+# ——————————————————————————————————————————————————————————————
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "900"))          # 15 min
+EPISODES_CACHE_TTL = float(os.getenv("EPISODES_CACHE_TTL", "21600"))    # 6 h
+# HLS URLs are signed and expire, so keep sources short-lived.
+SOURCES_CACHE_TTL = float(os.getenv("SOURCES_CACHE_TTL", "120"))        # 2 min
+
+# How long past its TTL an entry may still be served while it is refreshed
+# in the background. Never for sources: an expired HLS link is useless.
+SEARCH_CACHE_STALE = float(os.getenv("SEARCH_CACHE_STALE", "3600"))
+EPISODES_CACHE_STALE = float(os.getenv("EPISODES_CACHE_STALE", "86400"))
+SOURCES_CACHE_STALE = 0.0
+
+SCRAPER_CACHE_MAX_BYTES = int(os.getenv("SCRAPER_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+def _approx_size(value):
+    """
+    Rough in-memory size of a cached result (lists/tuples of strings).
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            size += _approx_size(item)
+    return size
+
+
+class ResponseCache:
+    """
+    Thread-safe TTL + LRU cache for parsed API results.
+
+    Each entry has its own TTL and stale window. Within the TTL the cached
+    value is returned as-is; past the TTL but inside the stale window the
+    old value is returned immediately and a single background refresh is
+    started (stale-while-revalidate). Concurrent misses on one key share a
+    single load. The total size is bounded by `max_bytes`; the least
+    recently used entries are evicted first.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key → (value, fresh_until, stale_until, size)
+        self._bytes = 0
+        self._refreshing = set()
+        self._flight = SingleFlight("scraper", failure_ttl=0)
+        self._loading = {}              # key → asyncio.Task of the load in flight
+        self._tasks = set()             # background refreshes, kept referenced until done
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key):
+        """
+        Returns (found, value, needs_refresh). `needs_refresh` is True for
+        exactly one caller per stale entry, who must start the refresh.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fresh_until, stale_until, _ = entry
+                if now < fresh_until:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value, False
+                if now < stale_until:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    needs_refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                    return True, value, needs_refresh
+            self.misses += 1
+            return False, None, False
+
+    def get_or_load(self, key, loader, ttl, stale=0.0):
+        found, value, needs_refresh = self._lookup(key)
+        if needs_refresh:
+            threading.Thread(
+                target=self._refresh,
+                args=(key, loader, ttl, stale),
+                daemon=True
+            ).start()
+        if found:
+            return value
+
+        def load(report, cancel):
+            value = loader()
+            self.put(key, value, ttl, stale)
+            return value
+
+        value, _ = self._flight.do(key, load)
+        return value
+
+    async def get_or_load_async(self, key, loader, ttl, stale=0.0):
+        """
+        Same as get_or_load() for a coroutine function `loader`.
+        """
+        found, value, needs_refresh = self._lookup(key)
+        if needs_refresh:
+            task = asyncio.ensure_future(self._refresh_async(key, loader, ttl, stale))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if found:
+            return value
+
+        task = self._loading.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._load_async(key, loader, ttl, stale))
+            self._loading[key] = task
+            task.add_done_callback(lambda t: self._loaded(key, t))
+        # shielded: a caller giving up doesn't cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _load_async(self, key, loader, ttl, stale):
+        value = await loader()
+        self.put(key, value, ttl, stale)
+        return value
+
+    def _loaded(self, key, task):
+        if self._loading.get(key) is task:
+            del self._loading[key]
+        if not task.cancelled():
+            task.exception()    # retrieved here in case every caller gave up
+
+    def _refresh(self, key, loader, ttl, stale):
+        try:
+            self.put(key, loader(), ttl, stale)
+        except Exception as e:
+            logger.warning("Background refresh of %s failed: %s", key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def _refresh_async(self, key, loader, ttl, stale):
+        try:
+            self.put(key, await loader(), ttl, stale)
+        except Exception as e:
+            logger.warning("Background refresh of %s failed: %s", key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def put(self, key, value, ttl, stale=0.0):
+        if ttl <= 0:
+            return
+        now = time.monotonic()
+        size = _approx_size(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[3]
+            self._entries[key] = (value, now + ttl, now + ttl + stale, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": ((self.hits + self.stale_hits) / lookups) if lookups else 0.0,
+            }
+
+
+_cache = ResponseCache(SCRAPER_CACHE_MAX_BYTES)
+
+
+def cache_stats():
+    """
+    Hit/miss counters and size of the scraper response cache.
+    """
+    return _cache.stats()
+
+
+def _search_key(query: str):
+    return ("search", " ".join(query.lower().split()))
+
+
+def _slug_from_url(anime_url: str):
+    return anime_url.rstrip("/").split("/")[-1]
+
+
+def _search_params(query: str):
+    return {"q": query, "page": 1}
+
+
+def _sources_params(episode_id: str):
+    return {
+        "animeEpisodeId": episode_id,
+        "server":          STREAM_SERVER,   # <<< force SUB HD-2 (1080p)
+        "category":       STREAM_CATEGORY
+    }
+
 
 def search_anime(query: str):
     """
@@ -22,14 +249,36 @@ def search_anime(query: str):
       - animeId is the slug (e.g. "raven-of-the-inner-palace-18168")
       - anime_url = "https://hianimez.to/watch/{animeId}"
     """
-    url = f"{ANIWATCH_API_BASE}/search"
-    params = {"q": query, "page": 1}
+    def _load():
+        with SCRAPER_SECONDS.time(endpoint="search"):
+            resp = http_get(f"{ANIWATCH_API_BASE}/search", params=_search_params(query), timeout=10)
+        resp.raise_for_status()
+        return _parse_search(resp.json())
+
+    results = _cache.get_or_load(_search_key(query), _load, SEARCH_CACHE_TTL, SEARCH_CACHE_STALE)
+    return list(results)
+
+
+async def async_search_anime(query: str):
+    """
+    asyncio version of search_anime(); shares its cache.
+    """
+    async def _load():
+        with SCRAPER_SECONDS.time(endpoint="search"):
+            status, full_json = await async_http_get_json(
+                f"{ANIWATCH_API_BASE}/search", params=_search_params(query), timeout=10
+            )
+        _raise_for_status(status, "/search")
+        return _parse_search(full_json)
+
+    results = await _cache.get_or_load_async(
+        _search_key(query), _load, SEARCH_CACHE_TTL, SEARCH_CACHE_STALE
+    )
+    return list(results)
 
-    resp = requests.get(url, params=params, timeout=10)
-    resp.raise_for_status()
 
-    full_json = resp.json()
-    logger.info("AniWatch /search raw JSON: %s", full_json)
+def _parse_search(full_json):
+    logger.debug("AniWatch /search raw JSON: %s", full_json)
 
     root = full_json.get("data", {})
     anime_list = root.get("animes", [])
@@ -51,7 +300,7 @@ def search_anime(query: str):
         anime_url = f"https://hianimez.to/watch/{slug}"
         results.append((title, anime_url, slug))
 
-    return results
+    return tuple(results)
 
 
 def get_episodes_list(anime_url: str):
@@ -66,21 +315,56 @@ def get_episodes_list(anime_url: str):
         … ]
     """
     try:
-        slug = anime_url.rstrip("/").split("/")[-1]
+        slug = _slug_from_url(anime_url)
     except Exception:
         return []
 
-    ep_list_url = f"{ANIWATCH_API_BASE}/anime/{slug}/episodes"
-    resp = requests.get(ep_list_url, timeout=10)
+    def _load():
+        with SCRAPER_SECONDS.time(endpoint="episodes"):
+            resp = http_get(f"{ANIWATCH_API_BASE}/anime/{slug}/episodes", timeout=10)
+        if resp.status_code == 404:
+            return _single_episode_fallback(slug)
+        resp.raise_for_status()
+        return _parse_episodes(resp.json())
+
+    episodes = _cache.get_or_load(
+        ("episodes", slug), _load, EPISODES_CACHE_TTL, EPISODES_CACHE_STALE
+    )
+    return list(episodes)
+
+
+async def async_get_episodes_list(anime_url: str):
+    """
+    asyncio version of get_episodes_list(); shares its cache.
+    """
+    try:
+        slug = _slug_from_url(anime_url)
+    except Exception:
+        return []
+
+    async def _load():
+        with SCRAPER_SECONDS.time(endpoint="episodes"):
+            status, full_json = await async_http_get_json(
+                f"{ANIWATCH_API_BASE}/anime/{slug}/episodes", timeout=10
+            )
+        if status == 404:
+            return _single_episode_fallback(slug)
+        _raise_for_status(status, f"/anime/{slug}/episodes")
+        return _parse_episodes(full_json)
+
+    episodes = await _cache.get_or_load_async(
+        ("episodes", slug), _load, EPISODES_CACHE_TTL, EPISODES_CACHE_STALE
+    )
+    return list(episodes)
 
+
+def _single_episode_fallback(slug: str):
     # If the anime has no “/anime/{slug}/episodes” list (e.g. a one‐shot), the API may return 404.
     # In that case, we treat it as a single‐episode fallback:
-    if resp.status_code == 404:
-        return [("1", f"{slug}?ep=1")]
+    return (("1", f"{slug}?ep=1"),)
 
-    resp.raise_for_status()
-    full_json = resp.json()
 
+def _parse_episodes(full_json):
     episodes_data = full_json.get("data", {}).get("episodes", [])
     episodes = []
 
@@ -98,7 +382,7 @@ def get_episodes_list(anime_url: str):
 
     # Sort by numeric episode number just to be safe:
     episodes.sort(key=lambda x: int(x[0]))
-    return episodes
+    return tuple(episodes)
 
 
 def extract_episode_stream_and_subtitle(episode_id: str):
@@ -111,17 +395,38 @@ def extract_episode_stream_and_subtitle(episode_id: str):
     the SUB‐HD2 (1080p) link (if available).
     Returns (hls_link_or_None, subtitle_url_or_None).
     """
-    url = f"{ANIWATCH_API_BASE}/episode/sources"
-    params = {
-        "animeEpisodeId": episode_id,
-        "server":          "hd-2",   # <<< force SUB HD-2 (1080p)
-        "category":       "sub"
-    }
+    def _load():
+        with SCRAPER_SECONDS.time(endpoint="sources"):
+            resp = http_get(
+                f"{ANIWATCH_API_BASE}/episode/sources", params=_sources_params(episode_id), timeout=10
+            )
+        resp.raise_for_status()
+        return _parse_sources(resp.json())
+
+    return _cache.get_or_load(
+        ("sources", episode_id), _load, SOURCES_CACHE_TTL, SOURCES_CACHE_STALE
+    )
+
 
-    resp = requests.get(url, params=params, timeout=10)
-    resp.raise_for_status()
+async def async_extract_episode_stream_and_subtitle(episode_id: str):
+    """
+    asyncio version of extract_episode_stream_and_subtitle(); shares its cache.
+    """
+    async def _load():
+        with SCRAPER_SECONDS.time(endpoint="sources"):
+            status, full_json = await async_http_get_json(
+                f"{ANIWATCH_API_BASE}/episode/sources", params=_sources_params(episode_id), timeout=10
+            )
+        _raise_for_status(status, "/episode/sources")
+        return _parse_sources(full_json)
+
+    return await _cache.get_or_load_async(
+        ("sources", episode_id), _load, SOURCES_CACHE_TTL, SOURCES_CACHE_STALE
+    )
 
-    data = resp.json().get("data", {})
+
+def _parse_sources(full_json):
+    data = full_json.get("data", {})
     sources = data.get("sources", [])
     tracks  = data.get("tracks", [])
 
@@ -157,3 +462,37 @@ def extract_episode_stream_and_subtitle(episode_id: str):
             break
 
     return hls_link, subtitle_url
+
+
+def _raise_for_status(status, endpoint):
+    if status >= 400:
+        raise RuntimeError(f"AniWatch {endpoint} returned HTTP {status}")
+
+
+# ——————————————————————————————————————————————————————————————
+# Batch source resolution
+# ——————————————————————————————————————————————————————————————
+SOURCES_BATCH_CONCURRENCY = int(os.getenv("SOURCES_BATCH_CONCURRENCY", "4"))
+
+
+async def async_resolve_sources(episode_ids, concurrency: int = SOURCES_BATCH_CONCURRENCY):
+    """
+    Resolves (hls_link, subtitle_url) for many episode IDs at once, with at
+    most `concurrency` requests in flight.
+
+    Returns { episode_id: (hls_link, subtitle_url) or Exception }. Results
+    also land in the sources cache, so a later
+    extract_episode_stream_and_subtitle() for the same ID is a cache hit.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(episode_id):
+        async with sem:
+            try:
+                return episode_id, await async_extract_episode_stream_and_subtitle(episode_id)
+            except Exception as e:
+                logger.warning("Could not resolve sources for %s: %s", episode_id, e)
+                return episode_id, e
+
+    pairs = await asyncio.gather(*(_one(eid) for eid in dict.fromkeys(episode_ids)))
+    return dict(pairs)
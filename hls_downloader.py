@@ -0,0 +1,723 @@
+# hls_downloader.py
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+from http_client import get_session, backoff_delay
+from ffmpeg_runner import run_ffmpeg
+from cancellation import OperationCancelled, on_cancel, raise_if_cancelled
+from metrics import HLS_BYTES, HLS_THROUGHPUT, observe_remux
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+HLS_WORKERS = int(os.getenv("HLS_WORKERS", "8"))                 # parallel segment fetches
+HLS_SEGMENT_RETRIES = int(os.getenv("HLS_SEGMENT_RETRIES", "4"))
+HLS_SEGMENT_TIMEOUT = float(os.getenv("HLS_SEGMENT_TIMEOUT", "30"))
+# 0 = no cap; otherwise the tallest variant not exceeding this height is used
+HLS_MAX_HEIGHT = int(os.getenv("HLS_MAX_HEIGHT", "0"))
+# Successful probe_stream() results are reused per URL for this long
+PROBE_CACHE_TTL = float(os.getenv("PROBE_CACHE_TTL", "300"))
+PROBE_CACHE_SIZE = int(os.getenv("PROBE_CACHE_SIZE", "256"))
+
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class HlsError(RuntimeError):
+    """
+    The playlist can't be handled natively (encrypted, separate audio
+    rendition, malformed, …) or a segment could not be fetched. Callers
+    fall back to yt-dlp / ffmpeg.
+    """
+
+
+class RemuxError(HlsError):
+    """
+    Every segment was fetched but the local remux failed. The staged
+    segments at `staged_path` are kept so other remux strategies can run
+    on them without downloading the stream again.
+    """
+
+    def __init__(self, code, staged_path, is_fmp4):
+        super().__init__(f"local remux failed with exit code {code}")
+        self.code = code
+        self.staged_path = staged_path
+        self.is_fmp4 = is_fmp4
+
+
+class Segment:
+    __slots__ = ("uri", "duration", "byterange")
+
+    def __init__(self, uri, duration, byterange=None):
+        self.uri = uri
+        self.duration = duration
+        self.byterange = byterange      # (length, offset) or None
+
+
+class MediaPlaylist:
+    def __init__(self, url):
+        self.url = url
+        self.segments = []
+        self.init_segment = None        # Segment from #EXT-X-MAP (fMP4 streams)
+        self.encrypted = False
+        self.media_sequence = 0
+
+    @property
+    def duration(self):
+        return sum(s.duration for s in self.segments)
+
+    @property
+    def is_fmp4(self):
+        return self.init_segment is not None
+
+
+def _parse_attributes(text):
+    attrs = {}
+    for key, val in _ATTR_RE.findall(text):
+        attrs[key] = val.strip('"')
+    return attrs
+
+
+def _parse_byterange(value, prev_end):
+    length, _, offset = value.partition("@")
+    length = int(length)
+    start = int(offset) if offset else prev_end
+    return length, start
+
+
+def parse_master_playlist(text, base_url):
+    """
+    Returns a list of variant dicts:
+      { "uri", "bandwidth", "height", "codecs", "audio" }
+    or [] if `text` is already a media playlist.
+    """
+    variants = []
+    audio_groups = {}   # GROUP-ID → has its own URI
+    pending = None
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-MEDIA:"):
+            attrs = _parse_attributes(line.split(":", 1)[1])
+            if attrs.get("TYPE") == "AUDIO":
+                audio_groups[attrs.get("GROUP-ID")] = bool(attrs.get("URI"))
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            attrs = _parse_attributes(line.split(":", 1)[1])
+            height = 0
+            if "RESOLUTION" in attrs and "x" in attrs["RESOLUTION"]:
+                try:
+                    height = int(attrs["RESOLUTION"].split("x", 1)[1])
+                except ValueError:
+                    height = 0
+            pending = {
+                "bandwidth": int(attrs.get("BANDWIDTH", "0") or 0),
+                "height": height,
+                "codecs": attrs.get("CODECS", ""),
+                "audio": attrs.get("AUDIO"),
+            }
+        elif pending is not None and not line.startswith("#"):
+            pending["uri"] = urljoin(base_url, line)
+            variants.append(pending)
+            pending = None
+
+    for v in variants:
+        v["separate_audio"] = bool(v["audio"] and audio_groups.get(v["audio"]))
+    return variants
+
+
+def pick_variant(variants, max_height=HLS_MAX_HEIGHT):
+    """
+    Highest-bandwidth variant, optionally capped at `max_height`.
+    """
+    candidates = variants
+    if max_height:
+        capped = [v for v in variants if 0 < v["height"] <= max_height]
+        candidates = capped or variants
+    return max(candidates, key=lambda v: (v["height"], v["bandwidth"]))
+
+
+def parse_media_playlist(text, base_url):
+    playlist = MediaPlaylist(base_url)
+    duration = None
+    byterange = None
+    prev_end = 0
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith("#EXTINF:"):
+            try:
+                duration = float(line[len("#EXTINF:"):].split(",", 1)[0])
+            except ValueError:
+                duration = 0.0
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            byterange = _parse_byterange(line.split(":", 1)[1], prev_end)
+        elif line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            try:
+                playlist.media_sequence = int(line.split(":", 1)[1])
+            except ValueError:
+                pass
+        elif line.startswith("#EXT-X-KEY:"):
+            attrs = _parse_attributes(line.split(":", 1)[1])
+            if attrs.get("METHOD", "NONE").upper() != "NONE":
+                playlist.encrypted = True
+        elif line.startswith("#EXT-X-MAP:"):
+            attrs = _parse_attributes(line.split(":", 1)[1])
+            map_range = None
+            if "BYTERANGE" in attrs:
+                map_range = _parse_byterange(attrs["BYTERANGE"], 0)
+            playlist.init_segment = Segment(urljoin(base_url, attrs["URI"]), 0.0, map_range)
+        elif not line.startswith("#"):
+            seg = Segment(urljoin(base_url, line), duration or 0.0, byterange)
+            if byterange:
+                prev_end = byterange[1] + byterange[0]
+            playlist.segments.append(seg)
+            duration = None
+            byterange = None
+    return playlist
+
+
+def _fetch_text(url):
+    resp = get_session().get(url, timeout=HLS_SEGMENT_TIMEOUT)
+    resp.raise_for_status()
+    return resp.text
+
+
+# Codec families (CODECS attribute prefixes) that `-c copy` can put in MP4
+_MP4_VIDEO = ("avc1", "avc3", "hvc1", "hev1", "av01", "vp09")
+_MP4_AUDIO = ("mp4a", "ac-3", "ec-3", "opus", "flac")
+_VIDEO_PREFIXES = _MP4_VIDEO + ("mp4v", "vp08", "theora", "dvh1", "dvhe")
+
+
+class StreamProbe:
+    """
+    What one look at the playlist(s) says about a stream, before any
+    segment is fetched:
+
+      host          – hostname of `url`, for per-host tier memory
+      playlist      – MediaPlaylist, or None when it could not be loaded
+      variant       – the chosen master-playlist variant, or None
+      error         – the exception that stopped loading, or None
+      native_reason – why the native downloader can't take it, or None
+      codecs        – the variant's CODECS attribute ("" when unknown)
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.host = urlsplit(url).hostname or ""
+        self.playlist = None
+        self.variant = None
+        self.error = None
+        self.native_reason = None
+        self.codecs = ""
+
+    @property
+    def reachable(self):
+        return self.playlist is not None
+
+    @property
+    def native_ok(self):
+        return self.reachable and self.native_reason is None
+
+    @property
+    def duration(self):
+        return self.playlist.duration if self.playlist is not None else None
+
+    @property
+    def mp4_copyable(self):
+        """
+        False when the advertised codecs can't be stream-copied into MP4
+        (a re-encode is unavoidable); True/None when they can / are unknown.
+        """
+        codecs = [c.strip().lower() for c in self.codecs.split(",") if c.strip()]
+        if not codecs:
+            return None
+        for codec in codecs:
+            if codec.startswith(_VIDEO_PREFIXES):
+                if not codec.startswith(_MP4_VIDEO):
+                    return False
+            elif not codec.startswith(_MP4_AUDIO):
+                return False
+        return True
+
+    def describe(self):
+        if not self.reachable:
+            return f"unreachable ({self.error})"
+        return (f"{len(self.playlist.segments)} segments, {self.duration:.0f}s, "
+                f"codecs={self.codecs or '?'}, fmp4={self.playlist.is_fmp4}, "
+                f"native={self.native_reason or 'ok'}")
+
+
+class ProbeCache:
+    """
+    Thread-safe TTL + LRU cache of StreamProbes keyed by source URL, so
+    the streaming attempt, every download tier and a retried job all work
+    from one read of the playlist. Only probes that reached the playlist
+    are kept; a failed one is retried on the next lookup.
+    """
+
+    def __init__(self, ttl=PROBE_CACHE_TTL, max_entries=PROBE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()   # url → (probe, fresh_until)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and now < entry[1]:
+                self._entries.move_to_end(url)
+                self.hits += 1
+                return entry[0]
+            self._entries.pop(url, None)
+            self.misses += 1
+            return None
+
+    def put(self, url, probe):
+        if self.ttl <= 0 or not probe.reachable:
+            return
+        with self._lock:
+            self._entries.pop(url, None)
+            self._entries[url] = (probe, time.monotonic() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+probe_cache = ProbeCache()
+
+
+def probe_stream(hls_link, fresh=False):
+    """
+    Fetches `hls_link` (and the chosen variant, for a master playlist) and
+    returns a StreamProbe; a cached one for the same URL unless `fresh`.
+    Never raises: a failure is recorded on the probe.
+    """
+    if not fresh:
+        cached = probe_cache.get(hls_link)
+        if cached is not None:
+            return cached
+    probe = _probe_stream(hls_link)
+    probe_cache.put(hls_link, probe)
+    return probe
+
+
+def _probe_stream(hls_link):
+    probe = StreamProbe(hls_link)
+    try:
+        text = _fetch_text(hls_link)
+        if not text.lstrip().startswith("#EXTM3U"):
+            raise HlsError("not an m3u8 playlist")
+
+        variants = parse_master_playlist(text, hls_link)
+        if variants:
+            probe.variant = pick_variant(variants)
+            probe.codecs = probe.variant["codecs"]
+            text = _fetch_text(probe.variant["uri"])
+            playlist = parse_media_playlist(text, probe.variant["uri"])
+        else:
+            playlist = parse_media_playlist(text, hls_link)
+        if not playlist.segments:
+            raise HlsError("media playlist has no segments")
+    except Exception as e:
+        probe.error = e
+        return probe
+
+    probe.playlist = playlist
+    if probe.variant and probe.variant["separate_audio"]:
+        probe.native_reason = "variant uses a separate audio rendition"
+    elif playlist.encrypted:
+        probe.native_reason = "encrypted HLS is not supported natively"
+    return probe
+
+
+def load_playlist(hls_link, probe=None):
+    """
+    Fetches `hls_link`; if it is a master playlist, picks a variant and
+    fetches that. Returns a MediaPlaylist (plus the chosen variant or None).
+    An earlier probe_stream() result can be passed in to skip the fetch.
+    """
+    probe = probe or probe_stream(hls_link)
+    if probe.error is not None:
+        raise probe.error
+    if probe.native_reason:
+        raise HlsError(probe.native_reason)
+    return probe.playlist, probe.variant
+
+
+class _Progress:
+    """
+    Byte counter shared by the segment workers; reports through the
+    download_and_rename_video() progress_callback signature.
+
+    `resumed_bytes` / `resumed_duration` describe what was already on disk
+    from an earlier attempt: they count towards size and percent, but not
+    towards speed and ETA.
+    """
+
+    def __init__(self, total_duration, progress_callback, interval=1.0,
+                 resumed_bytes=0, resumed_duration=0.0):
+        self.total_duration = total_duration
+        self.callback = progress_callback
+        self.interval = interval
+        self.start = time.time()
+        self.resumed_bytes = resumed_bytes
+        self.resumed_duration = resumed_duration
+        self.bytes = resumed_bytes
+        self.done_duration = resumed_duration
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def add_bytes(self, n):
+        with self._lock:
+            self.bytes += n
+        self.maybe_report()
+
+    def segment_done(self, duration):
+        with self._lock:
+            self.done_duration += duration
+        self.maybe_report()
+
+    def maybe_report(self, force=False):
+        if not self.callback:
+            return
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last < self.interval:
+                return
+            self._last = now
+            size_mb = self.bytes / (1024 * 1024)
+            new_mb = (self.bytes - self.resumed_bytes) / (1024 * 1024)
+            done = self.done_duration
+        elapsed = now - self.start
+        total = self.total_duration
+        pct = (done / total * 100) if total > 0 else 0.0
+        speed = (new_mb / elapsed) if elapsed > 0 else 0.0
+        new_done = done - self.resumed_duration
+        eta = (elapsed * (total - done) / new_done) if new_done > 0 else 0.0
+        try:
+            self.callback(size_mb, total, pct, speed, elapsed, eta)
+        except Exception as e:
+            logger.debug("progress_callback raised: %s", e)
+
+
+# ——————————————————————————————————————————————————————————————
+# Segment journal (resume support)
+# ——————————————————————————————————————————————————————————————
+# Next to the partial file we keep an append-only journal:
+#   line 1:  {"signature": …, "segments": N}
+#   line 2+: "<segment index> <end offset in the partial file>"
+# Segments are written strictly in order, so the journal always describes a
+# contiguous prefix. On resume the partial file is truncated to the last
+# journaled offset it actually contains and fetching restarts from there.
+
+def playlist_signature(playlist):
+    """
+    Identifies the media, not the (re-signed, expiring) URLs: segment paths
+    without query strings plus their durations.
+    """
+    h = hashlib.sha1()
+    for seg in ([playlist.init_segment] if playlist.init_segment else []) + playlist.segments:
+        h.update(urlsplit(seg.uri).path.encode())
+        h.update(f"|{seg.duration:.3f}|{seg.byterange}\n".encode())
+    return h.hexdigest()
+
+
+def _read_journal(journal_path, signature, part_path):
+    """
+    Returns (segments_done, byte_offset) usable for resuming, or (0, 0).
+    """
+    try:
+        with open(journal_path, "r") as f:
+            header = json.loads(f.readline())
+            if header.get("signature") != signature:
+                return 0, 0
+            entries = []
+            for line in f:
+                parts = line.split()
+                if len(parts) != 2:
+                    break       # torn final write
+                entries.append((int(parts[0]), int(parts[1])))
+        on_disk = os.path.getsize(part_path)
+    except (OSError, ValueError):
+        return 0, 0
+
+    done, offset = 0, 0
+    for expected, (idx, end) in enumerate(entries):
+        if idx != expected or end > on_disk:
+            break
+        done, offset = idx + 1, end
+    return done, offset
+
+
+def discard_partial(output_path):
+    """
+    Removes the partial segment file(s) and journal kept for `output_path`.
+    """
+    for path in (output_path + ".part.ts", output_path + ".part.m4s", output_path + ".journal"):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _fetch_segment(seg, progress, cancel=None):
+    headers = {}
+    if seg.byterange:
+        length, offset = seg.byterange
+        headers["Range"] = f"bytes={offset}-{offset + length - 1}"
+
+    last_error = None
+    for attempt in range(HLS_SEGMENT_RETRIES + 1):
+        if attempt:
+            if cancel is not None:
+                cancel.wait(backoff_delay(attempt))
+            else:
+                time.sleep(backoff_delay(attempt))
+        raise_if_cancelled(cancel, "segment fetch")
+        received = 0
+        try:
+            with get_session().get(seg.uri, headers=headers, stream=True,
+                                   timeout=HLS_SEGMENT_TIMEOUT) as resp, \
+                    on_cancel(cancel, resp.close):
+                resp.raise_for_status()
+                chunks = []
+                for chunk in resp.iter_content(chunk_size=64 * 1024):
+                    raise_if_cancelled(cancel, "segment fetch")
+                    if chunk:
+                        chunks.append(chunk)
+                        received += len(chunk)
+                        progress.add_bytes(len(chunk))
+                data = b"".join(chunks)
+            expected = resp.headers.get("Content-Length")
+            if expected and expected.isdigit() and int(expected) != len(data):
+                raise IOError(f"short read ({len(data)}/{expected} bytes)")
+            raise_if_cancelled(cancel, "segment fetch")     # a closed response may just end early
+            return data
+        except Exception as e:
+            # don't double-count bytes of a failed attempt
+            progress.add_bytes(-received)
+            # closing the response to abort it surfaces as a read error
+            raise_if_cancelled(cancel, "segment fetch")
+            last_error = e
+            logger.debug("Segment %s attempt %d failed: %s", seg.uri, attempt + 1, e)
+    raise HlsError(f"segment failed after {HLS_SEGMENT_RETRIES + 1} attempts: {last_error}")
+
+
+def iter_segments(playlist, progress, workers=HLS_WORKERS, start_idx=0, cancel=None):
+    """
+    Yields (index, segment, data) in playlist order from `start_idx` on,
+    with `workers` parallel requests running ahead; at most 2×workers
+    segments are held in memory at once. The #EXT-X-MAP init segment, if
+    any, comes first (index -1) unless resuming.
+
+    When the `cancel` token fires, queued fetches are dropped, in-flight
+    responses are closed and OperationCancelled is raised.
+    """
+    window = max(1, workers) * 2
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="hls") as pool:
+        if playlist.init_segment is not None and not start_idx:
+            yield -1, playlist.init_segment, _fetch_segment(playlist.init_segment, progress, cancel)
+
+        segments = iter(enumerate(playlist.segments[start_idx:], start=start_idx))
+        pending = deque()
+        for idx, seg in segments:
+            pending.append((idx, seg, pool.submit(_fetch_segment, seg, progress, cancel)))
+            if len(pending) >= window:
+                break
+        try:
+            while pending:
+                idx, seg, fut = pending.popleft()
+                data = fut.result()
+                nxt = next(segments, None)
+                if nxt is not None:
+                    pending.append((nxt[0], nxt[1], pool.submit(_fetch_segment, nxt[1], progress, cancel)))
+                yield idx, seg, data
+        except BaseException:
+            for _, _, fut in pending:
+                fut.cancel()
+            raise
+
+
+def download_segments(playlist, out_path, progress_callback=None, workers=HLS_WORKERS,
+                      journal_path=None, cancel=None):
+    """
+    Fetches every segment of `playlist` (see iter_segments) and writes them
+    to `out_path` in playlist order.
+
+    With `journal_path`, every written segment is journaled and an earlier
+    partial `out_path` for the same playlist is continued from the first
+    missing segment instead of being downloaded again.
+    """
+    signature = playlist_signature(playlist)
+    start_idx, offset = 0, 0
+    if journal_path and os.path.exists(out_path):
+        start_idx, offset = _read_journal(journal_path, signature, out_path)
+
+    journal = None
+    if start_idx:
+        logger.info("Resuming %s at segment %d/%d (%.1f MB on disk)",
+                    out_path, start_idx, len(playlist.segments), offset / (1024 * 1024))
+        out = open(out_path, "r+b")
+        out.truncate(offset)
+        out.seek(offset)
+        journal = open(journal_path, "a")
+    else:
+        out = open(out_path, "wb")
+        if journal_path:
+            journal = open(journal_path, "w")
+            journal.write(json.dumps({"signature": signature,
+                                      "segments": len(playlist.segments)}) + "\n")
+            journal.flush()
+
+    resumed_duration = sum(seg.duration for seg in playlist.segments[:start_idx])
+    progress = _Progress(playlist.duration, progress_callback,
+                         resumed_bytes=offset, resumed_duration=resumed_duration)
+
+    try:
+        for idx, seg, data in iter_segments(playlist, progress, workers, start_idx, cancel):
+            out.write(data)
+            if idx < 0:
+                continue
+            if journal:
+                # data first, then the journal entry that vouches for it
+                out.flush()
+                journal.write(f"{idx} {out.tell()}\n")
+                journal.flush()
+            progress.segment_done(seg.duration)
+    finally:
+        out.close()
+        if journal:
+            journal.close()
+
+    progress.maybe_report(force=True)
+    return progress.bytes
+
+
+def with_subtitle(cmd, subtitle_path, language="eng"):
+    """
+    Adds `subtitle_path` (a WebVTT file) to an ffmpeg remux command as a
+    soft-subtitle track: a second input, mapped after the video and audio
+    and converted to mov_text, the text format MP4 carries. Only the text
+    is converted; audio and video keep whatever codec options `cmd` has,
+    so a `-c copy` pass stays a single stream copy. The output path must
+    be the last argument. No `subtitle_path` returns `cmd` unchanged.
+    """
+    if not subtitle_path:
+        return list(cmd)
+    after_input = cmd.index("-i") + 2
+    return (cmd[:after_input] + ["-i", subtitle_path] + cmd[after_input:-1]
+            + ["-map", "0:v", "-map", "0:a?", "-map", "1:s",
+               # after any "-c copy", so it wins for the subtitle stream
+               "-c:s", "mov_text", "-metadata:s:s:0", f"language={language}",
+               cmd[-1]])
+
+
+def remux_to_mp4(src_path, output_path, is_fmp4=False, cancel=None, subtitle_path=None):
+    """
+    Single local `ffmpeg -c copy` pass from the concatenated segments to MP4,
+    muxing in `subtitle_path` as a soft subtitle if given.
+    Returns ffmpeg's exit code.
+    """
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", src_path, "-c", "copy"]
+    if not is_fmp4:
+        cmd += ["-bsf:a", "aac_adtstoasc"]
+    cmd += ["-movflags", "+faststart", output_path]
+    return run_ffmpeg(with_subtitle(cmd, subtitle_path), cancel=cancel).returncode
+
+
+def download_hls(hls_link, output_path, progress_callback=None, workers=HLS_WORKERS,
+                 resume=True, probe=None, cancel=None, subtitle_path=None):
+    """
+    Native HLS download: playlist → parallel segment fetch → in-order
+    concatenation → one local `ffmpeg -c copy` remux into `output_path`
+    (with `subtitle_path` muxed in as a soft subtitle, if given).
+
+    The segments are staged in "<output_path>.part.ts" (or ".part.m4s").
+    With `resume`, a journal next to it lets a retried or restarted job
+    continue from the first missing segment; the staged data is kept when
+    the download fails and only dropped once the MP4 is complete. The MP4
+    itself is written under a temporary name and renamed into place, so
+    `output_path` never holds a half-written file.
+
+    Raises HlsError when the stream has to go through yt-dlp/ffmpeg
+    instead, or RemuxError (staged data kept) when only the remux failed.
+    When the `cancel` token fires, fetches and ffmpeg are stopped, the
+    staged data is deleted and OperationCancelled is raised.
+    """
+    playlist, variant = load_playlist(hls_link, probe)
+    if variant:
+        logger.info(
+            "HLS variant %sp @ %d bps, %d segments, %.0fs",
+            variant["height"] or "?", variant["bandwidth"],
+            len(playlist.segments), playlist.duration
+        )
+
+    part_path = output_path + (".part.m4s" if playlist.is_fmp4 else ".part.ts")
+    journal_path = (output_path + ".journal") if resume else None
+    tmp_output = output_path + ".tmp.mp4"
+
+    try:
+        return _download_and_remux(playlist, part_path, output_path, tmp_output, journal_path,
+                                   progress_callback, workers, cancel, subtitle_path)
+    except OperationCancelled:
+        discard_partial(output_path)
+        try:
+            os.remove(tmp_output)
+        except OSError:
+            pass
+        raise
+
+
+def _download_and_remux(playlist, part_path, output_path, tmp_output, journal_path,
+                        progress_callback, workers, cancel, subtitle_path):
+    fetch_started = time.monotonic()
+    with tracing.span("download", tier="native") as sp:
+        total = download_segments(playlist, part_path, progress_callback, workers, journal_path, cancel)
+        sp["bytes"] = total
+    fetch_seconds = max(time.monotonic() - fetch_started, 1e-6)
+    logger.info("Fetched %.1f MB of segments for %s", total / (1024 * 1024), output_path)
+    HLS_BYTES.inc(total)
+    HLS_THROUGHPUT.observe(total / fetch_seconds / (1024 * 1024))
+
+    remux_started = time.monotonic()
+    with tracing.span("remux", tier="native") as sp:
+        code = remux_to_mp4(part_path, tmp_output, playlist.is_fmp4, cancel, subtitle_path)
+        sp["ok"] = code == 0
+    observe_remux("native", remux_started, code == 0)
+    if code != 0:
+        try:
+            os.remove(tmp_output)
+        except OSError:
+            pass
+        # the caller retries other remux options on the staged data, then
+        # discards it; resuming from it would only repeat this failure
+        raise RemuxError(code, part_path, playlist.is_fmp4)
+
+    os.replace(tmp_output, output_path)
+    discard_partial(output_path)
+    return output_path
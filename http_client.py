@@ -0,0 +1,192 @@
+# http_client.py
+
+import os
+import random
+import asyncio
+import threading
+import weakref
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+# Number of per-host connection pools kept alive at once.
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "10"))
+# Max keep-alive connections kept per host.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+# Retries for connection errors and 429/5xx responses.
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+# Base of the exponential backoff, in seconds (0.5 → 0.5s, 1s, 2s, …).
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+# Upper bound of the random jitter added to every backoff sleep.
+HTTP_BACKOFF_JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", "0.5"))
+
+DEFAULT_TIMEOUT = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+# aiohttp sessions are bound to the loop they were created on
+_async_sessions = weakref.WeakKeyDictionary()   # loop → aiohttp.ClientSession
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class JitterRetry(Retry):
+    """
+    urllib3 Retry with a random jitter added on top of the exponential
+    backoff, so that many threads failing at the same moment don't all
+    hammer the API again in lockstep.
+    """
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return 0
+        return backoff + random.uniform(0, HTTP_BACKOFF_JITTER)
+
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff with jitter for hand-rolled retry loops, matching
+    the policy of the pooled sessions.
+    """
+    if attempt <= 0:
+        return 0
+    return HTTP_BACKOFF * (2 ** (attempt - 1)) + random.uniform(0, HTTP_BACKOFF_JITTER)
+
+
+def _build_session():
+    retry = JitterRetry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=HTTP_RETRIES,
+        status=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_HOSTS,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=retry,
+        pool_block=False,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def get_session():
+    """
+    Returns the process-wide pooled `requests.Session`.
+
+    The session is created lazily on first use. Its urllib3 pools are
+    thread-safe, so every worker thread shares the same keep-alive
+    connections to ANIWATCH_API_BASE (and any other host we talk to).
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+                logger.info(
+                    "HTTP pool ready (hosts=%d, per-host=%d, retries=%d)",
+                    HTTP_POOL_HOSTS, HTTP_POOL_SIZE, HTTP_RETRIES
+                )
+    return _session
+
+
+def http_get(url, params=None, timeout=DEFAULT_TIMEOUT, **kwargs):
+    """
+    GET through the shared pool. Same arguments as `requests.get`.
+    """
+    return get_session().get(url, params=params, timeout=timeout, **kwargs)
+
+
+def close_session():
+    """
+    Closes every pooled connection (e.g. on shutdown). The next call to
+    `get_session()` builds a fresh session.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+# ——————————————————————————————————————————————————————————————
+# asyncio side (aiohttp) — same pool sizes and retry policy
+# ——————————————————————————————————————————————————————————————
+def get_async_session():
+    """
+    Returns the aiohttp session for the running event loop, creating it on
+    first use. Must be called from inside a coroutine.
+    """
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_SIZE * HTTP_POOL_HOSTS,
+            limit_per_host=HTTP_POOL_SIZE,
+            keepalive_timeout=60,
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        _async_sessions[loop] = session
+    return session
+
+
+async def async_http_get_json(url, params=None, timeout=DEFAULT_TIMEOUT):
+    """
+    GET `url` and decode its JSON body. Retries connection errors and
+    429/5xx like the sync session does.
+
+    Returns (status_code, json_or_None). Statuses >= 400 other than the
+    retried ones are returned to the caller rather than raised, so that
+    callers can special-case e.g. 404.
+    """
+    import aiohttp
+
+    session = get_async_session()
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    attempt = 0
+    while True:
+        try:
+            async with session.get(url, params=params, timeout=client_timeout) as resp:
+                if resp.status in RETRY_STATUSES and attempt < HTTP_RETRIES:
+                    retry_after = resp.headers.get("Retry-After")
+                    attempt += 1
+                    delay = float(retry_after) if (retry_after or "").isdigit() else backoff_delay(attempt)
+                    await asyncio.sleep(delay)
+                    continue
+                if resp.status >= 400:
+                    return resp.status, None
+                return resp.status, await resp.json(content_type=None)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt >= HTTP_RETRIES:
+                raise
+            attempt += 1
+            await asyncio.sleep(backoff_delay(attempt))
+
+
+async def close_async_session():
+    """
+    Closes the aiohttp session of the running loop, if any.
+    """
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
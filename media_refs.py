@@ -0,0 +1,85 @@
+# media_refs.py
+
+import os
+import json
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+MEDIA_REFS_PATH = os.getenv("MEDIA_REFS_PATH", "media_refs.json")
+
+
+class MediaRefStore:
+    """
+    Persistent map from (episode id, variant) to the Telegram message that
+    already carries that file, so a repeat request can be answered by
+    reference (copy / file_id) instead of uploading the bytes again.
+
+    Each record is:
+      { "chat_id": …, "message_id": …, "file_id": … or None, "saved_at": … }
+    """
+
+    def __init__(self, path=MEDIA_REFS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._refs = {}
+        try:
+            with open(path) as f:
+                self._refs = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable %s: %s", path, e)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(episode_id, variant):
+        return f"{episode_id}|{variant}"
+
+    def get(self, episode_id, variant):
+        with self._lock:
+            ref = self._refs.get(self.key(episode_id, variant))
+            if ref:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return dict(ref) if ref else None
+
+    def has(self, episode_id, variant):
+        """
+        Cheap existence check that does not count as a lookup.
+        """
+        with self._lock:
+            return self.key(episode_id, variant) in self._refs
+
+    def put(self, episode_id, variant, chat_id, message_id, file_id=None):
+        with self._lock:
+            self._refs[self.key(episode_id, variant)] = {
+                "chat_id": chat_id,
+                "message_id": message_id,
+                "file_id": file_id,
+                "saved_at": time.time(),
+            }
+            self._save()
+
+    def forget(self, episode_id, variant):
+        with self._lock:
+            if self._refs.pop(self.key(episode_id, variant), None) is not None:
+                self._save()
+
+    def _save(self):
+        # caller holds self._lock
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self._refs, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("Could not persist %s: %s", self.path, e)
+
+    def stats(self):
+        with self._lock:
+            return {"refs": len(self._refs), "hits": self.hits, "misses": self.misses}
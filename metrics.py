@@ -0,0 +1,203 @@
+# metrics.py
+
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket upper bounds (the +Inf bucket is implicit)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800)
+THROUGHPUT_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100)     # MB/s
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{_escape(v)}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}       # label values → total
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(self.labels, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series = {}       # label values → [bucket counts…, sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the wall time of the `with` block, also when it raises.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    extra = (("le", _number(float(bound))),)
+                    lines.append(f"{self.name}_bucket{_labels_text(self.labels, key, extra)} {count}")
+                inf = (("le", "+Inf"),)
+                lines.append(f"{self.name}_bucket{_labels_text(self.labels, key, inf)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels_text(self.labels, key)} {_number(series[-2])}")
+                lines.append(f"{self.name}_count{_labels_text(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """
+    Metrics rendered in the Prometheus text exposition format.
+
+    Counters and histograms are updated where the work happens; gauges
+    are read at scrape time from collector callbacks that return
+    [(metric_name, help, {label: value} or {}, value), …], so components
+    only need their existing stats().
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets, labels=()):
+        metric = Histogram(name, help_text, buckets, labels)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, fn):
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+
+        gauges = {}     # name → (help, [(labels, value)])
+        for fn in collectors:
+            try:
+                samples = fn()
+            except Exception as e:
+                logger.warning("Metrics collector %s failed: %s", getattr(fn, "__name__", fn), e)
+                continue
+            for name, help_text, labels, value in samples:
+                gauges.setdefault(name, (help_text, []))[1].append((labels, value))
+        for name, (help_text, samples) in sorted(gauges.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for labels, value in samples:
+                names, values = zip(*sorted(labels.items())) if labels else ((), ())
+                lines.append(f"{name}{_labels_text(names, values)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ——————————————————————————————————————————————————————————————
+# Pipeline metrics
+# ——————————————————————————————————————————————————————————————
+SCRAPER_SECONDS = REGISTRY.histogram(
+    "aniwatch_request_seconds", "AniWatch API call latency (cache misses only).",
+    LATENCY_BUCKETS, labels=("endpoint",)
+)
+HLS_BYTES = REGISTRY.counter(
+    "hls_download_bytes_total", "Bytes of HLS segments fetched by the native downloader."
+)
+HLS_THROUGHPUT = REGISTRY.histogram(
+    "hls_download_throughput_mb_per_second", "Native HLS download throughput per episode.",
+    THROUGHPUT_BUCKETS
+)
+REMUX_SECONDS = REGISTRY.histogram(
+    "ffmpeg_remux_seconds", "Time spent per download/remux fallback tier.",
+    DURATION_BUCKETS, labels=("tier", "outcome")
+)
+UPLOAD_BYTES = REGISTRY.counter(
+    "telethon_upload_bytes_total", "Bytes uploaded through Telethon.", labels=("method",)
+)
+UPLOAD_THROUGHPUT = REGISTRY.histogram(
+    "telethon_upload_throughput_mb_per_second", "Telethon upload throughput per file.",
+    THROUGHPUT_BUCKETS, labels=("method",)
+)
+
+
+def observe_remux(tier, started, ok):
+    REMUX_SECONDS.observe(time.monotonic() - started, tier=tier, outcome="ok" if ok else "failed")
+
+
+def observe_upload(method, nbytes, seconds):
+    UPLOAD_BYTES.inc(nbytes, method=method)
+    UPLOAD_THROUGHPUT.observe(nbytes / max(seconds, 1e-6) / (1024 * 1024), method=method)
+
+
+def render():
+    return REGISTRY.render()
+
+
+def flask_view():
+    """
+    `/metrics` route for a Flask app.
+    """
+    return render(), 200, {"Content-Type": CONTENT_TYPE}
@@ -0,0 +1,211 @@
+# outbox.py
+
+import os
+import time
+import threading
+import logging
+from collections import deque
+from concurrent.futures import Future
+
+from telegram.error import RetryAfter
+
+from progress_dispatcher import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))   # requests / s, all chats
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))        # requests / s, per chat
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "8"))              # concurrent Bot API calls
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "5"))      # RetryAfter rounds per request
+
+# Lower value = sent first
+PRIORITY_HIGH = 0       # finished files, copies
+PRIORITY_NORMAL = 1     # status / error messages, deletions
+PRIORITY_LOW = 2        # progress edits
+
+_PRIORITY_NAMES = {PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal", PRIORITY_LOW: "low"}
+
+
+class _Request:
+    __slots__ = ("fn", "args", "kwargs", "chat_id", "priority", "retry", "seq",
+                 "enqueued", "not_before", "attempts", "future")
+
+    def __init__(self, fn, args, kwargs, chat_id, priority, retry, seq):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.priority = priority
+        self.retry = retry
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.not_before = 0.0
+        self.attempts = 0
+        self.future = Future()
+
+
+class BotOutbox:
+    """
+    Outbound Bot API request queue.
+
+    Every request waits for a global and a per-chat token (Telegram's
+    ~30 messages/s overall and ~1/s per chat), is picked in priority order
+    (then FIFO), and runs on one of a few worker threads. A RetryAfter
+    re-schedules the request after the advised delay instead of dropping
+    it, and holds back the whole chat meanwhile; requests queued with
+    retry=False (progress edits, which a newer value replaces anyway) get
+    the RetryAfter raised instead.
+    """
+
+    def __init__(self, global_rate=OUTBOX_GLOBAL_RATE, chat_rate=OUTBOX_CHAT_RATE,
+                 workers=OUTBOX_WORKERS, max_retries=OUTBOX_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._queue = []                # _Request, scanned in (priority, seq) order
+        self._global = TokenBucket(global_rate, max(1.0, global_rate))
+        self._chats = {}                # chat_id → TokenBucket
+        self._seq = 0
+        self._threads = []
+        self._waits = deque(maxlen=1000)    # (priority, seconds queued before running)
+        self.executed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"outbox-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    # ── enqueueing ───────────────────────────────────────────────────────
+    def submit(self, fn, args=(), kwargs=None, chat_id=None, priority=PRIORITY_NORMAL, retry=True):
+        """
+        Queues `fn(*args, **kwargs)`, rate-limited as a request to `chat_id`;
+        returns a concurrent.futures.Future.
+        """
+        with self._cond:
+            self._seq += 1
+            req = _Request(fn, tuple(args), kwargs or {}, chat_id, priority, retry, self._seq)
+            self._queue.append(req)
+            self._queue.sort(key=lambda r: (r.priority, r.seq))
+            self._cond.notify()
+        return req.future
+
+    def call(self, fn, args=(), kwargs=None, chat_id=None, priority=PRIORITY_NORMAL, retry=True):
+        """
+        Blocking submit(): returns fn's result or raises its exception.
+        """
+        return self.submit(fn, args, kwargs, chat_id, priority, retry).result()
+
+    def wrap(self, fn, priority, chat_arg=0, retry=True):
+        """
+        Returns a drop-in replacement for a bot method that goes through the
+        queue. The chat is taken from `chat_id=` or positional `chat_arg`.
+        """
+        def queued(*args, **kwargs):
+            chat_id = kwargs.get("chat_id")
+            if chat_id is None and chat_arg is not None and len(args) > chat_arg:
+                chat_id = args[chat_arg]
+            return self.call(fn, args, kwargs, chat_id, priority, retry)
+
+        queued.__name__ = getattr(fn, "__name__", "queued")
+        return queued
+
+    # ── dispatch ─────────────────────────────────────────────────────────
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, 1.0)
+        return bucket
+
+    def _next_ready(self):
+        # caller holds self._cond; returns (request, None) or (None, wait seconds)
+        now = time.monotonic()
+        global_wait = self._global.wait_time(now)
+        wait = None
+        for i, req in enumerate(self._queue):
+            ready_in = max(req.not_before - now, global_wait)
+            if req.chat_id is not None:
+                ready_in = max(ready_in, self._chat_bucket(req.chat_id).wait_time(now))
+            if ready_in <= 0:
+                del self._queue[i]
+                self._global.take()
+                if req.chat_id is not None:
+                    self._chats[req.chat_id].take()
+                return req, None
+            wait = ready_in if wait is None else min(wait, ready_in)
+        return None, wait
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                req, wait = self._next_ready()
+                while req is None:
+                    self._cond.wait(wait)
+                    req, wait = self._next_ready()
+                if req.attempts == 0:
+                    self._waits.append((req.priority, time.monotonic() - req.enqueued))
+            self._execute(req)
+
+    def _execute(self, req):
+        req.attempts += 1
+        try:
+            result = req.fn(*req.args, **req.kwargs)
+        except RetryAfter as e:
+            delay = float(e.retry_after)
+            if not req.retry or req.attempts > self.max_retries:
+                with self._cond:
+                    self.failed += 1
+                req.future.set_exception(e)
+                return
+            logger.info("RetryAfter %.0fs for chat %s; re-queued (attempt %d)",
+                        delay, req.chat_id, req.attempts)
+            with self._cond:
+                self.retried += 1
+                now = time.monotonic()
+                req.not_before = now + delay
+                if req.chat_id is not None:
+                    self._chat_bucket(req.chat_id).block(now, delay)
+                self._queue.append(req)
+                self._queue.sort(key=lambda r: (r.priority, r.seq))
+                self._cond.notify()
+            return
+        except Exception as e:
+            with self._cond:
+                self.failed += 1
+            req.future.set_exception(e)
+            return
+        with self._cond:
+            self.executed += 1
+        req.future.set_result(result)
+
+    # ── metrics ──────────────────────────────────────────────────────────
+    def stats(self):
+        with self._cond:
+            depth = {name: 0 for name in _PRIORITY_NAMES.values()}
+            for req in self._queue:
+                depth[_PRIORITY_NAMES.get(req.priority, str(req.priority))] += 1
+            waits = {}
+            for prio, name in _PRIORITY_NAMES.items():
+                samples = sorted(w for p, w in self._waits if p == prio)
+                if samples:
+                    waits[name] = {
+                        "p50": samples[len(samples) // 2],
+                        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+                        "max": samples[-1],
+                    }
+            return {
+                "depth": depth,
+                "wait_s": waits,
+                "executed": self.executed,
+                "retried": self.retried,
+                "failed": self.failed,
+            }
@@ -0,0 +1,216 @@
+# progress_dispatcher.py
+
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from telegram.error import RetryAfter, BadRequest
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+# Bot API budget for progress edits: all chats together, and per chat
+PROGRESS_GLOBAL_RATE = float(os.getenv("PROGRESS_GLOBAL_RATE", "20"))     # edits / s
+PROGRESS_CHAT_RATE = float(os.getenv("PROGRESS_CHAT_RATE", "0.5"))        # edits / s
+# Last-sent texts of messages idle this long are forgotten
+PROGRESS_IDLE_FORGET = float(os.getenv("PROGRESS_IDLE_FORGET", "600"))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now):
+        """
+        Seconds until a token is available (0 = available now).
+        """
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class ProgressDispatcher:
+    """
+    Single background thread that applies progress-message edits.
+
+    update() never blocks: it only records the newest text for a message,
+    replacing any edit still pending for it ("latest value wins"). The
+    thread sends pending edits in arrival order, within a global and a
+    per-chat token bucket, skips texts identical to what the message
+    already shows, and backs off a chat on RetryAfter. At most one edit
+    per message is in flight, so they can't land out of order.
+    """
+
+    def __init__(self, global_rate=PROGRESS_GLOBAL_RATE, chat_rate=PROGRESS_CHAT_RATE):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self._edit = None
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()   # (chat_id, message_id) → (text, parse_mode)
+        self._shown = {}                # (chat_id, message_id) → (text, monotonic time)
+        self._in_flight = set()         # (chat_id, message_id) with an edit not yet answered
+        self._global = TokenBucket(global_rate, max(1.0, global_rate))
+        self._chats = {}                # chat_id → TokenBucket
+        self._thread = None
+        self.sent = 0
+        self.coalesced = 0
+        self.unchanged = 0
+        self.retry_after = 0
+        self.failed = 0
+
+    def start(self, edit_fn):
+        """
+        `edit_fn(chat_id=…, message_id=…, text=…, parse_mode=…)` performs
+        the Bot API call and must let RetryAfter propagate. It may instead
+        return a concurrent.futures.Future of it (e.g. a queued request);
+        the thread then moves on and handles the outcome when it is done,
+        so one slow chat never holds up the others.
+        """
+        self._edit = edit_fn
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+            self._thread.start()
+
+    def update(self, chat_id, message_id, text, parse_mode="HTML"):
+        key = (chat_id, message_id)
+        with self._cond:
+            if key in self._pending:
+                self.coalesced += 1
+                # keep its place in line, just swap the text
+                self._pending[key] = (text, parse_mode)
+            else:
+                self._pending[key] = (text, parse_mode)
+                self._cond.notify()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, 1.0)
+        return bucket
+
+    def _next_ready(self):
+        """
+        Caller holds self._cond. Returns (key, text, parse_mode) ready to be
+        sent now, or (None, wait_seconds).
+        """
+        now = time.monotonic()
+        wait = None
+        global_wait = self._global.wait_time(now)
+        for key, (text, parse_mode) in list(self._pending.items()):
+            if key in self._in_flight:
+                continue        # sent once the current edit is answered
+            shown = self._shown.get(key)
+            if shown and shown[0] == text:
+                del self._pending[key]
+                self.unchanged += 1
+                continue
+            chat_wait = self._chat_bucket(key[0]).wait_time(now)
+            ready_in = max(chat_wait, global_wait)
+            if ready_in == 0:
+                del self._pending[key]
+                self._global.take()
+                self._chats[key[0]].take()
+                self._in_flight.add(key)
+                return (key, text, parse_mode), None
+            wait = ready_in if wait is None else min(wait, ready_in)
+        return None, wait
+
+    def _run(self):
+        last_prune = time.monotonic()
+        while True:
+            with self._cond:
+                job, wait = self._next_ready()
+                while job is None:
+                    self._cond.wait(wait)
+                    job, wait = self._next_ready()
+            (chat_id, message_id), text, parse_mode = job
+            self._send(chat_id, message_id, text, parse_mode)
+
+            now = time.monotonic()
+            if now - last_prune > 60:
+                last_prune = now
+                self._prune(now)
+
+    def _send(self, chat_id, message_id, text, parse_mode):
+        try:
+            result = self._edit(chat_id=chat_id, message_id=message_id, text=text, parse_mode=parse_mode)
+        except Exception as e:
+            self._done(chat_id, message_id, text, parse_mode, e)
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(
+                lambda f: self._done(chat_id, message_id, text, parse_mode,
+                                     None if f.cancelled() else f.exception())
+            )
+        else:
+            self._done(chat_id, message_id, text, parse_mode, None)
+
+    def _done(self, chat_id, message_id, text, parse_mode, error):
+        key = (chat_id, message_id)
+        try:
+            self._finish(key, text, parse_mode, error)
+        finally:
+            with self._cond:
+                self._in_flight.discard(key)
+                if key in self._pending:
+                    self._cond.notify()
+
+    def _finish(self, key, text, parse_mode, error):
+        if error is None:
+            with self._cond:
+                self.sent += 1
+                self._shown[key] = (text, time.monotonic())
+        elif isinstance(error, RetryAfter):
+            self.retry_after += 1
+            with self._cond:
+                self._chat_bucket(key[0]).block(time.monotonic(), float(error.retry_after))
+                # retry later unless a newer text arrived meanwhile
+                self._pending.setdefault(key, (text, parse_mode))
+        elif isinstance(error, BadRequest) and "not modified" in str(error).lower():
+            with self._cond:
+                self._shown[key] = (text, time.monotonic())
+        elif isinstance(error, BadRequest):
+            self.failed += 1    # message deleted, etc.
+            logger.debug("Progress edit for %s dropped: %s", key, error)
+        else:
+            self.failed += 1
+            logger.debug("Progress edit for %s failed: %s", key, error)
+
+    def _prune(self, now):
+        with self._cond:
+            for key in [k for k, (_, t) in self._shown.items() if now - t > PROGRESS_IDLE_FORGET]:
+                del self._shown[key]
+            active = {chat_id for chat_id, _ in self._pending}
+            for chat_id in [c for c, b in self._chats.items()
+                            if c not in active and now - b.updated > PROGRESS_IDLE_FORGET]:
+                del self._chats[chat_id]
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "sent": self.sent,
+                "coalesced": self.coalesced,
+                "unchanged": self.unchanged,
+                "retry_after": self.retry_after,
+                "failed": self.failed,
+            }
@@ -0,0 +1,312 @@
+# scheduler.py
+
+import os
+import json
+import time
+import uuid
+import threading
+import logging
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+SCHED_JOB_WORKERS = int(os.getenv("SCHED_JOB_WORKERS", "8"))        # jobs running at once
+SCHED_PER_CHAT = int(os.getenv("SCHED_PER_CHAT", "1"))              # running jobs per chat
+SCHED_QUEUE_PATH = os.getenv("SCHED_QUEUE_PATH", "job_queue.json")
+RESOLVE_CONCURRENCY = int(os.getenv("RESOLVE_CONCURRENCY", "4"))
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "2"))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "2"))
+
+
+class FairLimiter:
+    """
+    Counting semaphore for one pipeline stage (resolve / download / upload)
+    that hands freed permits to waiting chats in round-robin order, so a chat
+    with many queued episodes gets one turn per round like everybody else.
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = max(1, limit)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = OrderedDict()   # chat_id → deque[threading.Event], in turn order
+
+    def acquire(self, chat_id, cancel_event=None):
+        """
+        Blocks until a permit is granted. Returns False (without a permit)
+        if `cancel_event` is set while waiting.
+        """
+        with self._lock:
+            if self._active < self.limit and not self._waiting:
+                self._active += 1
+                return True
+            ticket = threading.Event()
+            self._waiting.setdefault(chat_id, deque()).append(ticket)
+
+        while not ticket.wait(0.5):
+            if cancel_event is not None and cancel_event.is_set():
+                with self._lock:
+                    if not ticket.is_set():
+                        queue = self._waiting.get(chat_id)
+                        queue.remove(ticket)
+                        if not queue:
+                            del self._waiting[chat_id]
+                        return False
+                # granted while we were giving up: hand the permit on
+                self.release()
+                return False
+        return True
+
+    def release(self):
+        with self._lock:
+            if not self._waiting:
+                self._active -= 1
+                return
+            # next chat in turn gets the permit and moves to the back
+            chat_id, queue = self._waiting.popitem(last=False)
+            ticket = queue.popleft()
+            if queue:
+                self._waiting[chat_id] = queue
+            ticket.set()
+
+    @contextmanager
+    def slot(self, chat_id, cancel_event=None):
+        """
+        `with limiter.slot(chat_id) as granted:` – granted is False only
+        when the wait was cancelled.
+        """
+        granted = self.acquire(chat_id, cancel_event)
+        try:
+            yield granted
+        finally:
+            if granted:
+                self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "waiting": sum(len(q) for q in self._waiting.values()),
+            }
+
+
+class JobScheduler:
+    """
+    Bounded job dispatcher replacing one raw thread per button tap.
+
+    Jobs are queued per chat and dispatched round-robin across chats, at
+    most `per_chat` running per chat and `workers` in total. The queue
+    (including jobs that were running) is persisted to `path` as JSON, so
+    work survives a restart; handlers must therefore take JSON-serialisable
+    arguments and are looked up by `kind`.
+
+    A job is a dict: { "id", "kind", "chat_id", "args", "meta", "queued_at" }.
+    """
+
+    def __init__(self, workers=SCHED_JOB_WORKERS, per_chat=SCHED_PER_CHAT,
+                 path=SCHED_QUEUE_PATH):
+        self.workers = max(1, workers)
+        self.per_chat = max(1, per_chat)
+        self.path = path
+        self._handlers = {}
+        self._on_start = None
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()    # chat_id → deque[job], in turn order
+        self._running = {}              # job id → job
+        self._threads = []
+        self.completed = 0
+        self.failed = 0
+
+    def register(self, kind, fn):
+        self._handlers[kind] = fn
+
+    def on_start(self, fn):
+        """
+        `fn(job)` is called in the worker thread just before a job runs.
+        """
+        self._on_start = fn
+
+    # ── lifecycle ────────────────────────────────────────────────────────
+    def start(self):
+        """
+        Reloads persisted jobs and starts the worker threads.
+        """
+        with self._cond:
+            if self._threads:
+                return
+            known = {job["id"] for job in self._iter_jobs()}
+            for job in self._load():
+                if job.get("id") in known:
+                    continue    # submitted before start(), already queued
+                if job.get("kind") in self._handlers:
+                    self._queues.setdefault(job["chat_id"], deque()).append(job)
+                else:
+                    logger.warning("Dropping persisted job with unknown kind %r", job.get("kind"))
+            restored = sum(len(q) for q in self._queues.values())
+            self._save()
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"job-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        if restored:
+            logger.info("Restored %d queued job(s) from %s", restored, self.path)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable %s: %s", self.path, e)
+            return []
+
+    def _save(self):
+        # caller holds self._cond; running jobs come first so they restart first
+        jobs = list(self._running.values())
+        for queue in self._queues.values():
+            jobs.extend(queue)
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(jobs, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("Could not persist %s: %s", self.path, e)
+
+    # ── queueing ─────────────────────────────────────────────────────────
+    def submit(self, chat_id, kind, *args, meta=None):
+        """
+        Queues a job and returns it; see position() for feedback.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"no handler registered for job kind {kind!r}")
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "chat_id": chat_id,
+            "args": list(args),
+            "meta": meta or {},
+            "queued_at": time.time(),
+        }
+        with self._cond:
+            self._queues.setdefault(chat_id, deque()).append(job)
+            self._save()
+            self._cond.notify()
+        return job
+
+    def update_meta(self, job_id, **meta):
+        with self._cond:
+            for job in self._iter_jobs():
+                if job["id"] == job_id:
+                    job["meta"].update(meta)
+                    self._save()
+                    return
+
+    def _iter_jobs(self):
+        yield from self._running.values()
+        for queue in self._queues.values():
+            yield from queue
+
+    def position(self, job_id):
+        """
+        1-based place of a queued job in dispatch order (0 once it runs,
+        None if unknown). Follows the round-robin: every other chat ahead
+        in turn order gets one job per round before this chat's next one.
+        """
+        with self._cond:
+            if job_id in self._running:
+                return 0
+            chats = list(self._queues)
+            for turn, chat_id in enumerate(chats):
+                queue = self._queues[chat_id]
+                for k, job in enumerate(queue):
+                    if job["id"] != job_id:
+                        continue
+                    ahead = k
+                    for other_turn, other in enumerate(chats):
+                        if other == chat_id:
+                            continue
+                        rounds = k + 1 if other_turn < turn else k
+                        ahead += min(len(self._queues[other]), rounds)
+                    return ahead + 1
+            return None
+
+    def busy(self):
+        with self._cond:
+            return len(self._running) >= self.workers
+
+    def cancel_chat(self, chat_id):
+        """
+        Drops every queued (not yet running) job of a chat; returns them.
+        """
+        with self._cond:
+            dropped = list(self._queues.pop(chat_id, ()))
+            if dropped:
+                self._save()
+            return dropped
+
+    # ── dispatch ─────────────────────────────────────────────────────────
+    def _next_job(self):
+        # caller holds self._cond
+        if len(self._running) >= self.workers:
+            return None
+        running_per_chat = {}
+        for job in self._running.values():
+            running_per_chat[job["chat_id"]] = running_per_chat.get(job["chat_id"], 0) + 1
+        for chat_id in list(self._queues):
+            if running_per_chat.get(chat_id, 0) >= self.per_chat:
+                continue
+            queue = self._queues.pop(chat_id)
+            job = queue.popleft()
+            if queue:
+                self._queues[chat_id] = queue   # back of the line
+            return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                self._running[job["id"]] = job
+                self._save()
+
+            try:
+                if self._on_start:
+                    self._on_start(job)
+                self._handlers[job["kind"]](*job["args"])
+                ok = True
+            except Exception as e:
+                logger.error("Job %s (%s) for chat %s failed: %s",
+                             job["id"], job["kind"], job["chat_id"], e, exc_info=True)
+                ok = False
+
+            with self._cond:
+                self._running.pop(job["id"], None)
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._save()
+                # a chat slot and a worker slot just freed up
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "running": len(self._running),
+                "queued": sum(len(q) for q in self._queues.values()),
+                "chats_waiting": len(self._queues),
+                "completed": self.completed,
+                "failed": self.failed,
+            }
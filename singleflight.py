@@ -0,0 +1,169 @@
+# singleflight.py
+
+import os
+import time
+import threading
+import logging
+
+from cancellation import CancelToken, OperationCancelled
+
+logger = logging.getLogger(__name__)
+
+# How long a failed call is remembered, so a burst of identical requests
+# gets the same error instead of each starting its own retry
+SINGLEFLIGHT_FAILURE_TTL = float(os.getenv("SINGLEFLIGHT_FAILURE_TTL", "15"))
+
+
+class FlightCancelled(OperationCancelled):
+    """
+    Raised when the caller gave up. A leader raising it (or any other
+    OperationCancelled) does not fail its followers: they start (or join)
+    a fresh call instead.
+    """
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "subscribers", "last_progress", "finished_at",
+                 "cancel", "waiters", "gave_up")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.subscribers = []
+        self.last_progress = None
+        self.finished_at = 0.0
+        self.cancel = CancelToken()     # set once every waiter has cancelled
+        self.waiters = 0
+        self.gave_up = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller (the
+    leader) runs the work, later callers (followers) wait for its outcome.
+
+    The work function is called as `fn(report, cancel)`. Every caller's
+    `on_progress` is subscribed to `report(*args)`, and a late follower is
+    first replayed the most recent report. `cancel` is a CancelToken that
+    fires only when every caller waiting on the work has had its own
+    `cancel_event` (a CancelToken) set, so one chat's /cancel doesn't kill
+    a download other chats still wait for. Failures reach every waiter
+    and are remembered for `failure_ttl` seconds.
+    """
+
+    def __init__(self, name, failure_ttl=SINGLEFLIGHT_FAILURE_TTL):
+        self.name = name
+        self.failure_ttl = failure_ttl
+        self._lock = threading.Lock()
+        self._calls = {}        # key → _Call (in flight, or failed recently)
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn, on_progress=None, cancel_event=None):
+        """
+        Returns (result, is_leader). Raises the leader's exception, or
+        FlightCancelled if `cancel_event` is set while following.
+        """
+        while True:
+            handle = None
+            with self._lock:
+                call = self._calls.get(key)
+                if call is not None and call.done.is_set():
+                    if call.error is not None and time.time() - call.finished_at < self.failure_ttl:
+                        raise call.error
+                    del self._calls[key]
+                    call = None
+                leader = call is None
+                if leader:
+                    self._prune()
+                    call = _Call()
+                    self._calls[key] = call
+                    self.leaders += 1
+                else:
+                    self.followers += 1
+                if on_progress is not None:
+                    call.subscribers.append(on_progress)
+                    replay = call.last_progress
+                else:
+                    replay = None
+                call.waiters += 1
+
+            if isinstance(cancel_event, CancelToken):
+                handle = cancel_event.add_callback(lambda: self._gave_up(call))
+            try:
+                if leader:
+                    return self._lead(key, call, fn), True
+
+                if replay is not None:
+                    self._safe_progress(on_progress, replay)
+                while not call.done.wait(0.5):
+                    if cancel_event is not None and cancel_event.is_set():
+                        self._unsubscribe(call, on_progress)
+                        raise FlightCancelled(f"{self.name} {key}: cancelled while waiting")
+            finally:
+                if handle is not None:
+                    cancel_event.remove_callback(handle)
+            if isinstance(call.error, OperationCancelled):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise FlightCancelled(f"{self.name} {key}: cancelled while waiting")
+                continue    # the leader gave up, not the work: try again
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+
+    def _lead(self, key, call, fn):
+        def report(*args):
+            with self._lock:
+                call.last_progress = args
+                subscribers = list(call.subscribers)
+            for cb in subscribers:
+                self._safe_progress(cb, args)
+
+        try:
+            call.result = fn(report, call.cancel)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                call.finished_at = time.time()
+                # keep failures around briefly; successes are not cached here
+                if call.error is None or isinstance(call.error, OperationCancelled):
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+            call.done.set()
+
+    def _prune(self):
+        # caller holds self._lock; forget failures that are past their TTL
+        now = time.time()
+        for key in [k for k, c in self._calls.items()
+                    if c.done.is_set() and now - c.finished_at >= self.failure_ttl]:
+            del self._calls[key]
+
+    def _gave_up(self, call):
+        with self._lock:
+            call.gave_up += 1
+            everyone = call.gave_up >= call.waiters
+        if everyone:
+            call.cancel.set()
+
+    def _unsubscribe(self, call, cb):
+        with self._lock:
+            if cb in call.subscribers:
+                call.subscribers.remove(cb)
+
+    def _safe_progress(self, cb, args):
+        try:
+            cb(*args)
+        except Exception as e:
+            logger.debug("%s progress subscriber failed: %s", self.name, e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": sum(1 for c in self._calls.values() if not c.done.is_set()),
+                "leaders": self.leaders,
+                "followers": self.followers,
+            }
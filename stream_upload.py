@@ -0,0 +1,317 @@
+# stream_upload.py
+
+import os
+import time
+import random
+import threading
+import subprocess
+import logging
+from collections import deque
+
+from telethon.tl import types
+from telethon.tl.functions.upload import SaveFilePartRequest, SaveBigFilePartRequest
+
+from app_loop import app_loop
+from hls_downloader import HLS_WORKERS, load_playlist, iter_segments, _Progress
+from cancellation import CancelToken, OperationCancelled
+from metrics import observe_upload
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+# Remux straight into the Telegram upload instead of staging the MP4 on disk
+STREAM_UPLOAD = os.getenv("STREAM_UPLOAD", "0") == "1"
+UPLOAD_PART_SIZE = 512 * 1024           # the MTProto maximum
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024   # larger files must use SaveBigFilePart
+
+# Memory between ffmpeg and the uploader; ffmpeg (and the segment fetch
+# behind it) pauses while it is full. At least two upload parts, or the
+# uploader would wait for a part the full ring can never hold.
+STREAM_BUFFER_BYTES = max(2 * UPLOAD_PART_SIZE,
+                          int(os.getenv("STREAM_BUFFER_BYTES", str(32 * 1024 * 1024))))
+
+
+class StreamError(RuntimeError):
+    """
+    The remux or the segment feed behind it failed, or the stream was
+    cancelled; whatever was uploaded so far is unusable.
+    """
+
+
+class RingBuffer:
+    """
+    Fixed-capacity byte ring between one writer thread and one reader.
+
+    write() blocks while the ring is full, read(n) blocks until n bytes are
+    there or the writer finished. Either side can end the stream: finish()
+    (writer, optionally with an error for the reader) or abort() (reader
+    gone, further writes raise).
+    """
+
+    def __init__(self, capacity=STREAM_BUFFER_BYTES):
+        if capacity < 1:
+            raise ValueError("RingBuffer capacity must be positive")
+        self._buf = bytearray(capacity)
+        self._cap = capacity
+        self._start = 0
+        self._size = 0
+        self._eof = False
+        self._error = None
+        self._aborted = False
+        self._cond = threading.Condition()
+        self.total_written = 0
+        self.peak = 0
+
+    @property
+    def capacity(self):
+        return self._cap
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            with self._cond:
+                while self._size == self._cap and not self._aborted:
+                    self._cond.wait()
+                if self._aborted:
+                    raise StreamError("reader went away")
+                n = min(len(view), self._cap - self._size)
+                end = (self._start + self._size) % self._cap
+                first = min(n, self._cap - end)
+                self._buf[end:end + first] = view[:first]
+                if n > first:
+                    self._buf[:n - first] = view[first:n]
+                self._size += n
+                self.total_written += n
+                self.peak = max(self.peak, self._size)
+                self._cond.notify_all()
+            view = view[n:]
+
+    def read(self, n):
+        """
+        Returns exactly n bytes, fewer only at the end of the stream
+        (b"" once drained). Raises the writer's error, if any.
+        """
+        with self._cond:
+            while self._size < n and not self._eof and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+            n = min(n, self._size)
+            first = min(n, self._cap - self._start)
+            out = bytes(self._buf[self._start:self._start + first])
+            if n > first:
+                out += bytes(self._buf[:n - first])
+            self._start = (self._start + n) % self._cap
+            self._size -= n
+            self._cond.notify_all()
+            return out
+
+    def finish(self, error=None):
+        with self._cond:
+            self._eof = True
+            if error is not None and self._error is None:
+                self._error = error
+            self._cond.notify_all()
+
+    def abort(self, error=None):
+        with self._cond:
+            self._aborted = True
+            if self._error is None:
+                self._error = error or StreamError("stream aborted")
+            self._cond.notify_all()
+
+
+class FragmentedMp4Stream:
+    """
+    `ffmpeg -c copy` remux of an HLS stream into fragmented MP4 on stdout,
+    feeding a RingBuffer. Segments come from the native parallel fetcher
+    through ffmpeg's stdin; streams it can't handle are read by ffmpeg
+    from the URL itself.
+
+    progress_callback has the download_and_rename_video() signature.
+    """
+
+    def __init__(self, hls_link, progress_callback=None, buffer_bytes=STREAM_BUFFER_BYTES,
+                 workers=HLS_WORKERS):
+        self.hls_link = hls_link
+        self.buffer = RingBuffer(max(buffer_bytes, 2 * UPLOAD_PART_SIZE))
+        self.progress_callback = progress_callback
+        self.workers = workers
+        self.proc = None
+        self._feed_error = None
+        self._stderr = deque(maxlen=20)
+        self._threads = []
+        self._cancel = CancelToken()    # stops the segment feed
+
+    def start(self):
+        try:
+            playlist, _ = load_playlist(self.hls_link)
+        except Exception as e:
+            logger.info("Streaming %s through ffmpeg's own HLS input: %s", self.hls_link, e)
+            playlist = None
+
+        is_fmp4 = playlist is not None and playlist.is_fmp4
+        cmd = ["ffmpeg", "-v", "error", "-i", "pipe:0" if playlist else self.hls_link, "-c", "copy"]
+        if not is_fmp4:
+            cmd += ["-bsf:a", "aac_adtstoasc"]
+        cmd += ["-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof", "pipe:1"]
+        self.proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if playlist else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+        progress = _Progress(playlist.duration if playlist else 0.0, self.progress_callback)
+        targets = [(self._drain_stderr, ())]
+        if playlist is not None:
+            targets.append((self._feed, (playlist, progress)))
+        # last, so it sees every other thread when it joins them
+        targets.append((self._pump, (None if playlist else progress,)))
+        for target, args in targets:
+            t = threading.Thread(target=target, args=args, daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def _feed(self, playlist, progress):
+        try:
+            for idx, seg, data in iter_segments(playlist, progress, self.workers, cancel=self._cancel):
+                self.proc.stdin.write(data)
+                if idx >= 0:
+                    progress.segment_done(seg.duration)
+            progress.maybe_report(force=True)
+        except (BrokenPipeError, OperationCancelled):
+            pass        # ffmpeg exited or was killed; _pump reports why
+        except Exception as e:
+            self._feed_error = e
+            self.proc.kill()
+        finally:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+
+    def _pump(self, byte_progress):
+        try:
+            while True:
+                chunk = self.proc.stdout.read(64 * 1024)
+                if not chunk:
+                    break
+                self.buffer.write(chunk)
+                if byte_progress is not None:
+                    byte_progress.add_bytes(len(chunk))
+        except StreamError:
+            self.proc.kill()    # the uploader gave up
+        code = self.proc.wait()
+        for t in self._threads:
+            if t is not threading.current_thread():
+                t.join()
+        if self._feed_error is not None:
+            self.buffer.finish(StreamError(f"segment feed failed: {self._feed_error}"))
+        elif code != 0:
+            detail = " | ".join(self._stderr)
+            self.buffer.finish(StreamError(f"ffmpeg exited with {code}: {detail}"))
+        else:
+            self.buffer.finish()
+
+    def _drain_stderr(self):
+        for line in self.proc.stderr:
+            self._stderr.append(line.decode(errors="replace").strip())
+
+    def cancel(self):
+        self._cancel.set()
+        self.buffer.abort(StreamError("cancelled"))
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+
+
+async def upload_stream(client, buffer, file_name, progress_callback=None):
+    """
+    Uploads everything read from `buffer` as one Telegram file while it is
+    still being produced and returns the InputFile / InputFileBig for it.
+
+    The total size is unknown until the end, so big-file parts go out with
+    file_total_parts=-1 and only the last one carries the real count. The
+    first 10 MB are buffered to tell small files (SaveFilePart) apart.
+    progress_callback(uploaded_bytes, total_bytes_or_None) is optional.
+    """
+    if buffer.capacity < UPLOAD_PART_SIZE:
+        # read_part() would wait for more than the full ring ever holds
+        raise ValueError(f"stream buffer of {buffer.capacity} bytes is smaller than one upload part")
+
+    async def read_part():
+        # the ring blocks; keep the event loop free for other uploads
+        return await app_loop.to_thread(buffer.read, UPLOAD_PART_SIZE)
+
+    file_id = random.getrandbits(63)
+    head = []
+    head_bytes = 0
+    eof = False
+    while head_bytes <= BIG_FILE_THRESHOLD:
+        part = await read_part()
+        if not part:
+            eof = True
+            break
+        head.append(part)
+        head_bytes += len(part)
+        if len(part) < UPLOAD_PART_SIZE:
+            eof = True
+            break
+
+    if not head:
+        raise StreamError("remux produced no data")
+
+    uploaded = 0
+    if eof and head_bytes <= BIG_FILE_THRESHOLD:
+        for idx, part in enumerate(head):
+            await client(SaveFilePartRequest(file_id, idx, part))
+            uploaded += len(part)
+            if progress_callback:
+                progress_callback(uploaded, head_bytes)
+        return types.InputFile(file_id, len(head), file_name, "")
+
+    pending = deque(head)
+    idx = 0
+    while pending:
+        part = pending.popleft()
+        if not pending and not eof:
+            nxt = await read_part()
+            if nxt:
+                pending.append(nxt)
+            if len(nxt) < UPLOAD_PART_SIZE:
+                eof = True
+        last = eof and not pending
+        await client(SaveBigFilePartRequest(file_id, idx, idx + 1 if last else -1, part))
+        uploaded += len(part)
+        idx += 1
+        if progress_callback:
+            progress_callback(uploaded, uploaded if last else None)
+    return types.InputFileBig(file_id, idx, file_name)
+
+
+async def send_stream(client, chat_id, stream, file_name, caption, progress_callback=None):
+    """
+    Upload-service job: uploads `stream` and sends it as a document.
+    progress_callback is upload_stream()'s, called on the event loop.
+    """
+    started = time.time()
+    try:
+        input_file = await upload_stream(client, stream.buffer, file_name, progress_callback)
+    except BaseException:
+        stream.cancel()
+        raise
+    logger.info(
+        "Streamed %s: %.1f MB in %.1fs, ring peak %.1f MB",
+        file_name, stream.buffer.total_written / (1024 * 1024),
+        time.time() - started, stream.buffer.peak / (1024 * 1024)
+    )
+    observe_upload("stream", stream.buffer.total_written, time.time() - started)
+    return await client.send_file(
+        entity=chat_id,
+        file=input_file,
+        caption=caption,
+        force_document=True,
+    )
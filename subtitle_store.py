@@ -0,0 +1,199 @@
+# subtitle_store.py
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+
+from http_client import get_session
+from singleflight import SingleFlight
+from app_loop import app_loop
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+SUBTITLE_CACHE_DIR = os.getenv("SUBTITLE_CACHE_DIR", os.path.join("subtitles_cache", "shared"))
+SUBTITLE_CACHE_MAX_BYTES = int(os.getenv("SUBTITLE_CACHE_MAX_BYTES", str(64 * 1024 ** 2)))   # 64 MiB
+# Served without asking the origin for this long; after that, revalidated
+# with If-None-Match / If-Modified-Since (a 304 costs no body)
+SUBTITLE_FRESH_TTL = float(os.getenv("SUBTITLE_FRESH_TTL", "600"))
+SUBTITLE_TIMEOUT = float(os.getenv("SUBTITLE_TIMEOUT", "30"))
+
+INDEX_FILE = "index.json"
+
+
+class SubtitleStore:
+    """
+    Shared on-disk store of subtitle files, so every chat asking for an
+    episode reuses one download.
+
+    Entries are keyed by episode ID when the caller has one (subtitle URLs
+    may carry per-resolve tokens), else by URL. Each is saved as
+    <root>/<sha1 of key>.vtt and described in index.json:
+
+      { key: { "url", "file", "size", "etag", "last_modified",
+               "checked_at", "last_used" } }
+
+    An entry younger than `fresh_ttl` is used as is; an older one is
+    revalidated with its ETag / Last-Modified, and kept (stale) if the
+    origin can't be reached. A keyed entry matches whatever URL the caller
+    has now, and remembers the latest one. The total size is bounded by `max_bytes`,
+    least recently used first. Concurrent fetches of one key are coalesced.
+    """
+
+    def __init__(self, root=SUBTITLE_CACHE_DIR, max_bytes=SUBTITLE_CACHE_MAX_BYTES,
+                 fresh_ttl=SUBTITLE_FRESH_TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.fresh_ttl = fresh_ttl
+        self._lock = threading.Lock()
+        self._flight = SingleFlight("subtitle", failure_ttl=0)
+        self._entries = {}
+        self.hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+        try:
+            with open(os.path.join(root, INDEX_FILE)) as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable subtitle index in %s: %s", root, e)
+        # drop entries whose file is gone
+        self._entries = {k: e for k, e in self._entries.items()
+                         if os.path.exists(os.path.join(root, e.get("file", "")))}
+
+    def fetch(self, url, key=None):
+        """
+        Returns the local path of the subtitle at `url`, downloading or
+        revalidating it first if needed. Raises if there is no usable copy.
+        """
+        key = key or url
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry["checked_at"] < self.fresh_ttl:
+                entry["last_used"] = time.time()
+                self.hits += 1
+                self._save()    # keeps the LRU order across restarts
+                return os.path.join(self.root, entry["file"])
+        path, _ = self._flight.do(key, lambda report, cancel: self._fill(key, url))
+        return path
+
+    def prefetch(self, url, key=None):
+        """
+        fetch() in the background (on the shared loop's blocking pool), so
+        the file is ready by the time it is sent. Returns a Future.
+        """
+        return app_loop.submit(app_loop.to_thread(self.fetch, url, key))
+
+    def _fill(self, key, url, conditional=True):
+        with self._lock:
+            entry = dict(self._entries.get(key) or {}) if conditional else {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            resp = get_session().get(url, headers=headers, timeout=SUBTITLE_TIMEOUT)
+            if resp.status_code != 304:
+                resp.raise_for_status()
+        except Exception as e:
+            path = self._touch(key, url, checked=False) if entry else None
+            if path is None:
+                raise
+            logger.warning("Subtitle revalidation of %s failed (%s); using the cached copy", url, e)
+            return path
+
+        if resp.status_code == 304:
+            path = self._touch(key, url, checked=True) if entry else None
+            if path is None:
+                if not conditional:
+                    raise RuntimeError(f"{url} answered 304 to an unconditional request")
+                # evicted while we asked: fetch it in full
+                return self._fill(key, url, conditional=False)
+            self.revalidated += 1
+            return path
+
+        data = resp.content
+        name = hashlib.sha1(key.encode()).hexdigest() + ".vtt"
+        path = os.path.join(self.root, name)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        now = time.time()
+        with self._lock:
+            self.downloads += 1
+            self._entries[key] = {
+                "url": url,
+                "file": name,
+                "size": len(data),
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "checked_at": now,
+                "last_used": now,
+            }
+            self._evict(keep=key)
+            self._save()
+        return path
+
+    def _touch(self, key, url, checked):
+        # None if the entry was evicted while its fill was in flight
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry["url"] = url
+            entry["last_used"] = time.time()
+            if checked:
+                entry["checked_at"] = entry["last_used"]
+            self._save()
+            return os.path.join(self.root, entry["file"])
+
+    def _evict(self, keep):
+        # caller holds self._lock
+        total = sum(e["size"] for e in self._entries.values())
+        for key, entry in sorted(self._entries.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            del self._entries[key]
+            total -= entry["size"]
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.root, entry["file"]))
+            except OSError:
+                pass
+
+    def _save(self):
+        # caller holds self._lock
+        path = os.path.join(self.root, INDEX_FILE)
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("Could not persist %s: %s", path, e)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.revalidated + self.downloads
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(e["size"] for e in self._entries.values()),
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "downloads": self.downloads,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.revalidated) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,342 @@
+# telethon_uploader.py
+
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import itertools
+import threading
+import logging
+
+from telethon import TelegramClient
+from telethon.tl import types
+from telethon.tl.functions.upload import SaveFilePartRequest, SaveBigFilePartRequest
+
+from app_loop import app_loop
+
+logger = logging.getLogger(__name__)
+
+TELETHON_SESSION = os.getenv("TELETHON_SESSION", "telethon_bot_session")
+# Number of authenticated clients uploads are spread over (each has its own session file)
+TELETHON_POOL_SIZE = int(os.getenv("TELETHON_POOL_SIZE", "1"))
+# Opt-in: own part uploader with tuned part size / parallel parts instead of send_file's
+UPLOAD_ADAPTIVE = os.getenv("UPLOAD_ADAPTIVE", "0") == "1"
+UPLOAD_MAX_PARALLEL = int(os.getenv("UPLOAD_MAX_PARALLEL", "8"))
+UPLOAD_TUNING_PATH = os.getenv("UPLOAD_TUNING_PATH", "upload_tuning.json")
+
+# MTProto limits: parts are ≤512 KB and divide 512 KB; at most 4000 parts
+PART_SIZES_KB = (128, 256, 512)
+MAX_PARTS = 4000
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+PART_RETRIES = 3
+# Throughput is measured over windows of this many bytes while probing
+PROBE_WINDOW_BYTES = 4 * 1024 * 1024
+# Every Nth upload in a size bucket tries a neighbouring part size
+EXPLORE_EVERY = 5
+
+SIZE_BUCKETS = (
+    (10 * 1024 ** 2, "<10MB"),
+    (100 * 1024 ** 2, "<100MB"),
+    (500 * 1024 ** 2, "<500MB"),
+    (None, ">=500MB"),
+)
+
+
+class UploadService:
+    """
+    Long-lived Telethon upload service.
+
+    A small, already-authenticated pool of TelegramClient instances (one by
+    default) lives on the process-wide event loop (app_loop). Worker
+    threads hand work over with submit(), which returns a
+    concurrent.futures.Future; coroutines already on the loop await call().
+    There is no per-file login, handshake or session file any more.
+    """
+
+    def __init__(self, api_id, api_hash, bot_token,
+                 session=TELETHON_SESSION, pool_size=TELETHON_POOL_SIZE, runner=app_loop):
+        self.api_id = int(api_id)
+        self.api_hash = api_hash
+        self.bot_token = bot_token
+        self.session = session
+        self.pool_size = max(1, pool_size)
+        self.runner = runner
+        self._clients = []
+        self._next_client = None
+        self._ready = None
+        self._start_lock = threading.Lock()
+        self.tuner = UploadTuner()
+
+    # ── lifecycle ────────────────────────────────────────────────────────
+    def start(self):
+        """
+        Connects the pool (once). Returns the Future of that; blocks on it
+        unless called from the loop. A failed connect is forgotten, so the
+        next call tries again instead of re-raising the same error forever.
+        """
+        with self._start_lock:
+            ready = self._ready
+            started = ready is None
+            if started:
+                ready = self._ready = self.runner.submit(self._connect_all())
+        if started:
+            # outside the lock: runs right away if the connect already ended
+            ready.add_done_callback(self._connect_done)
+        if not self.runner.in_loop():
+            ready.result()
+        return ready
+
+    def _connect_done(self, future):
+        if future.cancelled() or future.exception() is not None:
+            with self._start_lock:
+                if self._ready is future:
+                    self._ready = None
+
+    async def _connect_all(self):
+        clients = []
+        try:
+            for i in range(self.pool_size):
+                name = self.session if i == 0 else f"{self.session}_{i}"
+                client = TelegramClient(name, self.api_id, self.api_hash)
+                clients.append(client)
+                await client.start(bot_token=self.bot_token)
+        except BaseException as e:
+            logger.warning("Telethon upload service failed to connect: %s", e)
+            for client in clients:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+            raise
+        self._clients = clients
+        self._next_client = itertools.cycle(clients)
+        logger.info("Telethon upload service ready with %d client(s)", len(clients))
+
+    def stop(self):
+        with self._start_lock:
+            if self._ready is None:
+                return
+            self._ready = None
+
+        async def _disconnect():
+            for client in self._clients:
+                await client.disconnect()
+
+        try:
+            self.runner.run(_disconnect(), timeout=10)
+        except Exception as e:
+            logger.warning("Error while disconnecting Telethon clients: %s", e)
+        self._clients = []
+
+    # ── work submission ──────────────────────────────────────────────────
+    async def call(self, coro_fn, *args, **kwargs):
+        """
+        Awaits `coro_fn(client, *args, **kwargs)` with the next pooled client.
+        """
+        await asyncio.wrap_future(self.start())
+        client = next(self._next_client)
+        if not client.is_connected():
+            await client.connect()
+        return await coro_fn(client, *args, **kwargs)
+
+    def submit(self, coro_fn, *args, **kwargs):
+        """
+        Schedules call(coro_fn, …) on the event loop. Thread-safe; returns a
+        concurrent.futures.Future with its result.
+        """
+        self.start()
+        return self.runner.submit(self.call(coro_fn, *args, **kwargs))
+
+
+# ——————————————————————————————————————————————————————————————
+# Adaptive part uploader
+# ——————————————————————————————————————————————————————————————
+
+class UploadTuner:
+    """
+    Remembers, per file-size bucket, which part size and how many parallel
+    in-flight parts gave the best throughput, persisted to `path` as JSON:
+
+      { bucket: { "uploads": n, "best": {"part_kb", "parallel", "mbps"},
+                  "by_part_kb": { "512": {"mbps": EMA, "parallel": p}, … } } }
+    """
+
+    def __init__(self, path=UPLOAD_TUNING_PATH, max_parallel=UPLOAD_MAX_PARALLEL):
+        self.path = path
+        self.max_parallel = max(1, max_parallel)
+        self._lock = threading.Lock()
+        self._data = {}
+        try:
+            with open(path) as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable %s: %s", path, e)
+
+    @staticmethod
+    def bucket(size):
+        for limit, name in SIZE_BUCKETS:
+            if limit is None or size < limit:
+                return name
+
+    def plan(self, size):
+        """
+        Returns (part_kb, parallel) to start an upload of `size` bytes with.
+        """
+        with self._lock:
+            entry = self._data.get(self.bucket(size), {})
+            best = entry.get("best")
+            uploads = entry.get("uploads", 0)
+        if best:
+            part_kb, parallel = best["part_kb"], best["parallel"]
+            if uploads % EXPLORE_EVERY == EXPLORE_EVERY - 1:
+                # occasionally re-check a neighbouring part size
+                i = PART_SIZES_KB.index(part_kb) if part_kb in PART_SIZES_KB else len(PART_SIZES_KB) - 1
+                part_kb = PART_SIZES_KB[i - 1] if i > 0 else PART_SIZES_KB[i + 1]
+        else:
+            part_kb, parallel = 512, min(4, self.max_parallel)
+        # small parts would exceed the part-count limit on big files
+        while part_kb < PART_SIZES_KB[-1] and math.ceil(size / (part_kb * 1024)) > MAX_PARTS:
+            part_kb *= 2
+        return part_kb, min(max(1, parallel), self.max_parallel)
+
+    def record(self, size, part_kb, parallel, mbps):
+        with self._lock:
+            entry = self._data.setdefault(self.bucket(size), {"uploads": 0, "by_part_kb": {}})
+            entry["uploads"] = entry.get("uploads", 0) + 1
+            seen = entry.setdefault("by_part_kb", {}).get(str(part_kb))
+            ema = mbps if seen is None else 0.7 * seen["mbps"] + 0.3 * mbps
+            entry["by_part_kb"][str(part_kb)] = {"mbps": round(ema, 3), "parallel": parallel}
+            kb, rec = max(entry["by_part_kb"].items(), key=lambda kv: kv[1]["mbps"])
+            entry["best"] = {"part_kb": int(kb), "parallel": rec["parallel"], "mbps": rec["mbps"]}
+            self._save()
+
+    def _save(self):
+        # caller holds self._lock
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self._data, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("Could not persist %s: %s", self.path, e)
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(entry.get("best", {}), uploads=entry.get("uploads", 0))
+                    for name, entry in self._data.items()}
+
+
+class _ParallelProbe:
+    """
+    Hill climb on in-flight parts during the first windows of an upload:
+    double while throughput improves by at least 10%, otherwise settle on
+    the best level seen.
+    """
+
+    def __init__(self, start, max_parallel, window_bytes=PROBE_WINDOW_BYTES):
+        self.parallel = start
+        self.max_parallel = max_parallel
+        self.window_bytes = window_bytes
+        self.probing = start < max_parallel
+        self._best = (0.0, start)
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+
+    def on_part(self, nbytes):
+        if not self.probing:
+            return
+        self._window_bytes += nbytes
+        if self._window_bytes < self.window_bytes:
+            return
+        now = time.monotonic()
+        rate = self._window_bytes / max(now - self._window_start, 1e-6)
+        best_rate, best_parallel = self._best
+        if rate > best_rate * 1.1:
+            self._best = (rate, self.parallel)
+            if self.parallel < self.max_parallel:
+                self.parallel = min(self.max_parallel, self.parallel * 2)
+            else:
+                self.probing = False
+        else:
+            self.parallel = best_parallel
+            self.probing = False
+        self._window_start = now
+        self._window_bytes = 0
+
+
+async def upload_file_adaptive(client, file_path, tuner, progress_callback=None):
+    """
+    Uploads a local file in parts with several requests in flight (the
+    client multiplexes them over its connection) and returns the
+    InputFile / InputFileBig for send_file(). Part size comes from the
+    tuner; parallelism is probed during the first parts, and the outcome
+    is fed back to the tuner.
+    """
+    size = os.path.getsize(file_path)
+    part_kb, parallel = tuner.plan(size)
+    part_size = part_kb * 1024
+    total_parts = max(1, math.ceil(size / part_size))
+    is_big = size > BIG_FILE_THRESHOLD
+    file_id = random.getrandbits(63)
+    probe = _ParallelProbe(parallel, tuner.max_parallel)
+
+    uploaded = 0
+    started = time.monotonic()
+    read_lock = threading.Lock()
+
+    def read_part(f, idx):
+        with read_lock:         # parts are read on several pool threads
+            f.seek(idx * part_size)
+            return f.read(part_size)
+
+    async def send_part(f, idx):
+        # disk reads stay off the loop the other uploads and edits run on
+        data = await app_loop.to_thread(read_part, f, idx)
+        if is_big:
+            request = SaveBigFilePartRequest(file_id, idx, total_parts, data)
+        else:
+            request = SaveFilePartRequest(file_id, idx, data)
+        for attempt in range(PART_RETRIES + 1):
+            try:
+                await client(request)
+                return len(data)
+            except Exception as e:
+                if attempt == PART_RETRIES:
+                    raise
+                logger.debug("Part %d of %s failed (%s), retrying", idx, file_path, e)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    with open(file_path, "rb") as f:
+        next_idx = 0
+        in_flight = set()
+        try:
+            while next_idx < total_parts or in_flight:
+                while next_idx < total_parts and len(in_flight) < probe.parallel:
+                    in_flight.add(asyncio.ensure_future(send_part(f, next_idx)))
+                    next_idx += 1
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    n = task.result()
+                    uploaded += n
+                    probe.on_part(n)
+                    if progress_callback:
+                        progress_callback(uploaded, size)
+        except BaseException:
+            for task in in_flight:
+                task.cancel()
+            raise
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    mbps = size / elapsed / (1024 * 1024)
+    tuner.record(size, part_kb, probe.parallel, mbps)
+    logger.info("Uploaded %s: %.1f MB in %.1fs (%.2f MB/s, %d KB parts, %d in flight)",
+                os.path.basename(file_path), size / (1024 * 1024), elapsed, mbps, part_kb, probe.parallel)
+
+    name = os.path.basename(file_path)
+    if is_big:
+        return types.InputFileBig(file_id, total_parts, name)
+    return types.InputFile(file_id, total_parts, name, "")
@@ -0,0 +1,8 @@
+# tests/conftest.py
+#
+# The bot's modules live flat in the repository root.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
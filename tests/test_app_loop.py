@@ -0,0 +1,81 @@
+# tests/test_app_loop.py
+
+import asyncio
+import threading
+
+import pytest
+
+from app_loop import AppLoop
+
+
+@pytest.fixture
+def loop():
+    app = AppLoop(name="test-loop", blocking_workers=2)
+    yield app
+    app.stop()
+
+
+def test_run_returns_the_coroutine_result(loop):
+    async def add(a, b):
+        await asyncio.sleep(0)
+        return a + b
+
+    assert loop.run(add(2, 3), timeout=5) == 5
+
+
+def test_run_raises_the_coroutine_error(loop):
+    async def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        loop.run(fail(), timeout=5)
+
+
+def test_run_refuses_to_block_the_loop_itself(loop):
+    async def inner():
+        return 1
+
+    async def outer():
+        loop.run(inner())
+
+    with pytest.raises(RuntimeError, match="await instead"):
+        loop.run(outer(), timeout=5)
+
+
+def test_to_thread_runs_off_the_loop(loop):
+    async def probe():
+        loop_thread = threading.current_thread()
+        worker = await loop.to_thread(threading.current_thread)
+        return loop_thread, worker, loop.in_loop()
+
+    loop_thread, worker, in_loop = loop.run(probe(), timeout=5)
+    assert in_loop
+    assert worker is not loop_thread
+    assert not loop.in_loop()
+
+
+def test_handler_sends_errors_to_the_dispatcher():
+    app = AppLoop(name="test-loop", blocking_workers=1)
+    dispatched = threading.Event()
+    errors = []
+
+    class Dispatcher:
+        def dispatch_error(self, update, error):
+            errors.append((update, error))
+            dispatched.set()
+
+    class Context:
+        dispatcher = Dispatcher()
+
+    async def handler(update, context):
+        raise ValueError(update)
+
+    try:
+        callback = app.handler(handler)
+        assert callback.__name__ == "handler"
+        callback("update-1", Context())
+        assert dispatched.wait(5)
+        assert errors[0][0] == "update-1"
+        assert isinstance(errors[0][1], ValueError)
+    finally:
+        app.stop()
@@ -0,0 +1,162 @@
+# tests/test_cancellation.py
+
+import time
+import threading
+
+import pytest
+
+from cancellation import CancelToken, OperationCancelled, on_cancel, raise_if_cancelled
+from singleflight import SingleFlight, FlightCancelled
+
+
+def _wait_for(cond, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _run(flight, key, fn, results, **kwargs):
+    def target():
+        try:
+            results.append(flight.do(key, fn, **kwargs))
+        except Exception as e:
+            results.append(e)
+
+    t = threading.Thread(target=target, daemon=True)
+    t.start()
+    return t
+
+
+# ── CancelToken ─────────────────────────────────────────────────────────
+
+def test_callbacks_run_once_when_set():
+    token = CancelToken()
+    fired = []
+    token.add_callback(lambda: fired.append("a"))
+    token.add_callback(lambda: fired.append("b"))
+    token.set()
+    token.set()
+    assert token.is_set() and token.wait(0)
+    assert fired == ["a", "b"]
+
+
+def test_callback_added_after_set_runs_at_once():
+    token = CancelToken()
+    token.cancel()
+    fired = []
+    assert token.add_callback(lambda: fired.append(1)) is None
+    assert fired == [1]
+
+
+def test_removed_and_failing_callbacks_do_not_stop_the_rest():
+    token = CancelToken()
+    fired = []
+    handle = token.add_callback(lambda: fired.append("removed"))
+    token.remove_callback(handle)
+    token.add_callback(lambda: 1 / 0)
+    token.add_callback(lambda: fired.append("kept"))
+    token.set()
+    assert fired == ["kept"]
+
+
+def test_on_cancel_only_covers_the_with_block():
+    token = CancelToken()
+    fired = []
+    with on_cancel(token, lambda: fired.append(1)):
+        pass
+    token.set()
+    assert fired == []
+
+    with on_cancel(None, lambda: fired.append(2)):
+        pass        # no token: nothing to register
+
+
+def test_raise_if_cancelled():
+    raise_if_cancelled(None)
+    token = CancelToken()
+    raise_if_cancelled(token)
+    token.set()
+    with pytest.raises(OperationCancelled, match="download cancelled"):
+        raise_if_cancelled(token, "download")
+
+
+# ── SingleFlight with cancellation ──────────────────────────────────────
+
+def test_work_is_cancelled_only_when_every_waiter_cancels():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    work_tokens = []
+
+    def work(report, cancel):
+        work_tokens.append(cancel)
+        started.set()
+        cancel.wait(5)
+        raise OperationCancelled("work cancelled")
+
+    leader_cancel, follower_cancel = CancelToken(), CancelToken()
+    results = []
+    threads = [_run(flight, "k", work, results, cancel_event=leader_cancel)]
+    started.wait(5)
+    threads.append(_run(flight, "k", work, results, cancel_event=follower_cancel))
+    _wait_for(lambda: flight.followers == 1)
+
+    leader_cancel.set()
+    time.sleep(0.1)
+    assert not work_tokens[0].is_set()     # the follower still wants it
+
+    follower_cancel.set()
+    assert work_tokens[0].wait(5)
+    for t in threads:
+        t.join(5)
+    assert len(work_tokens) == 1
+    assert all(isinstance(r, OperationCancelled) for r in results)
+    assert any(isinstance(r, FlightCancelled) for r in results)
+
+
+def test_cancelled_follower_leaves_and_the_work_goes_on():
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+
+    def work(report, cancel):
+        started.set()
+        release.wait(5)
+        return "done"
+
+    follower_cancel = CancelToken()
+    leader_results, follower_results = [], []
+    leader = _run(flight, "k", work, leader_results)
+    started.wait(5)
+    follower = _run(flight, "k", work, follower_results, cancel_event=follower_cancel)
+    _wait_for(lambda: flight.followers == 1)
+
+    follower_cancel.set()
+    follower.join(5)
+    assert isinstance(follower_results[0], FlightCancelled)
+
+    release.set()
+    leader.join(5)
+    assert leader_results == [("done", True)]
+
+
+def test_follower_retries_when_the_leader_gives_up():
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+
+    def leader_work(report, cancel):
+        started.set()
+        release.wait(5)
+        raise OperationCancelled("leader's chat cancelled")
+
+    results = []
+    leader = _run(flight, "k", leader_work, results)
+    started.wait(5)
+    follower = _run(flight, "k", lambda report, cancel: "second try", results)
+    _wait_for(lambda: flight.followers == 1)
+    release.set()
+    for t in (leader, follower):
+        t.join(5)
+
+    assert isinstance(results[0], OperationCancelled)
+    assert results[1] == ("second try", True)
+    assert flight.leaders == 2
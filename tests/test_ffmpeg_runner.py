@@ -0,0 +1,106 @@
+# tests/test_ffmpeg_runner.py
+
+import sys
+import time
+import threading
+import textwrap
+
+import pytest
+
+import ffmpeg_runner
+from cancellation import CancelToken, OperationCancelled
+from ffmpeg_runner import run_ffmpeg
+
+# Stands in for ffmpeg: prints -progress blocks according to its mode.
+# "-progress" is on the command line, so the runner adds no flags.
+FAKE_FFMPEG = textwrap.dedent("""
+    import sys, time
+
+    mode = sys.argv[2]
+
+    def block(us, size, state="continue"):
+        print(f"out_time_us={us}")
+        print(f"total_size={size}")
+        print(f"progress={state}", flush=True)
+
+    if mode == "ok":
+        block("N/A", "N/A")
+        block(5000000, 1048576)
+        block(10000000, 2097152, "end")
+    elif mode == "stall":
+        block(1000000, 1024)
+        time.sleep(30)
+    elif mode == "busy":
+        n = 0
+        while True:
+            n += 1
+            block(n * 100000, n * 1024)
+            time.sleep(0.05)
+    elif mode == "fail":
+        block(1000000, 1024, "end")
+        sys.exit(3)
+""")
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path):
+    script = tmp_path / "fake_ffmpeg.py"
+    script.write_text(FAKE_FFMPEG)
+
+    def cmd(mode):
+        return [sys.executable, str(script), "-progress", mode, str(tmp_path / "out.mp4")]
+    return cmd
+
+
+def test_progress_is_parsed_and_reported(fake_ffmpeg, monkeypatch):
+    monkeypatch.setattr(ffmpeg_runner, "FFMPEG_PROGRESS_INTERVAL", 0)
+    reports = []
+    result = run_ffmpeg(fake_ffmpeg("ok"), duration=20,
+                        progress_callback=lambda *args: reports.append(args), timeout=30)
+    assert result.ok and result.reason is None
+    assert result.out_time == 10.0
+    assert result.total_size == 2097152
+    size_mb, duration, pct, _speed, _elapsed, _eta = reports[-1]
+    assert (size_mb, duration, pct) == (2.0, 20, 50.0)
+    # the "N/A" block before the first packet counts as nothing written
+    assert reports[0][0] == 0.0 and reports[0][2] == 0.0
+
+
+def test_exit_code_is_returned(fake_ffmpeg):
+    result = run_ffmpeg(fake_ffmpeg("fail"), timeout=30)
+    assert not result.ok
+    assert result.returncode == 3
+    assert result.reason is None
+
+
+def test_stalled_process_is_killed(fake_ffmpeg):
+    started = time.monotonic()
+    result = run_ffmpeg(fake_ffmpeg("stall"), timeout=30, stall_timeout=0.5)
+    assert result.reason == "stalled"
+    assert result.returncode < 0
+    assert result.out_time == 1.0
+    assert time.monotonic() - started < 10
+
+
+def test_process_past_its_timeout_is_killed(fake_ffmpeg):
+    # output keeps advancing, so only the wall-clock limit can stop it
+    result = run_ffmpeg(fake_ffmpeg("busy"), timeout=0.5, stall_timeout=5)
+    assert result.reason == "timeout"
+    assert result.returncode < 0
+    assert result.out_time > 0
+
+
+def test_cancel_kills_and_raises(fake_ffmpeg):
+    token = CancelToken()
+    threading.Timer(0.3, token.set).start()
+    started = time.monotonic()
+    with pytest.raises(OperationCancelled):
+        run_ffmpeg(fake_ffmpeg("busy"), timeout=30, stall_timeout=30, cancel=token)
+    assert time.monotonic() - started < 10
+
+
+def test_already_cancelled_token_never_waits(fake_ffmpeg):
+    token = CancelToken()
+    token.set()
+    with pytest.raises(OperationCancelled):
+        run_ffmpeg(fake_ffmpeg("busy"), timeout=30, stall_timeout=30, cancel=token)
@@ -0,0 +1,99 @@
+# tests/test_hianimez_scraper.py
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+from hianimez_scraper import ResponseCache
+
+
+def test_concurrent_async_misses_share_one_load():
+    cache = ResponseCache(max_bytes=1024 * 1024)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ["naruto"]
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_load_async("k", loader, ttl=60) for _ in range(5)))
+
+    assert asyncio.run(main()) == [["naruto"]] * 5
+    assert len(calls) == 1
+    assert cache._loading == {}
+
+
+def test_async_load_failure_reaches_every_caller():
+    cache = ResponseCache(max_bytes=1024 * 1024)
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_load_async("k", loader, ttl=60) for _ in range(3)),
+                                    return_exceptions=True)
+
+    assert [type(r) for r in asyncio.run(main())] == [ValueError] * 3
+    assert cache._loading == {}
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_load():
+    cache = ResponseCache(max_bytes=1024 * 1024)
+
+    async def loader():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        first = asyncio.ensure_future(cache.get_or_load_async("k", loader, ttl=60))
+        second = asyncio.ensure_future(cache.get_or_load_async("k", loader, ttl=60))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "value"
+    assert cache.get_or_load("k", lambda: pytest.fail("should be cached"), ttl=60) == "value"
+
+
+def test_stale_entry_is_served_and_refreshed_in_the_background():
+    cache = ResponseCache(max_bytes=1024 * 1024)
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        return "new"
+
+    async def main():
+        cache.put("k", "old", ttl=0.01, stale=60)
+        await asyncio.sleep(0.02)
+        served = await cache.get_or_load_async("k", loader, ttl=60, stale=60)
+        assert len(cache._tasks) == 1       # held until it finishes
+        await asyncio.gather(*cache._tasks)
+        return served
+
+    assert asyncio.run(main()) == "old"
+    assert cache._tasks == set()
+    assert cache.get_or_load("k", lambda: "unused", ttl=60) == "new"
+
+
+def test_concurrent_sync_misses_share_one_load():
+    cache = ResponseCache(max_bytes=1024 * 1024)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.1)
+        return ["one piece"]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("k", loader, ttl=60)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert results == [["one piece"]] * 4
+    assert len(calls) == 1
@@ -0,0 +1,254 @@
+# tests/test_hls_downloader.py
+
+import time
+
+import pytest
+
+import hls_downloader
+from hls_downloader import (
+    HlsError, ProbeCache, StreamProbe, MediaPlaylist, discard_partial, download_segments,
+    parse_master_playlist, parse_media_playlist, pick_variant, playlist_signature, with_subtitle,
+    _read_journal,
+)
+
+MASTER = """#EXTM3U
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="English",URI="audio/eng.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"
+360/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2800000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"
+https://cdn.example.com/720/index.m3u8?token=abc
+#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080,CODECS="avc1.640028",AUDIO="aud"
+1080/index.m3u8
+"""
+
+MEDIA = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-MEDIA-SEQUENCE:7
+#EXT-X-KEY:METHOD=NONE
+#EXTINF:10.0,
+seg0.ts
+#EXTINF:9.5,
+/abs/seg1.ts?sig=1
+#EXTINF:4.25,
+seg2.ts
+#EXT-X-ENDLIST
+"""
+
+FMP4_MEDIA = """#EXTM3U
+#EXT-X-MAP:URI="init.mp4",BYTERANGE="800@0"
+#EXTINF:6.0,
+#EXT-X-BYTERANGE:1000@800
+media.m4s
+#EXTINF:6.0,
+#EXT-X-BYTERANGE:1200
+media.m4s
+"""
+
+
+# ── playlist parsing ────────────────────────────────────────────────────
+
+def test_master_playlist_variants():
+    variants = parse_master_playlist(MASTER, "https://host/anime/master.m3u8")
+    assert [v["height"] for v in variants] == [360, 720, 1080]
+    assert variants[0]["uri"] == "https://host/anime/360/index.m3u8"
+    assert variants[1]["uri"] == "https://cdn.example.com/720/index.m3u8?token=abc"
+    assert variants[1]["codecs"] == "avc1.4d401f,mp4a.40.2"
+    assert [v["separate_audio"] for v in variants] == [False, False, True]
+
+
+def test_media_playlist_is_not_a_master():
+    assert parse_master_playlist(MEDIA, "https://host/index.m3u8") == []
+
+
+def test_pick_variant_prefers_height_and_honours_the_cap():
+    variants = parse_master_playlist(MASTER, "https://host/master.m3u8")
+    assert pick_variant(variants)["height"] == 1080
+    assert pick_variant(variants, max_height=720)["height"] == 720
+    # a cap below every variant falls back to the best one
+    assert pick_variant(variants, max_height=240)["height"] == 1080
+
+
+def test_media_playlist_segments():
+    playlist = parse_media_playlist(MEDIA, "https://host/anime/index.m3u8")
+    assert [s.uri for s in playlist.segments] == [
+        "https://host/anime/seg0.ts", "https://host/abs/seg1.ts?sig=1", "https://host/anime/seg2.ts",
+    ]
+    assert playlist.duration == pytest.approx(23.75)
+    assert playlist.media_sequence == 7
+    assert not playlist.encrypted and not playlist.is_fmp4
+
+
+def test_encrypted_media_playlist_is_flagged():
+    text = MEDIA.replace("METHOD=NONE", 'METHOD=AES-128,URI="key.bin"')
+    assert parse_media_playlist(text, "https://host/index.m3u8").encrypted
+
+
+def test_fmp4_init_segment_and_byteranges():
+    playlist = parse_media_playlist(FMP4_MEDIA, "https://host/index.m3u8")
+    assert playlist.is_fmp4
+    assert playlist.init_segment.uri == "https://host/init.mp4"
+    assert playlist.init_segment.byterange == (800, 0)
+    # a BYTERANGE without an offset continues where the previous one ended
+    assert [s.byterange for s in playlist.segments] == [(1000, 800), (1200, 1800)]
+
+
+def test_signature_ignores_url_tokens():
+    a = parse_media_playlist(MEDIA, "https://host/index.m3u8")
+    b = parse_media_playlist(MEDIA.replace("sig=1", "sig=2"), "https://host/index.m3u8")
+    c = parse_media_playlist(MEDIA.replace("4.25", "4.5"), "https://host/index.m3u8")
+    assert playlist_signature(a) == playlist_signature(b)
+    assert playlist_signature(a) != playlist_signature(c)
+
+
+# ── segment journal and resume ──────────────────────────────────────────
+
+def _segment_data(seg):
+    return seg.uri.rsplit("/", 1)[1].encode() * 100
+
+
+@pytest.fixture
+def playlist():
+    text = "#EXTM3U\n" + "".join(f"#EXTINF:2.0,\nseg{i}.ts\n" for i in range(6))
+    return parse_media_playlist(text, "https://host/index.m3u8")
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    """Records fetched segment URIs; fetching `fetches.fail_at` raises."""
+    class Fetches(list):
+        fail_at = None
+
+    log = Fetches()
+
+    def fake_fetch(seg, progress, cancel=None):
+        if seg.uri.endswith(f"seg{log.fail_at}.ts"):
+            raise HlsError("segment failed")
+        log.append(seg.uri.rsplit("/", 1)[1])
+        progress.add_bytes(len(_segment_data(seg)))
+        return _segment_data(seg)
+
+    monkeypatch.setattr(hls_downloader, "_fetch_segment", fake_fetch)
+    return log
+
+
+def _expected(playlist):
+    return b"".join(_segment_data(s) for s in playlist.segments)
+
+
+def test_interrupted_download_resumes_from_the_journal(tmp_path, playlist, fetches):
+    part, journal = str(tmp_path / "ep.part.ts"), str(tmp_path / "ep.journal")
+    fetches.fail_at = 3
+    with pytest.raises(HlsError):
+        download_segments(playlist, part, workers=1, journal_path=journal)
+    assert _read_journal(journal, playlist_signature(playlist), part) == (3, 3 * len(b"seg0.ts") * 100)
+
+    fetches.fail_at = None
+    fetches.clear()
+    download_segments(playlist, part, workers=2, journal_path=journal)
+    assert fetches == ["seg3.ts", "seg4.ts", "seg5.ts"]
+    assert open(part, "rb").read() == _expected(playlist)
+
+
+def test_resume_truncates_unjournaled_bytes(tmp_path, playlist, fetches):
+    part, journal = str(tmp_path / "ep.part.ts"), str(tmp_path / "ep.journal")
+    fetches.fail_at = 2
+    with pytest.raises(HlsError):
+        download_segments(playlist, part, workers=1, journal_path=journal)
+    with open(part, "ab") as f:
+        f.write(b"half a segment")        # written, but never journaled
+    with open(journal, "a") as f:
+        f.write("2")                      # torn journal line
+
+    fetches.fail_at = None
+    download_segments(playlist, part, workers=1, journal_path=journal)
+    assert open(part, "rb").read() == _expected(playlist)
+
+
+def test_journal_entries_beyond_the_file_are_ignored(tmp_path, playlist, fetches):
+    part, journal = str(tmp_path / "ep.part.ts"), str(tmp_path / "ep.journal")
+    fetches.fail_at = 4
+    with pytest.raises(HlsError):
+        download_segments(playlist, part, workers=1, journal_path=journal)
+    seg_len = len(b"seg0.ts") * 100
+    with open(part, "r+b") as f:
+        f.truncate(2 * seg_len + 10)      # e.g. a lost page-cache write
+    assert _read_journal(journal, playlist_signature(playlist), part) == (2, 2 * seg_len)
+
+
+def test_different_playlist_starts_over(tmp_path, playlist, fetches):
+    part, journal = str(tmp_path / "ep.part.ts"), str(tmp_path / "ep.journal")
+    fetches.fail_at = 3
+    with pytest.raises(HlsError):
+        download_segments(playlist, part, workers=1, journal_path=journal)
+
+    other = parse_media_playlist("#EXTM3U\n#EXTINF:2.0,\nseg0.ts\n#EXTINF:3.0,\nseg1.ts\n",
+                                 "https://host/index.m3u8")
+    assert _read_journal(journal, playlist_signature(other), part) == (0, 0)
+    fetches.fail_at = None
+    fetches.clear()
+    download_segments(other, part, workers=1, journal_path=journal)
+    assert fetches == ["seg0.ts", "seg1.ts"]
+    assert open(part, "rb").read() == _expected(other)
+
+
+def test_missing_journal_means_no_resume(tmp_path, playlist):
+    assert _read_journal(str(tmp_path / "none.journal"), playlist_signature(playlist),
+                         str(tmp_path / "none.part.ts")) == (0, 0)
+
+
+def test_discard_partial_removes_staged_files(tmp_path):
+    out = str(tmp_path / "ep.mp4")
+    for suffix in (".part.ts", ".part.m4s", ".journal"):
+        open(out + suffix, "w").close()
+    open(out, "w").close()
+    discard_partial(out)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["ep.mp4"]
+    discard_partial(out)        # nothing left: no error
+
+
+# ── probe cache ─────────────────────────────────────────────────────────
+
+def _probe(url):
+    probe = StreamProbe(url)
+    probe.playlist = MediaPlaylist(url)
+    return probe
+
+
+def test_probe_cache_expires_after_ttl():
+    cache = ProbeCache(ttl=0.1)
+    probe = _probe("https://host/a.m3u8")
+    cache.put(probe.url, probe)
+    assert cache.get(probe.url) is probe
+    time.sleep(0.15)
+    assert cache.get(probe.url) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_probe_cache_skips_unreachable_and_evicts_lru():
+    cache = ProbeCache(ttl=60, max_entries=2)
+    cache.put("https://host/dead.m3u8", StreamProbe("https://host/dead.m3u8"))
+    assert cache.get("https://host/dead.m3u8") is None
+    a, b, c = (_probe(f"https://host/{n}.m3u8") for n in "abc")
+    cache.put(a.url, a)
+    cache.put(b.url, b)
+    cache.get(a.url)            # a is now the most recently used
+    cache.put(c.url, c)
+    assert cache.get(b.url) is None
+    assert cache.get(a.url) is a and cache.get(c.url) is c
+
+
+# ── subtitle muxing ─────────────────────────────────────────────────────
+
+def test_with_subtitle_adds_a_mov_text_track():
+    cmd = ["ffmpeg", "-y", "-i", "in.ts", "-c", "copy", "-movflags", "+faststart", "out.mp4"]
+    assert with_subtitle(cmd, "ep.vtt") == [
+        "ffmpeg", "-y", "-i", "in.ts", "-i", "ep.vtt", "-c", "copy", "-movflags", "+faststart",
+        "-map", "0:v", "-map", "0:a?", "-map", "1:s",
+        "-c:s", "mov_text", "-metadata:s:s:0", "language=eng", "out.mp4",
+    ]
+
+
+def test_with_subtitle_without_a_file_leaves_the_command_alone():
+    cmd = ["ffmpeg", "-i", "in.ts", "out.mp4"]
+    assert with_subtitle(cmd, None) == cmd
+    assert with_subtitle(cmd, None) is not cmd
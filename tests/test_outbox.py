@@ -0,0 +1,105 @@
+# tests/test_outbox.py
+
+import time
+import threading
+
+import pytest
+from telegram.error import RetryAfter
+
+from outbox import BotOutbox, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+
+def test_requests_run_in_priority_then_fifo_order():
+    outbox = BotOutbox(global_rate=1000, chat_rate=1000, workers=1)
+    ran = []
+    futures = [
+        outbox.submit(ran.append, ("low",), priority=PRIORITY_LOW),
+        outbox.submit(ran.append, ("normal-1",), priority=PRIORITY_NORMAL),
+        outbox.submit(ran.append, ("high",), priority=PRIORITY_HIGH),
+        outbox.submit(ran.append, ("normal-2",), priority=PRIORITY_NORMAL),
+    ]
+    outbox.start()      # everything is queued before the worker looks
+    for f in futures:
+        f.result(5)
+    assert ran == ["high", "normal-1", "normal-2", "low"]
+
+
+def test_per_chat_rate_is_enforced():
+    outbox = BotOutbox(global_rate=1000, chat_rate=5, workers=4)
+    outbox.start()
+    times = []
+    futures = [outbox.submit(lambda: times.append(time.monotonic()), chat_id=1) for _ in range(3)]
+    for f in futures:
+        f.result(5)
+    # burst of one, then one every 0.2 s
+    assert times[2] - times[0] >= 0.35
+
+
+def test_retry_after_requeues_and_holds_back_the_chat():
+    outbox = BotOutbox(global_rate=1000, chat_rate=1000, workers=2)
+    outbox.start()
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RetryAfter(1)
+        return "sent"
+
+    started = time.monotonic()
+    future = outbox.submit(flaky, chat_id=1)
+    while not attempts:
+        time.sleep(0.01)
+    # the same chat waits out the block; another chat doesn't
+    same_chat = outbox.submit(time.monotonic, chat_id=1)
+    other_chat = outbox.submit(time.monotonic, chat_id=2)
+    assert other_chat.result(5) - started < 0.5
+    assert same_chat.result(5) - started >= 0.9
+
+    assert future.result(5) == "sent"
+    assert attempts[1] - attempts[0] >= 0.9
+    assert outbox.stats()["retried"] == 1
+
+
+def test_retry_after_is_raised_for_non_retried_requests():
+    outbox = BotOutbox(global_rate=1000, chat_rate=1000, workers=1)
+    outbox.start()
+
+    def throttled():
+        raise RetryAfter(3)
+
+    with pytest.raises(RetryAfter):
+        outbox.submit(throttled, chat_id=1, priority=PRIORITY_LOW, retry=False).result(5)
+    assert outbox.stats()["failed"] == 1
+
+
+def test_gives_up_after_max_retries():
+    outbox = BotOutbox(global_rate=1000, chat_rate=1000, workers=1, max_retries=2)
+    outbox.start()
+    attempts = []
+
+    def always_throttled():
+        attempts.append(1)
+        raise RetryAfter(0)
+
+    with pytest.raises(RetryAfter):
+        outbox.submit(always_throttled, chat_id=1).result(5)
+    assert len(attempts) == 3
+
+
+def test_wrap_takes_the_chat_from_args_or_kwargs():
+    outbox = BotOutbox(global_rate=1000, chat_rate=1000, workers=1)
+    outbox.start()
+    seen = []
+    lock = threading.Lock()
+
+    def send_message(chat_id, text, **kwargs):
+        with lock:
+            seen.append((chat_id, text))
+        return text
+
+    queued = outbox.wrap(send_message, PRIORITY_NORMAL)
+    assert queued(7, "hi") == "hi"
+    assert queued(chat_id=8, text="there") == "there"
+    assert seen == [(7, "hi"), (8, "there")]
+    assert outbox.stats()["executed"] == 2
@@ -0,0 +1,128 @@
+# tests/test_progress_dispatcher.py
+
+import time
+import threading
+from concurrent.futures import Future
+
+from telegram.error import RetryAfter
+
+from progress_dispatcher import TokenBucket, ProgressDispatcher
+
+
+def _wait_for(cond, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2.0, burst=2.0)
+    now = bucket.updated
+    for _ in range(2):
+        assert bucket.wait_time(now) == 0
+        bucket.take()
+    assert abs(bucket.wait_time(now) - 0.5) < 1e-6
+    assert bucket.wait_time(now + 0.5) == 0
+    # never more than the burst, however long it was idle
+    bucket.wait_time(now + 100)
+    assert bucket.tokens == 2.0
+
+
+def test_token_bucket_block_overrides_tokens():
+    bucket = TokenBucket(rate=10.0, burst=10.0)
+    now = bucket.updated
+    bucket.block(now, 3)
+    assert bucket.wait_time(now + 1) == 2
+    bucket.block(now, 1)    # a shorter block doesn't shorten it
+    assert bucket.wait_time(now + 1) == 2
+    assert bucket.wait_time(now + 3) == 0
+
+
+class _Recorder:
+    def __init__(self):
+        self.edits = []
+        self.lock = threading.Lock()
+
+    def __call__(self, chat_id, message_id, text, parse_mode):
+        with self.lock:
+            self.edits.append((chat_id, text))
+
+    def texts(self, chat_id):
+        with self.lock:
+            return [t for c, t in self.edits if c == chat_id]
+
+
+def test_pending_edits_coalesce_to_the_latest_text():
+    edit = _Recorder()
+    dispatcher = ProgressDispatcher(global_rate=100, chat_rate=2)
+    dispatcher.start(edit)
+    dispatcher.update(1, 10, "0%")
+    _wait_for(lambda: edit.texts(1) == ["0%"])
+    # the chat's next token is 0.5 s away: these all wait for it
+    for i in range(1, 5):
+        dispatcher.update(1, 10, f"{i}%")
+    _wait_for(lambda: edit.texts(1) == ["0%", "4%"])
+    assert dispatcher.stats()["coalesced"] == 3
+
+
+def test_unchanged_text_is_not_sent_again():
+    edit = _Recorder()
+    dispatcher = ProgressDispatcher(global_rate=100, chat_rate=100)
+    dispatcher.start(edit)
+    dispatcher.update(1, 10, "50%")
+    _wait_for(lambda: edit.texts(1) == ["50%"])
+    dispatcher.update(1, 10, "50%")
+    _wait_for(lambda: dispatcher.stats()["unchanged"] == 1)
+    assert edit.texts(1) == ["50%"]
+
+
+def test_retry_after_backs_off_only_that_chat():
+    edit = _Recorder()
+    throttled = []
+
+    def flaky(chat_id, message_id, text, parse_mode):
+        if chat_id == 1 and not throttled:
+            throttled.append(time.monotonic())
+            raise RetryAfter(1)
+        edit(chat_id, message_id, text, parse_mode)
+
+    dispatcher = ProgressDispatcher(global_rate=100, chat_rate=100)
+    dispatcher.start(flaky)
+    dispatcher.update(1, 10, "a")
+    _wait_for(lambda: throttled)
+    dispatcher.update(2, 20, "b")
+    _wait_for(lambda: edit.texts(2) == ["b"])
+    assert edit.texts(1) == []
+
+    # the throttled text is retried once the chat's block is over
+    _wait_for(lambda: edit.texts(1) == ["a"])
+    assert time.monotonic() - throttled[0] >= 0.9
+    assert dispatcher.stats()["retry_after"] == 1
+
+
+def test_queued_edits_do_not_block_other_chats():
+    # an edit_fn returning Futures (the outbox): chat 1's never completes
+    futures = {}
+    sent = []
+
+    def submit(chat_id, message_id, text, parse_mode):
+        sent.append((chat_id, text))
+        future = futures[(chat_id, text)] = Future()
+        if chat_id != 1:
+            future.set_result(None)
+        return future
+
+    dispatcher = ProgressDispatcher(global_rate=100, chat_rate=100)
+    dispatcher.start(submit)
+    dispatcher.update(1, 10, "1a")
+    _wait_for(lambda: (1, "1a") in sent)
+    dispatcher.update(1, 10, "1b")
+    for i in range(3):
+        dispatcher.update(2, 20, f"2-{i}")
+        _wait_for(lambda: (2, f"2-{i}") in sent)
+
+    # one edit per message in flight: "1b" waits for "1a" to be answered
+    assert (1, "1b") not in sent
+    futures[(1, "1a")].set_result(None)
+    _wait_for(lambda: (1, "1b") in sent)
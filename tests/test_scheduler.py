@@ -0,0 +1,85 @@
+# tests/test_scheduler.py
+
+import time
+import threading
+
+from scheduler import FairLimiter
+
+
+def _wait_for(cond, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _queue_waiter(limiter, chat_id, granted, cancel_event=None):
+    """
+    Starts a thread waiting for a permit and returns once it is queued.
+    """
+    waiting = limiter.stats()["waiting"]
+
+    def run():
+        if limiter.acquire(chat_id, cancel_event):
+            granted.append(chat_id)
+        else:
+            granted.append(("cancelled", chat_id))
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    _wait_for(lambda: limiter.stats()["waiting"] == waiting + 1)
+    return t
+
+
+def test_free_permits_are_granted_at_once():
+    limiter = FairLimiter("test", 2)
+    assert limiter.acquire("a")
+    assert limiter.acquire("b")
+    assert limiter.stats() == {"limit": 2, "active": 2, "waiting": 0}
+    limiter.release()
+    limiter.release()
+    assert limiter.stats()["active"] == 0
+
+
+def test_freed_permits_go_round_robin_across_chats():
+    limiter = FairLimiter("test", 1)
+    assert limiter.acquire("holder")
+    granted = []
+    threads = [_queue_waiter(limiter, chat, granted) for chat in ("a", "a", "a", "b", "c")]
+
+    for n in range(1, len(threads) + 1):
+        limiter.release()
+        _wait_for(lambda: len(granted) == n)
+
+    # one turn per chat per round, however many episodes "a" queued first
+    assert granted == ["a", "b", "c", "a", "a"]
+    limiter.release()
+    assert limiter.stats() == {"limit": 1, "active": 0, "waiting": 0}
+    for t in threads:
+        t.join(1)
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    limiter = FairLimiter("test", 1)
+    assert limiter.acquire("holder")
+    granted = []
+    cancel = threading.Event()
+    t = _queue_waiter(limiter, "a", granted, cancel)
+    _queue_waiter(limiter, "b", granted)
+
+    cancel.set()
+    t.join(2)
+    assert granted == [("cancelled", "a")]
+    assert limiter.stats()["waiting"] == 1
+
+    limiter.release()
+    _wait_for(lambda: len(granted) == 2)
+    assert granted[-1] == "b"
+
+
+def test_slot_releases_on_exit():
+    limiter = FairLimiter("test", 1)
+    with limiter.slot("a") as granted:
+        assert granted
+        assert limiter.stats()["active"] == 1
+    assert limiter.stats()["active"] == 0
@@ -0,0 +1,122 @@
+# tests/test_singleflight.py
+
+import time
+import threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def _wait_for(cond, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _run(flight, key, fn, results, **kwargs):
+    def target():
+        try:
+            results.append(flight.do(key, fn, **kwargs))
+        except Exception as e:
+            results.append(e)
+
+    t = threading.Thread(target=target, daemon=True)
+    t.start()
+    return t
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def work(report, cancel):
+        calls.append(1)
+        release.wait(5)
+        return "done"
+
+    results = []
+    threads = [_run(flight, "k", work, results)]
+    _wait_for(lambda: calls)
+    threads += [_run(flight, "k", work, results) for _ in range(3)]
+    _wait_for(lambda: flight.followers == 3)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: not r[1]) == [("done", True)] + [("done", False)] * 3
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 3}
+
+
+def test_successes_are_not_cached():
+    flight = SingleFlight("test")
+    calls = []
+    for _ in range(2):
+        assert flight.do("k", lambda report, cancel: calls.append(1) or len(calls)) == (len(calls), True)
+    assert len(calls) == 2
+
+
+def test_late_follower_gets_the_last_progress_replayed():
+    flight = SingleFlight("test")
+    reported = threading.Event()
+    release = threading.Event()
+
+    def work(report, cancel):
+        report(10)
+        report(42)
+        reported.set()
+        release.wait(5)
+        return "done"
+
+    results = []
+    leader = _run(flight, "k", work, results)
+    reported.wait(5)
+    seen = []
+    follower = _run(flight, "k", work, results, on_progress=seen.append)
+    _wait_for(lambda: seen)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert seen == [42]
+
+
+def test_failure_reaches_followers_and_is_remembered():
+    flight = SingleFlight("test", failure_ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work(report, cancel):
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    results = []
+    threads = [_run(flight, "k", work, results)]
+    started.wait(5)
+    threads.append(_run(flight, "k", work, results))
+    _wait_for(lambda: flight.followers == 1)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert [type(r) for r in results] == [ValueError, ValueError]
+
+    # a new caller within the TTL gets the same error without a new call
+    with pytest.raises(ValueError):
+        flight.do("k", work)
+    assert len(calls) == 1
+
+
+def test_failure_is_forgotten_after_ttl():
+    flight = SingleFlight("test", failure_ttl=0)
+
+    def fail(report, cancel):
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.do("k", fail)
+    assert flight.do("k", lambda report, cancel: "ok") == ("ok", True)
@@ -0,0 +1,113 @@
+# tests/test_stream_upload.py
+
+import asyncio
+import threading
+
+import pytest
+
+from stream_upload import FragmentedMp4Stream, RingBuffer, StreamError, UPLOAD_PART_SIZE, upload_stream
+
+
+def test_wraps_around_and_preserves_order():
+    ring = RingBuffer(7)
+    data = bytes(range(256)) * 4
+
+    def writer():
+        # odd chunk sizes, so writes straddle the end of the ring
+        for i in range(0, len(data), 5):
+            ring.write(data[i:i + 5])
+        ring.finish()
+
+    t = threading.Thread(target=writer, daemon=True)
+    t.start()
+    out = bytearray()
+    while True:
+        chunk = ring.read(3)
+        if not chunk:
+            break
+        out += chunk
+    t.join(5)
+
+    assert bytes(out) == data
+    assert ring.total_written == len(data)
+    assert ring.peak <= 7
+
+
+def test_read_returns_short_then_empty_at_end():
+    ring = RingBuffer(16)
+    ring.write(b"abcde")
+    ring.finish()
+    assert ring.read(4) == b"abcd"
+    assert ring.read(4) == b"e"
+    assert ring.read(4) == b""
+
+
+def test_write_blocks_while_full():
+    ring = RingBuffer(4)
+    ring.write(b"1234")
+    done = threading.Event()
+
+    def writer():
+        ring.write(b"56")
+        done.set()
+
+    threading.Thread(target=writer, daemon=True).start()
+    assert not done.wait(0.2)
+    assert ring.read(2) == b"12"
+    assert done.wait(5)
+    ring.finish()
+    assert ring.read(10) == b"3456"
+
+
+def test_writer_error_reaches_the_reader():
+    ring = RingBuffer(8)
+    ring.write(b"xy")
+    ring.finish(StreamError("ffmpeg exited with 1"))
+    with pytest.raises(StreamError, match="ffmpeg exited"):
+        ring.read(2)
+
+
+def test_abort_fails_the_blocked_writer():
+    ring = RingBuffer(2)
+    ring.write(b"ab")
+    errors = []
+
+    def writer():
+        try:
+            ring.write(b"c")
+        except StreamError as e:
+            errors.append(e)
+
+    t = threading.Thread(target=writer, daemon=True)
+    t.start()
+    ring.abort()
+    t.join(5)
+    assert len(errors) == 1
+
+
+def test_stream_buffer_holds_at_least_two_upload_parts():
+    stream = FragmentedMp4Stream("http://example.invalid/master.m3u8", buffer_bytes=1024)
+    assert stream.buffer.capacity == 2 * UPLOAD_PART_SIZE
+
+
+def test_upload_refuses_a_ring_smaller_than_one_part():
+    with pytest.raises(ValueError):
+        asyncio.run(upload_stream(None, RingBuffer(1024), "x.mp4"))
+
+
+def test_small_stream_is_uploaded_in_parts_through_a_small_ring():
+    ring = RingBuffer(2 * UPLOAD_PART_SIZE)
+    data = bytes(range(256)) * (5 * UPLOAD_PART_SIZE // 2 // 256)     # 2.5 parts
+    sent = []
+
+    async def client(request):
+        sent.append(request)
+
+    def writer():
+        ring.write(data)
+        ring.finish()
+
+    threading.Thread(target=writer, daemon=True).start()
+    input_file = asyncio.run(upload_stream(client, ring, "ep.mp4"))
+    assert input_file.parts == 3
+    assert b"".join(r.bytes for r in sent) == data
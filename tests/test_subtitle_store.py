@@ -0,0 +1,96 @@
+# tests/test_subtitle_store.py
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from subtitle_store import SubtitleStore
+
+VTT = b"WEBVTT\n\n00:00:01.000 --> 00:00:02.000\nHello\n"
+
+
+class _Origin(BaseHTTPRequestHandler):
+    etag = '"v1"'
+    body = VTT
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path.startswith("/down"):
+            self.send_response(404)     # not retried by the shared session
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    _Origin.etag, _Origin.body, _Origin.requests = '"v1"', VTT, []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Origin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_fresh_entry_is_served_without_asking(tmp_path, origin):
+    store = SubtitleStore(root=str(tmp_path), fresh_ttl=600)
+    path = store.fetch(origin + "/ep1.vtt?token=a", key="ep1")
+    assert open(path, "rb").read() == VTT
+    # a new per-resolve token still hits the entry of the episode
+    assert store.fetch(origin + "/ep1.vtt?token=b", key="ep1") == path
+    assert len(_Origin.requests) == 1
+    assert store.stats()["hits"] == 1
+
+
+def test_304_revalidation_keeps_the_cached_file(tmp_path, origin):
+    store = SubtitleStore(root=str(tmp_path), fresh_ttl=0)
+    path = store.fetch(origin + "/ep1.vtt", key="ep1")
+    mtime = os.path.getmtime(path)
+    assert store.fetch(origin + "/ep1.vtt", key="ep1") == path
+    assert _Origin.requests[-1] == ("/ep1.vtt", '"v1"')
+    assert open(path, "rb").read() == VTT and os.path.getmtime(path) == mtime
+    assert store.stats()["revalidated"] == 1 and store.stats()["downloads"] == 1
+
+
+def test_changed_subtitle_is_downloaded_again(tmp_path, origin):
+    store = SubtitleStore(root=str(tmp_path), fresh_ttl=0)
+    path = store.fetch(origin + "/ep1.vtt", key="ep1")
+    _Origin.etag, _Origin.body = '"v2"', VTT + b"\n00:00:03.000 --> 00:00:04.000\nBye\n"
+    assert store.fetch(origin + "/ep1.vtt", key="ep1") == path
+    assert open(path, "rb").read() == _Origin.body
+    assert store.stats()["downloads"] == 2
+
+
+def test_stale_copy_is_used_when_the_origin_fails(tmp_path, origin):
+    store = SubtitleStore(root=str(tmp_path), fresh_ttl=0)
+    path = store.fetch(origin + "/ep1.vtt", key="ep1")
+    assert store.fetch(origin + "/down/ep1.vtt", key="ep1") == path
+    with pytest.raises(Exception):
+        store.fetch(origin + "/down/ep2.vtt", key="ep2")
+
+
+def test_least_recently_used_is_evicted_and_index_persists(tmp_path, origin):
+    store = SubtitleStore(root=str(tmp_path), max_bytes=2 * len(VTT), fresh_ttl=600)
+    paths = {k: store.fetch(f"{origin}/{k}.vtt", key=k) for k in ("ep1", "ep2")}
+    store.fetch(f"{origin}/ep1.vtt", key="ep1")        # ep1 is now the most recent
+    store.fetch(f"{origin}/ep3.vtt", key="ep3")
+    assert not os.path.exists(paths["ep2"])
+    assert store.stats()["evictions"] == 1
+
+    reopened = SubtitleStore(root=str(tmp_path), max_bytes=2 * len(VTT), fresh_ttl=600)
+    assert reopened.fetch(f"{origin}/ep1.vtt", key="ep1") == paths["ep1"]
+    assert reopened.stats()["hits"] == 1
@@ -0,0 +1,44 @@
+# tests/test_telethon_uploader.py
+
+import os
+import asyncio
+import random
+
+from telethon.tl import types
+
+from telethon_uploader import UploadTuner, upload_file_adaptive
+
+
+def _upload(tmp_path, size):
+    path = tmp_path / "ep.mp4"
+    data = os.urandom(size)
+    path.write_bytes(data)
+    tuner = UploadTuner(path=str(tmp_path / "tuning.json"), max_parallel=4)
+    parts = {}
+
+    async def client(request):
+        await asyncio.sleep(random.uniform(0, 0.005))     # parts finish out of order
+        parts[request.file_part] = request.bytes
+
+    input_file = asyncio.run(upload_file_adaptive(client, str(path), tuner))
+    return data, parts, input_file, tuner
+
+
+def test_parallel_parts_reassemble_into_the_file(tmp_path):
+    data, parts, input_file, tuner = _upload(tmp_path, 3 * 512 * 1024 + 1000)
+    assert isinstance(input_file, types.InputFile)
+    assert input_file.parts == len(parts) == 4
+    assert b"".join(parts[i] for i in sorted(parts)) == data
+    assert tuner.stats()["<10MB"]["uploads"] == 1
+
+
+def test_big_file_uses_big_file_parts(tmp_path):
+    data, parts, input_file, _ = _upload(tmp_path, 11 * 1024 * 1024)
+    assert isinstance(input_file, types.InputFileBig)
+    assert b"".join(parts[i] for i in sorted(parts)) == data
+
+
+def test_tuning_is_persisted(tmp_path):
+    _upload(tmp_path, 1024)
+    reloaded = UploadTuner(path=str(tmp_path / "tuning.json"))
+    assert reloaded.stats()["<10MB"]["part_kb"] == 512
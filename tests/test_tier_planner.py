@@ -0,0 +1,80 @@
+# tests/test_tier_planner.py
+
+from hls_downloader import MediaPlaylist, StreamProbe
+from tier_planner import (
+    COPY, COPY_MUX_QUEUE, FFMPEG, NATIVE, REENCODE, YTDLP, TIER_DEMOTE_AFTER, TierMemory, plan_tiers,
+)
+
+
+def _probe(reachable=True, codecs="avc1.640028,mp4a.40.2", native_reason=None):
+    probe = StreamProbe("https://cdn.example.com/ep/master.m3u8")
+    if reachable:
+        probe.playlist = MediaPlaylist(probe.url)
+    else:
+        probe.error = OSError("connection refused")
+    probe.codecs = codecs
+    probe.native_reason = native_reason
+    return probe
+
+
+def test_default_order():
+    assert plan_tiers(_probe(), ytdlp=True) == [NATIVE, COPY, COPY_MUX_QUEUE, REENCODE, YTDLP]
+    assert FFMPEG not in plan_tiers(_probe(), ytdlp=True)
+
+
+def test_probe_prunes_tiers():
+    assert NATIVE not in plan_tiers(_probe(native_reason="encrypted"), ytdlp=True)
+    assert plan_tiers(_probe(codecs="hev1,mp3"), ytdlp=False) == [NATIVE, REENCODE]
+    # unreadable playlist: yt-dlp's own extraction is the best bet
+    assert plan_tiers(_probe(reachable=False), ytdlp=True)[0] == YTDLP
+    assert YTDLP not in plan_tiers(_probe(reachable=False), ytdlp=False)
+
+
+def test_recorded_failures_demote_a_tier(tmp_path):
+    memory = TierMemory(path=str(tmp_path / "tiers.json"))
+    host = _probe().host
+    for _ in range(TIER_DEMOTE_AFTER - 1):
+        memory.record(host, NATIVE, ok=False)
+    assert plan_tiers(_probe(), memory, ytdlp=True)[0] == NATIVE
+    memory.record(host, NATIVE, ok=False)
+    assert plan_tiers(_probe(), memory, ytdlp=True) == [COPY, COPY_MUX_QUEUE, REENCODE, YTDLP, NATIVE]
+    # other hosts are unaffected
+    other = _probe()
+    other.host = "other.example.com"
+    assert plan_tiers(other, memory, ytdlp=True)[0] == NATIVE
+
+
+def test_last_success_goes_first_and_clears_failures(tmp_path):
+    memory = TierMemory(path=str(tmp_path / "tiers.json"))
+    host = _probe().host
+    memory.record(host, NATIVE, ok=False)
+    memory.record(host, NATIVE, ok=False)
+    memory.record(host, COPY_MUX_QUEUE, ok=True)
+    assert plan_tiers(_probe(), memory, ytdlp=True) == [COPY_MUX_QUEUE, COPY, REENCODE, YTDLP, NATIVE]
+    memory.record(host, NATIVE, ok=True)
+    assert plan_tiers(_probe(), memory, ytdlp=True)[0] == NATIVE
+    assert memory.get(host)["failures"] == {}
+
+
+def test_reencode_is_never_promoted(tmp_path):
+    memory = TierMemory(path=str(tmp_path / "tiers.json"))
+    memory.record(_probe().host, REENCODE, ok=True)
+    assert plan_tiers(_probe(), memory, ytdlp=True)[0] == NATIVE
+
+
+def test_memory_survives_a_restart(tmp_path):
+    path = str(tmp_path / "tiers.json")
+    host = _probe().host
+    memory = TierMemory(path=path)
+    memory.record(host, COPY, ok=True)
+    for _ in range(TIER_DEMOTE_AFTER):
+        memory.record(host, NATIVE, ok=False)
+    reloaded = TierMemory(path=path)
+    assert plan_tiers(_probe(), reloaded, ytdlp=True) == [COPY, COPY_MUX_QUEUE, REENCODE, YTDLP, NATIVE]
+    assert reloaded.stats() == {"hosts": 1, "last_ok": {COPY: 1}}
+
+
+def test_unreadable_memory_file_is_ignored(tmp_path):
+    path = tmp_path / "tiers.json"
+    path.write_text("{not json")
+    assert TierMemory(path=str(path)).get("any") == {"last_ok": None, "failures": {}}
@@ -0,0 +1,64 @@
+# tests/test_tracing.py
+
+import json
+
+import pytest
+
+import tracing
+from tracing import TraceLog
+
+
+@pytest.fixture
+def trace_log(tmp_path):
+    return TraceLog(path=str(tmp_path / "traces.jsonl"))
+
+
+def test_spans_are_recorded_and_summarised(trace_log):
+    with trace_log.trace("episode", 1):
+        with tracing.span("download", bytes=1024 * 1024) as sp:
+            sp["tier"] = "ffmpeg"
+        with tracing.span("upload"):
+            pass
+    summary = trace_log.summary()
+    assert summary["jobs"] == 1 and summary["failed"] == 0
+    assert summary["stages"]["download"]["count"] == 1
+    assert summary["tiers"] == {"download/ffmpeg": 1}
+
+
+def test_handled_failure_marks_the_job_failed(trace_log):
+    @trace_log.job("episode")
+    def job(chat_id):
+        # falls back to the HLS link and returns normally
+        tracing.fail("download failed for episode 1")
+
+    job(7)
+    summary = trace_log.summary()
+    assert summary["jobs"] == 1 and summary["failed"] == 1
+    record = json.loads(open(trace_log.path).read().splitlines()[-1])
+    assert record["status"] == "error"
+    assert record["errors"] == ["download failed for episode 1"]
+
+
+def test_raising_job_is_failed_and_failed_span_counted(trace_log):
+    @trace_log.job("episode")
+    def job(chat_id):
+        with tracing.span("upload"):
+            raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        job(7)
+    summary = trace_log.summary()
+    assert summary["failed"] == 1
+    assert summary["stages"]["upload"]["failed"] == 1
+
+
+def test_fail_outside_a_job_is_a_no_op():
+    tracing.fail("nothing to mark")
+    assert tracing.current() is None
+
+
+def test_traces_survive_a_restart(trace_log):
+    with trace_log.trace("episode", 1) as trace:
+        trace.fail("upload failed")
+    reloaded = TraceLog(path=trace_log.path)
+    assert reloaded.summary()["failed"] == 1
@@ -0,0 +1,129 @@
+# tests/test_video_cache.py
+
+import os
+import time
+import threading
+
+import pytest
+
+import video_cache
+from video_cache import VideoCache
+
+
+def _downloader(size, calls=None, gate=None):
+    def download(d):
+        if calls is not None:
+            calls.append(d)
+        if gate is not None:
+            gate.wait(5)
+        path = os.path.join(d, "Episode 1.mp4")
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        return path
+    return download
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return VideoCache(root=str(tmp_path / "cache"), max_bytes=250, policy="lru")
+
+
+def test_miss_downloads_then_hits(cache):
+    path, cached = cache.fetch("a", _downloader(100))
+    assert not cached and os.path.getsize(path) == 100
+    cache.release("a")
+    assert cache.acquire("a") == path
+    cache.release("a")
+    assert cache.acquire("missing") is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["hits"], stats["misses"]) == (1, 100, 1, 1)
+
+
+def test_concurrent_fetches_share_one_download(cache):
+    calls, gate = [], threading.Event()
+    results = []
+
+    def fetch():
+        results.append(cache.fetch("a", _downloader(100, calls, gate)))
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert sorted(cached for _, cached in results) == [False, True, True, True]
+    assert cache.stats()["pinned"] == 1
+    assert cache._fill_locks == {}
+
+
+def test_lru_evicts_least_recently_used_unpinned(cache):
+    for key in "abc":
+        cache.fetch(key, _downloader(100))
+        cache.release(key)
+        time.sleep(0.01)
+    # c pushed the total to 300 > 250: a, the oldest, went
+    assert cache.acquire("a") is None
+    assert cache.acquire("b") is not None          # b is now newer than c
+    cache.release("b")
+    cache.fetch("d", _downloader(100))
+    assert cache.acquire("c") is None
+    assert cache.acquire("b") is not None
+    assert cache.stats()["evictions"] == 2
+
+
+def test_pinned_entries_are_not_evicted(cache):
+    path_a, _ = cache.fetch("a", _downloader(200))      # stays pinned
+    cache.fetch("b", _downloader(200))
+    cache.release("b")
+    assert os.path.isfile(path_a)
+    assert cache.acquire("b") is None                   # the unpinned one went instead
+    cache.release("a")
+    cache.fetch("c", _downloader(100))
+    assert not os.path.exists(path_a)
+
+
+def test_lfu_keeps_the_frequently_used(tmp_path):
+    cache = VideoCache(root=str(tmp_path / "cache"), max_bytes=250, policy="lfu")
+    cache.fetch("popular", _downloader(100))
+    cache.release("popular")
+    for _ in range(3):
+        cache.acquire("popular")
+        cache.release("popular")
+    cache.fetch("once", _downloader(100))
+    cache.release("once")
+    cache.fetch("new", _downloader(100))
+    cache.release("new")
+    assert cache.acquire("popular") is not None
+    assert cache.acquire("once") is None
+
+
+def test_index_survives_a_restart(tmp_path, cache):
+    path, _ = cache.fetch("a", _downloader(100))
+    cache.release("a")
+    os.makedirs(os.path.join(cache.root, video_cache.TOMBSTONE_PREFIX + "old"))
+    reopened = VideoCache(root=cache.root, max_bytes=250)
+    assert reopened.acquire("a") == path
+    assert sorted(os.listdir(cache.root)) == ["a"]
+
+
+def test_refill_during_eviction_is_not_deleted(cache, monkeypatch):
+    cache.fetch("a", _downloader(100))
+    cache.release("a")
+    real_rmtree = video_cache.shutil.rmtree
+    refilled = []
+
+    def slow_rmtree(path, **kwargs):
+        # another job asks for "a" between the unlock and the deletion
+        if not refilled:
+            refilled.append(cache.fetch("a", _downloader(100)))
+        real_rmtree(path, **kwargs)
+
+    monkeypatch.setattr(video_cache.shutil, "rmtree", slow_rmtree)
+    cache.fetch("b", _downloader(200))      # evicts "a"
+    path, cached = refilled[0]
+    assert not cached
+    assert os.path.isfile(path)
+    assert not [n for n in os.listdir(cache.root) if n.startswith(video_cache.TOMBSTONE_PREFIX)]
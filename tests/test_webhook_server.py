@@ -0,0 +1,84 @@
+# tests/test_webhook_server.py
+
+import queue
+import time
+
+import pytest
+
+from webhook_server import UpdateBatcher
+
+
+def _wait_for(cond, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def batcher():
+    b = UpdateBatcher(None, queue.Queue(), max_batch=10, wait=0.05)
+    yield b
+    b.stop()
+
+
+def _drain(q):
+    out = []
+    while True:
+        try:
+            out.append(q.get_nowait().update_id)
+        except queue.Empty:
+            return out
+
+
+def test_burst_is_dispatched_in_update_id_order(batcher):
+    for update_id in (3, 1, 2):
+        batcher.add({"update_id": update_id})
+    batcher.start()
+    assert _wait_for(lambda: batcher.stats()["dispatched"] == 3)
+    assert _drain(batcher.update_queue) == [1, 2, 3]
+    assert batcher.stats()["batches"] == 1
+
+
+def test_redelivered_updates_are_dropped(batcher):
+    batcher.start()
+    batcher.add({"update_id": 7})
+    assert _wait_for(lambda: batcher.stats()["dispatched"] == 1)
+    batcher.add({"update_id": 7})     # re-delivery in a later batch
+    batcher.add({"update_id": 8})
+    batcher.add({"update_id": 8})     # duplicate within one batch
+    assert _wait_for(lambda: batcher.stats()["dispatched"] == 2)
+    assert _wait_for(lambda: batcher.stats()["duplicates"] == 2)
+    assert _drain(batcher.update_queue) == [7, 8]
+
+
+def test_payloads_without_update_id_are_counted_invalid(batcher):
+    batcher.start()
+    batcher.add({"message": {}})
+    batcher.add("not a dict")
+    batcher.add({"update_id": 1})
+    assert _wait_for(lambda: batcher.stats()["dispatched"] == 1)
+    assert batcher.stats()["invalid"] == 2
+    assert _drain(batcher.update_queue) == [1]
+
+
+def test_batches_are_capped_at_max_batch():
+    b = UpdateBatcher(None, queue.Queue(), max_batch=4, wait=0)
+    for update_id in range(10):
+        b.add({"update_id": update_id})
+    b.start()
+    try:
+        assert _wait_for(lambda: b.stats()["dispatched"] == 10)
+        assert b.stats()["batches"] == 3
+        assert _drain(b.update_queue) == list(range(10))
+    finally:
+        b.stop()
+
+
+def test_stop_returns_with_nothing_pending():
+    b = UpdateBatcher(None, queue.Queue())
+    b.start()
+    b.stop()
+    assert b._thread is None
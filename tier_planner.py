@@ -0,0 +1,126 @@
+# tier_planner.py
+
+import os
+import json
+import importlib.util
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+TIER_MEMORY_PATH = os.getenv("TIER_MEMORY_PATH", "tier_memory.json")
+# A tier that failed this many times in a row on a host is tried last there
+TIER_DEMOTE_AFTER = int(os.getenv("TIER_DEMOTE_AFTER", "2"))
+
+# Download / remux strategies of utils.download_and_rename_video
+NATIVE = "native"               # parallel segment fetch + local copy remux
+FFMPEG = "ffmpeg"               # ffmpeg fetches the stream once to a local .ts …
+COPY = "copy"                   # … which is then remuxed (stream copy) …
+COPY_MUX_QUEUE = "copy-mux-queue"   # … with a larger mux queue …
+REENCODE = "re-encode"          # … or re-encoded with libx264/aac
+YTDLP = "yt-dlp"                # yt-dlp's own downloader, straight to MP4
+
+DEFAULT_ORDER = (NATIVE, COPY, COPY_MUX_QUEUE, REENCODE, YTDLP)
+
+
+def _ytdlp_available():
+    return importlib.util.find_spec("yt_dlp") is not None
+
+
+class TierMemory:
+    """
+    Per host, the tier that last produced an MP4 and how many times in a
+    row each tier has failed, persisted to TIER_MEMORY_PATH:
+
+      { host: { "last_ok": tier, "saved_at": …, "failures": { tier: n } } }
+    """
+
+    def __init__(self, path=TIER_MEMORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._hosts = {}
+        try:
+            with open(path) as f:
+                self._hosts = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable %s: %s", path, e)
+
+    def get(self, host):
+        with self._lock:
+            entry = self._hosts.get(host) or {}
+            return {"last_ok": entry.get("last_ok"), "failures": dict(entry.get("failures", {}))}
+
+    def record(self, host, tier, ok):
+        if not host:
+            return
+        with self._lock:
+            entry = self._hosts.setdefault(host, {"last_ok": None, "failures": {}})
+            failures = entry.setdefault("failures", {})
+            if ok:
+                entry["last_ok"] = tier
+                entry["saved_at"] = time.time()
+                failures.pop(tier, None)
+            else:
+                failures[tier] = failures.get(tier, 0) + 1
+            self._save()
+
+    def _save(self):
+        # caller holds self._lock
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self._hosts, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("Could not persist %s: %s", self.path, e)
+
+    def stats(self):
+        with self._lock:
+            wins = {}
+            for entry in self._hosts.values():
+                if entry.get("last_ok"):
+                    wins[entry["last_ok"]] = wins.get(entry["last_ok"], 0) + 1
+            return {"hosts": len(self._hosts), "last_ok": wins}
+
+
+def plan_tiers(probe, memory=None, ytdlp=None, native=True):
+    """
+    Orders the tiers worth trying for a stream, from a StreamProbe and the
+    host's TierMemory entry:
+
+      - native only when the probe says the segments can be fetched natively;
+      - no stream-copy tiers when the codecs can't go into MP4 as they are;
+      - yt-dlp (a separate download) last, or first when the playlist
+        could not even be read here; dropped when it isn't installed;
+      - the host's last successful tier first (except the re-encode, which
+        is never preferred over a cheaper tier that may still work), and
+        tiers that keep failing there last.
+    """
+    if ytdlp is None:
+        ytdlp = _ytdlp_available()
+    tiers = list(DEFAULT_ORDER)
+    if not (native and probe.native_ok):
+        tiers.remove(NATIVE)
+    if probe.mp4_copyable is False:
+        tiers.remove(COPY)
+        tiers.remove(COPY_MUX_QUEUE)
+    if not ytdlp:
+        tiers.remove(YTDLP)
+    elif not probe.reachable:
+        tiers.remove(YTDLP)
+        tiers.insert(0, YTDLP)
+
+    if memory is not None:
+        seen = memory.get(probe.host)
+        failing = [t for t in tiers if seen["failures"].get(t, 0) >= TIER_DEMOTE_AFTER]
+        tiers = [t for t in tiers if t not in failing] + failing
+        if seen["last_ok"] in tiers and seen["last_ok"] != REENCODE:
+            tiers.remove(seen["last_ok"])
+            tiers.insert(0, seen["last_ok"])
+    return tiers
@@ -0,0 +1,246 @@
+# tracing.py
+
+import os
+import json
+import time
+import uuid
+import threading
+import functools
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+TRACE_PATH = os.getenv("TRACE_PATH", "traces.jsonl")
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", "500"))                              # jobs kept for /stats
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(20 * 1024 * 1024)))   # then rotated to .1
+
+_local = threading.local()
+
+
+class Trace:
+    """
+    Timeline of one job: an ID, the job's attributes and a flat list of
+    spans ({"name", "start" (s since the job started), "dur", "ok", …}).
+    Spans are recorded from any thread the trace is activated on.
+
+    Jobs that handle their own failures (e.g. by sending the HLS link
+    instead) record them with fail(), so the job still counts as failed.
+    """
+
+    def __init__(self, kind, chat_id, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.chat_id = chat_id
+        self.attrs = attrs
+        self.started = time.time()
+        self._t0 = time.monotonic()
+        self._lock = threading.Lock()
+        self.spans = []
+        self.errors = []
+
+    def fail(self, reason):
+        """
+        Marks the job failed without raising; a job may fail several times
+        (one reason per episode of a Download All).
+        """
+        with self._lock:
+            self.errors.append(reason)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Times the `with` block. Yields the span's attribute dict, which the
+        block may fill in (e.g. bytes, tier, ok); an exception marks it
+        failed unless "ok" was set.
+        """
+        record = dict(attrs)
+        started = time.monotonic()
+        try:
+            yield record
+        except BaseException:
+            record.setdefault("ok", False)
+            raise
+        finally:
+            ended = time.monotonic()
+            record.setdefault("ok", True)
+            record.update(name=name, start=round(started - self._t0, 3), dur=round(ended - started, 3))
+            with self._lock:
+                self.spans.append(record)
+
+    def to_dict(self, status):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start"])
+            errors = list(self.errors)
+        record = {
+            "trace_id": self.trace_id,
+            "kind": self.kind,
+            "chat_id": self.chat_id,
+            "started": round(self.started, 3),
+            "duration": round(time.monotonic() - self._t0, 3),
+            "status": status,
+            "attrs": self.attrs,
+            "spans": spans,
+        }
+        if errors:
+            record["errors"] = errors
+        return record
+
+
+def current():
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def activate(trace):
+    """
+    Makes `trace` the current one on this thread (for helper threads of a job).
+    """
+    previous = current()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Span on the current thread's trace; a plain no-op outside of a job.
+    """
+    trace = current()
+    if trace is None:
+        yield dict(attrs)
+        return
+    with trace.span(name, **attrs) as record:
+        yield record
+
+
+def fail(reason):
+    """
+    Trace.fail() on the current thread's trace; a no-op outside of a job.
+    """
+    trace = current()
+    if trace is not None:
+        trace.fail(reason)
+
+
+def _percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class TraceLog:
+    """
+    Finished job traces: appended to `path` as JSON lines (rotated past
+    `max_bytes`) and kept in memory, including those from before a
+    restart, for summary().
+    """
+
+    def __init__(self, path=TRACE_PATH, keep=TRACE_KEEP, max_bytes=TRACE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=max(1, keep))
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        self._recent.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not read %s: %s", self.path, e)
+
+    @contextmanager
+    def trace(self, kind, chat_id, **attrs):
+        trace = Trace(kind, chat_id, **attrs)
+        status = "ok"
+        try:
+            with activate(trace):
+                yield trace
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            if status == "ok" and trace.errors:
+                status = "error"
+            self._finish(trace.to_dict(status))
+
+    def job(self, kind):
+        """
+        Decorator for job functions taking `chat_id` first: each call runs
+        inside its own trace.
+        """
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(chat_id, *args, **kwargs):
+                with self.trace(kind, chat_id):
+                    return fn(chat_id, *args, **kwargs)
+            return wrapper
+        return decorate
+
+    def _finish(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._recent.append(record)
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logger.warning("Could not write trace to %s: %s", self.path, e)
+
+    def summary(self, last_n=50):
+        """
+        Stage timings over the last `last_n` jobs:
+          { "jobs", "failed", "job_p50", "job_p95",
+            "stages": { name: {"count", "failed", "p50", "p95", "mbps_p50"} },
+            "tiers": { "stage/tier": count } }
+        """
+        with self._lock:
+            records = list(self._recent)[-last_n:]
+        durations = {}
+        failed = {}
+        rates = {}
+        tiers = {}
+        for rec in records:
+            for sp in rec.get("spans", []):
+                name = sp["name"]
+                durations.setdefault(name, []).append(sp["dur"])
+                if not sp.get("ok", True):
+                    failed[name] = failed.get(name, 0) + 1
+                if sp.get("bytes") and sp["dur"] > 0:
+                    rates.setdefault(name, []).append(sp["bytes"] / sp["dur"] / (1024 * 1024))
+                if sp.get("tier"):
+                    key = f"{name}/{sp['tier']}"
+                    tiers[key] = tiers.get(key, 0) + 1
+        stages = {}
+        for name, samples in durations.items():
+            stages[name] = {
+                "count": len(samples),
+                "failed": failed.get(name, 0),
+                "p50": _percentile(samples, 0.5),
+                "p95": _percentile(samples, 0.95),
+                "mbps_p50": _percentile(rates[name], 0.5) if name in rates else None,
+            }
+        job_durations = [rec["duration"] for rec in records]
+        return {
+            "jobs": len(records),
+            "failed": sum(1 for rec in records if rec.get("status") != "ok"),
+            "job_p50": _percentile(job_durations, 0.5) if job_durations else None,
+            "job_p95": _percentile(job_durations, 0.95) if job_durations else None,
+            "stages": stages,
+            "tiers": tiers,
+        }
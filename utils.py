@@ -1,159 +1,270 @@
 import os
-import subprocess
+import glob
 import time
-import requests
 import logging
 
+from hls_downloader import download_hls, discard_partial, probe_stream, with_subtitle, RemuxError
+from metrics import observe_remux
+from ffmpeg_runner import run_ffmpeg
+from cancellation import OperationCancelled, raise_if_cancelled
+from tier_planner import (
+    TierMemory, plan_tiers, NATIVE, FFMPEG, COPY, COPY_MUX_QUEUE, REENCODE, YTDLP,
+)
+import tracing
+
 logger = logging.getLogger(__name__)
 
+# Use the built-in parallel HLS downloader before yt-dlp/ffmpeg ("0" disables it)
+HLS_NATIVE = os.getenv("HLS_NATIVE", "1") != "0"
 
-def download_and_rename_subtitle(subtitle_url, ep_num, cache_dir="subtitles_cache"):
-    """
-    Downloads subtitle from subtitle_url, saves as "Episode {ep_num}.vtt" in cache_dir.
-    Returns the local file path.
-    """
-    os.makedirs(cache_dir, exist_ok=True)
-    local_filename = os.path.join(cache_dir, f"Episode {ep_num}.vtt")
+# Mux the English .vtt into the MP4 as a soft subtitle (mov_text) instead of
+# sending it as a separate document: one upload per episode
+SOFT_SUBS = os.getenv("SOFT_SUBS", "0") == "1"
 
-    response = requests.get(subtitle_url, stream=True, timeout=30)
-    response.raise_for_status()
+# Which tier last worked per stream host (see tier_planner)
+tier_memory = TierMemory()
 
-    with open(local_filename, "wb") as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
 
-    return local_filename
+def _remux_cmd(tier, src, is_fmp4, out_path, subtitle_path=None):
+    """
+    ffmpeg command for one local remux tier, from the staged stream `src`,
+    with `subtitle_path` as a soft subtitle track if given.
+    """
+    cmd = ["ffmpeg", "-i", src]
+    if tier == REENCODE:
+        cmd += ["-c:v", "libx264", "-preset", "fast", "-crf", "18",
+                "-c:a", "aac", "-b:a", "192k"]
+    else:
+        cmd += ["-c", "copy"]
+        if not is_fmp4:
+            cmd += ["-bsf:a", "aac_adtstoasc"]
+        if tier == COPY_MUX_QUEUE:
+            cmd += ["-max_muxing_queue_size", "9999"]
+    return with_subtitle(cmd + ["-movflags", "+faststart", "-y", out_path], subtitle_path)
 
 
-def download_and_rename_video(hls_link, ep_num, cache_dir="videos_cache", progress_callback=None):
+def download_and_rename_video(hls_link, ep_num, cache_dir="videos_cache", progress_callback=None,
+                              resume=True, cancel=None, subtitle_path=None):
     """
-    Tries, in order:
-      1) yt-dlp (if installed)
-      2) ffmpeg copy-mode (with max_muxing_queue_size retry)
-      3) ffmpeg full re-encode (libx264 + aac)
+    Probes the playlist first (tier_planner.plan_tiers), then tries only
+    the strategies that can work for it, the one that last worked on the
+    same host first:
+      native) built-in parallel HLS downloader + local `ffmpeg -c copy` remux
+      copy / copy-mux-queue / re-encode) ffmpeg fetches the stream once
+              into a local .ts, which is then remuxed (stream copy, then
+              with a larger mux queue on exit 145) or re-encoded with
+              libx264/aac
+      yt-dlp) yt-dlp (if installed)
+
+    The stream is downloaded at most once on the way down: when the native
+    remux fails, its staged segments are what the ffmpeg tiers remux, and
+    yt-dlp is not tried once a local copy exists. The playlist itself is
+    read once per URL (hls_downloader.probe_cache).
 
     Reports progress via progress_callback(downloaded_mb, total_duration_s,
     percent, speed_mb_s, elapsed_s, eta_s).
 
+    Every tier writes under a temporary name and renames on success, so
+    "Episode {ep_num}.mp4" only ever exists complete. With `resume`, an
+    existing complete file is reused, and an interrupted native download
+    continues from its segment journal instead of starting over.
+
+    With `subtitle_path` (a local .vtt), the MP4 gets it as a mov_text
+    track, muxed in by the same remux pass (hls_downloader.with_subtitle);
+    only yt-dlp's output needs one more `-c copy` pass for it.
+
+    When the `cancel` token (cancellation.CancelToken) fires, the running
+    ffmpeg is killed, segment fetches and yt-dlp are aborted, every
+    partial file is deleted and OperationCancelled is raised.
+
     Returns path to "Episode {ep_num}.mp4".
     """
     os.makedirs(cache_dir, exist_ok=True)
     output_path = os.path.join(cache_dir, f"Episode {ep_num}.mp4")
+    tmp_output = output_path + ".tmp.mp4"
+    fetch_path = output_path + ".ffmpeg.ts"
 
-    # ─── 1) Try yt-dlp if available ─────────────────────────────────────────────
-    try:
-        import yt_dlp
-        ydl_opts = {
-            "format": "best[protocol^=https]",
-            "outtmpl": output_path,
-            "quiet": True,
-            "noprogress": True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([hls_link])
+    if resume and os.path.exists(output_path):
+        logger.info(f"Reusing already downloaded {output_path}")
         return output_path
-    except Exception as e:
-        logger.warning(f"yt-dlp failed ({e}); falling back to ffmpeg.")
-
-    # ─── helper to run ffmpeg + report progress ─────────────────────────────────
-    def _run_ffmpeg(cmd):
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-            text=True,
-            bufsize=1
-        )
-        start = time.time()
-        last_cb = 0.0
-
-        # attempt to probe duration
-        duration = None
-        try:
-            res = subprocess.run([
-                "ffprobe", "-v", "error",
-                "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1",
-                hls_link
-            ], capture_output=True, text=True, timeout=15)
-            out = res.stdout.strip()
-            duration = float(out) if out else None
-        except:
-            logger.warning("ffprobe failed; proceeding without duration")
-
-        while True:
-            line = proc.stdout.readline()
-            if not line:
-                if proc.poll() is not None:
-                    break
-                continue
 
-            line = line.strip()
-            if "=" not in line:
-                continue
+    with tracing.span("probe") as sp:
+        probe = probe_stream(hls_link)
+        tiers = plan_tiers(probe, tier_memory, native=HLS_NATIVE)
+        sp["ok"] = probe.reachable
+    logger.info(f"Episode {ep_num}: {probe.describe()}; trying {', '.join(tiers)}")
+
+    duration = probe.duration   # #EXTINF total; no ffprobe round trip
+    staged = None           # (path, is_fmp4) once the stream is on disk
+    copy_code = None        # exit code of the stream-copy remux, once tried
+    last_error = None
+
+    def _record(tier, ok):
+        tier_memory.record(probe.host, tier, ok)
+
+    def _cleanup_staged():
+        if staged and staged[0] == fetch_path:
+            try:
+                os.remove(fetch_path)
+            except OSError:
+                pass
+        elif staged:
+            discard_partial(output_path)
+
+    def _discard_partials():
+        # everything a tier may have left behind, yt-dlp's .part files included
+        for path in glob.glob(glob.escape(tmp_output) + "*") + [fetch_path]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        discard_partial(output_path)
+
+    def _finish():
+        os.replace(tmp_output, output_path)
+        _cleanup_staged()
+        discard_partial(output_path)
+        return output_path
 
-            key, val = line.split("=", 1)
-            if key == "out_time_ms":
+    def _fetch_with_ffmpeg():
+        # one pass over the network, no MP4 muxing to fail in it
+        cmd = [
+            "ffmpeg",
+            "-protocol_whitelist", "file,http,https,tcp,tls,crypto",
+            "-i", hls_link,
+            "-c", "copy", "-sn", "-dn",
+            "-f", "mpegts",
+            "-y", fetch_path
+        ]
+        started = time.monotonic()
+        with tracing.span("download", tier=FFMPEG) as sp:
+            result = run_ffmpeg(cmd, duration, progress_callback, cancel=cancel)
+            sp["ok"] = result.ok
+            sp["bytes"] = result.total_size
+        observe_remux(FFMPEG, started, result.ok)
+        if not result.ok:
+            try:
+                os.remove(fetch_path)
+            except OSError:
+                pass
+            logger.warning(f"ffmpeg could not fetch the stream (exit code {result.returncode}"
+                           f"{', ' + result.reason if result.reason else ''})")
+            return None
+        return fetch_path, False, result.out_time
+
+    def _add_subtitle():
+        # yt-dlp wrote tmp_output; copy it once more with the subtitle track
+        src = tmp_output + ".ytdlp"
+        os.replace(tmp_output, src)
+        with tracing.span("remux", tier="subtitle") as sp:
+            result = run_ffmpeg(_remux_cmd(COPY, src, True, tmp_output, subtitle_path), duration,
+                                cancel=cancel)
+            sp["ok"] = result.ok
+        os.remove(src)
+        if not result.ok:
+            logger.warning(f"Muxing the subtitle into yt-dlp's download failed (exit code {result.returncode})")
+        return result.ok
+
+    fetch_failed = False
+    try:
+        for tier in tiers:
+            raise_if_cancelled(cancel, f"download of Episode {ep_num}")
+            if tier == NATIVE:
                 try:
-                    out_ms = int(val)
-                except:
+                    path = download_hls(hls_link, output_path, progress_callback=progress_callback,
+                                        resume=resume, probe=probe, cancel=cancel,
+                                        subtitle_path=subtitle_path)
+                except OperationCancelled:
+                    raise
+                except RemuxError as e:
+                    logger.warning(f"Native remux failed ({e}); remuxing the fetched segments again.")
+                    staged = (e.staged_path, e.is_fmp4)
+                    copy_code = e.code
+                    _record(tier, False)
                     continue
-                curr_s = out_ms / 1e6
-                pct = (curr_s / duration * 100) if (duration and duration > 0) else 0.0
-                size_mb = (os.path.getsize(output_path) / (1024 * 1024)) if os.path.exists(output_path) else 0.0
-                elapsed = time.time() - start
-                speed = (size_mb / elapsed) if elapsed > 0 else 0.0
-                eta = (elapsed * (100 - pct) / pct) if pct > 0 else None
-
-                now = time.time()
-                if progress_callback and (now - last_cb) > 3.0:
-                    last_cb = now
-                    progress_callback(size_mb, duration or 0.0, pct, speed, elapsed, eta or 0.0)
-
-        return proc.wait()
-
-    # ─── 2) ffmpeg copy-mode ─────────────────────────────────────────────────────
-    base_cmd = [
-        "ffmpeg",
-        "-protocol_whitelist", "file,http,https,tcp,tls",
-        "-i", hls_link,
-        "-c", "copy",
-        "-bsf:a", "aac_adtstoasc",
-        "-progress", "pipe:1",
-        "-nostats",
-        output_path
-    ]
-    code = _run_ffmpeg(base_cmd)
-    if code == 0:
-        return output_path
+                except Exception as e:
+                    logger.warning(f"Native HLS download failed ({e}); falling back.")
+                    last_error = e
+                    _record(tier, False)
+                    continue
+                _record(tier, True)
+                return path
 
-    # retry on mux-queue overflow
-    if code == 145:
-        logger.warning("ffmpeg copy-mode exit 145; retrying with larger mux queue…")
-        retry_cmd = base_cmd.copy()
-        idx = retry_cmd.index("-progress")
-        retry_cmd[idx:idx] = ["-max_muxing_queue_size", "9999"]
-        code2 = _run_ffmpeg(retry_cmd)
-        if code2 == 0:
-            return output_path
-        logger.warning(f"Retry also exited with {code2}")
-
-    # ─── 3) full re-encode ───────────────────────────────────────────────────────
-    logger.warning("Falling back to full re-encode with libx264/aac…")
-    encode_cmd = [
-        "ffmpeg",
-        "-protocol_whitelist", "file,http,https,tcp,tls",
-        "-i", hls_link,
-        "-c:v", "libx264", "-preset", "fast", "-crf", "18",
-        "-c:a", "aac", "-b:a", "192k",
-        "-progress", "pipe:1",
-        "-nostats",
-        output_path
-    ]
-    code3 = _run_ffmpeg(encode_cmd)
-    if code3 == 0:
-        return output_path
+            if tier == YTDLP:
+                if staged:
+                    # would download the whole stream again
+                    continue
+                started = time.monotonic()
+                ydl_opts = {
+                    "format": "best[protocol^=https]",
+                    "outtmpl": tmp_output,
+                    "quiet": True,
+                    "noprogress": True,
+                    # yt-dlp aborts the download when a hook raises
+                    "progress_hooks": [lambda _: raise_if_cancelled(cancel, "yt-dlp download")],
+                }
+                try:
+                    import yt_dlp
+                    with tracing.span("download", tier=YTDLP), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                        ydl.download([hls_link])
+                except Exception as e:
+                    raise_if_cancelled(cancel, "yt-dlp download")
+                    logger.warning(f"yt-dlp failed ({e}); falling back.")
+                    last_error = e
+                    observe_remux(YTDLP, started, False)
+                    _record(tier, False)
+                    continue
+                observe_remux(YTDLP, started, True)
+                _record(tier, True)
+                if subtitle_path and not _add_subtitle():
+                    last_error = RuntimeError("could not mux the subtitle into yt-dlp's download")
+                    continue
+                return _finish()
 
-    logger.error(f"Full re-encode also failed with exit code {code3}")
-    raise RuntimeError(f"ffmpeg failed with exit code {code3}")
+            # ─── local ffmpeg remux tiers ────────────────────────────────────────────
+            if tier == COPY and copy_code is not None:
+                continue
+            if tier == COPY_MUX_QUEUE and copy_code not in (None, 145):
+                # only a mux-queue overflow is fixed by a larger queue
+                continue
+            if staged is None:
+                if fetch_failed:
+                    continue
+                fetched = _fetch_with_ffmpeg()
+                if fetched is None:
+                    fetch_failed = True
+                    continue
+                staged = fetched[:2]
+                # the playlist couldn't be read here; the fetch pass measured it
+                duration = duration or fetched[2] or None
+
+            if tier == REENCODE:
+                logger.warning("Falling back to full re-encode with libx264/aac…")
+            src, is_fmp4 = staged
+            started = time.monotonic()
+            with tracing.span("remux", tier=tier) as sp:
+                result = run_ffmpeg(_remux_cmd(tier, src, is_fmp4, tmp_output, subtitle_path), duration,
+                                    progress_callback, cancel=cancel)
+                code = result.returncode
+                sp["ok"] = code == 0
+            observe_remux(tier, started, code == 0)
+            _record(tier, code == 0)
+            if code == 0:
+                return _finish()
+            if tier == COPY:
+                copy_code = code
+            logger.warning(f"ffmpeg {tier} exited with {code}")
+            last_error = RuntimeError(f"ffmpeg {tier} failed with exit code {code}")
+
+    except OperationCancelled:
+        logger.info(f"Download of Episode {ep_num} cancelled; removing partial files")
+        _discard_partials()
+        raise
+
+    try:
+        os.remove(tmp_output)
+    except OSError:
+        pass
+    _cleanup_staged()
+    logger.error(f"Every download tier failed for {hls_link} ({', '.join(tiers) or 'none applicable'})")
+    raise RuntimeError(f"download failed: {last_error or 'no applicable tier'}")
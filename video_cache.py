@@ -0,0 +1,275 @@
+# video_cache.py
+
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+VIDEO_CACHE_DIR = os.getenv("VIDEO_CACHE_DIR", os.path.join("videos_cache", "shared"))
+VIDEO_CACHE_MAX_BYTES = int(os.getenv("VIDEO_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))   # 20 GiB
+VIDEO_CACHE_POLICY = os.getenv("VIDEO_CACHE_POLICY", "lru").lower()                   # lru | lfu
+# Abandoned partial downloads older than this are removed by the startup scan
+VIDEO_CACHE_PARTIAL_MAX_AGE = float(os.getenv("VIDEO_CACHE_PARTIAL_MAX_AGE", str(24 * 3600)))
+
+META_FILE = "meta.json"
+# Evicted entry dirs are renamed to this prefix before they are deleted
+TOMBSTONE_PREFIX = ".evicted-"
+
+
+def cache_key(slug, episode_id, server, category, tracks=None):
+    """
+    Content address of one rendition of one episode. `tracks` names extra
+    muxed-in tracks (e.g. a soft subtitle), which make another rendition.
+    """
+    raw = "\x1f".join([slug, episode_id, server, category] + ([tracks] if tracks else []))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("key", "path", "size", "hits", "last_used", "refs", "meta")
+
+    def __init__(self, key, path, size, hits=0, last_used=0.0, meta=None):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.hits = hits
+        self.last_used = last_used
+        self.refs = 0
+        self.meta = meta or {}
+
+
+class VideoCache:
+    """
+    Shared, content-addressed store of finished MP4s.
+
+    Layout: <root>/<sha1 of (slug, episode id, server, category)>/Episode N.mp4
+    plus a small meta.json. Partial downloads (.part.ts / .journal) live in the
+    same directory, so an interrupted fill resumes on the next request.
+
+    Files are reference-counted: acquire() pins an entry for the duration of
+    an upload and release() unpins it. Only unpinned entries are evicted when
+    the total size exceeds `max_bytes`, least recently (LRU) or least
+    frequently (LFU) used first.
+    """
+
+    def __init__(self, root=VIDEO_CACHE_DIR, max_bytes=VIDEO_CACHE_MAX_BYTES,
+                 policy=VIDEO_CACHE_POLICY):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.policy = policy if policy in ("lru", "lfu") else "lru"
+        self._entries = {}          # key → _Entry
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._fill_locks = {}       # key → [threading.Lock, users] (one download per key)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+        self.scan()
+
+    # ── index ────────────────────────────────────────────────────────────
+    def entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def scan(self):
+        """
+        Rebuilds the index from disk: every <key>/ dir with a meta.json and
+        its MP4 becomes an entry; stale partial downloads are removed.
+        """
+        entries = {}
+        now = time.time()
+        for key in os.listdir(self.root):
+            d = os.path.join(self.root, key)
+            if not os.path.isdir(d):
+                continue
+            if key.startswith(TOMBSTONE_PREFIX):
+                shutil.rmtree(d, ignore_errors=True)    # eviction cut short by a restart
+                continue
+            meta = None
+            try:
+                with open(os.path.join(d, META_FILE)) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+            path = os.path.join(d, meta["file"]) if meta and meta.get("file") else None
+            if path and os.path.isfile(path):
+                entries[key] = _Entry(
+                    key, path, os.path.getsize(path),
+                    hits=meta.get("hits", 0),
+                    last_used=meta.get("last_used", os.path.getmtime(path)),
+                    meta=meta.get("key", {}),
+                )
+                continue
+
+            # no finished file: a partial fill, kept for resuming unless abandoned
+            try:
+                age = now - max(os.path.getmtime(os.path.join(d, n)) for n in os.listdir(d))
+            except ValueError:
+                age = VIDEO_CACHE_PARTIAL_MAX_AGE + 1   # empty dir
+            if age > VIDEO_CACHE_PARTIAL_MAX_AGE:
+                shutil.rmtree(d, ignore_errors=True)
+
+        with self._lock:
+            self._entries = entries
+            self._bytes = sum(e.size for e in entries.values())
+        logger.info("Video cache: %d entries, %.1f MB in %s",
+                    len(entries), self._bytes / (1024 * 1024), self.root)
+        self._evict()
+
+    def _write_meta(self, entry):
+        data = {
+            "key": entry.meta,
+            "file": os.path.basename(entry.path),
+            "size": entry.size,
+            "hits": entry.hits,
+            "last_used": entry.last_used,
+        }
+        meta_path = os.path.join(os.path.dirname(entry.path), META_FILE)
+        try:
+            with open(meta_path + ".tmp", "w") as f:
+                json.dump(data, f)
+            os.replace(meta_path + ".tmp", meta_path)
+        except OSError as e:
+            logger.warning("Could not write %s: %s", meta_path, e)
+
+    # ── pin / unpin ──────────────────────────────────────────────────────
+    def acquire(self, key):
+        """
+        Returns the cached file path (pinned) or None on a miss.
+        """
+        path = self._pin(key)
+        with self._lock:
+            if path:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return path
+
+    def _pin(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not os.path.isfile(entry.path):
+                self._drop(entry)
+                return None
+            entry.refs += 1
+            entry.hits += 1
+            entry.last_used = time.time()
+        self._write_meta(entry)
+        return entry.path
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.refs > 0:
+                entry.refs -= 1
+        self._evict()
+
+    def fetch(self, key, download, meta=None):
+        """
+        Returns (pinned_path, was_cached). On a miss, `download(entry_dir)`
+        is called to produce the file; concurrent fetches of the same key
+        wait for that single download instead of starting their own.
+        """
+        with self._lock:
+            slot = self._fill_locks.get(key)
+            if slot is None:
+                slot = self._fill_locks[key] = [threading.Lock(), 0]
+            slot[1] += 1
+        try:
+            with slot[0]:
+                path = self._pin(key)   # filled by someone else while we waited?
+                if path:
+                    return path, True
+                d = self.entry_dir(key)
+                os.makedirs(d, exist_ok=True)
+                path = download(d)
+                self._add(key, path, meta)
+                return path, False
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if slot[1] == 0:
+                    # last one out: don't keep a lock per episode ever requested
+                    del self._fill_locks[key]
+
+    def _add(self, key, path, meta):
+        entry = _Entry(key, path, os.path.getsize(path), hits=1,
+                       last_used=time.time(), meta=meta or {})
+        entry.refs = 1
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+        self._write_meta(entry)
+        self._evict()
+
+    # ── eviction ─────────────────────────────────────────────────────────
+    def _drop(self, entry):
+        # caller holds self._lock
+        self._entries.pop(entry.key, None)
+        self._bytes -= entry.size
+
+    def _tombstone(self, entry):
+        # caller holds self._lock. Moves the entry's dir out of the way so a
+        # fetch() refilling the key after the lock is released gets a fresh
+        # dir that the deletion can't touch.
+        d = os.path.dirname(entry.path)
+        tomb = os.path.join(self.root, f"{TOMBSTONE_PREFIX}{entry.key}-{uuid.uuid4().hex[:8]}")
+        try:
+            os.rename(d, tomb)
+        except OSError as e:
+            logger.warning("Could not move %s aside, deleting in place: %s", d, e)
+            shutil.rmtree(d, ignore_errors=True)
+            return None
+        return tomb
+
+    def _evict(self):
+        victims = []
+        with self._lock:
+            if self._bytes <= self.max_bytes:
+                return
+            if self.policy == "lfu":
+                order = sorted(self._entries.values(), key=lambda e: (e.hits, e.last_used))
+            else:
+                order = sorted(self._entries.values(), key=lambda e: e.last_used)
+            for entry in order:
+                if self._bytes <= self.max_bytes:
+                    break
+                if entry.refs > 0:
+                    continue
+                self._drop(entry)
+                victims.append((entry, self._tombstone(entry)))
+                self.evictions += 1
+        for entry, tomb in victims:
+            logger.info("Evicting %s (%.1f MB) from video cache",
+                        entry.path, entry.size / (1024 * 1024))
+            if tomb is not None:
+                shutil.rmtree(tomb, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "pinned": sum(1 for e in self._entries.values() if e.refs),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
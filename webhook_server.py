@@ -0,0 +1,207 @@
+# webhook_server.py
+
+import os
+import hmac
+import time
+import secrets
+import threading
+import logging
+from collections import OrderedDict
+
+from flask import Flask, request
+from werkzeug.serving import make_server, WSGIRequestHandler
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# ——————————————————————————————————————————————————————————————
+# Tunables (override through the environment)
+# ——————————————————————————————————————————————————————————————
+# Public HTTPS base URL Telegram should post updates to; empty = long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Sent back by Telegram in X-Telegram-Bot-Api-Secret-Token; random if unset
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Updates are decoded and handed to the dispatcher in batches of up to
+# WEBHOOK_BATCH_MAX, at most WEBHOOK_BATCH_WAIT seconds after the first one
+WEBHOOK_BATCH_MAX = int(os.getenv("WEBHOOK_BATCH_MAX", "100"))
+WEBHOOK_BATCH_WAIT = float(os.getenv("WEBHOOK_BATCH_WAIT", "0.01"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Telegram re-delivers an update whose response was slow or lost
+SEEN_UPDATE_IDS = 10000
+
+
+def new_secret():
+    # 1–256 characters of A-Z a-z 0-9 _ - (Bot API secret_token rules)
+    return secrets.token_urlsafe(32)
+
+
+class UpdateBatcher:
+    """
+    Hands webhook payloads to the PTB dispatcher.
+
+    Request threads only append the raw JSON and return; one thread takes
+    whatever has piled up (up to `max_batch`), drops re-deliveries of
+    update IDs it has already seen, decodes the rest into Update objects
+    and puts them on `update_queue` in update_id order.
+    """
+
+    def __init__(self, bot, update_queue, max_batch=WEBHOOK_BATCH_MAX, wait=WEBHOOK_BATCH_WAIT):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.max_batch = max(1, max_batch)
+        self.wait = wait
+        self._cond = threading.Condition()
+        self._pending = []
+        self._seen = OrderedDict()      # update_id → None, oldest first
+        self._thread = None
+        self._stopped = False
+        self.received = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.batches = 0
+        self.dispatched = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="webhook-batcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def add(self, payload):
+        with self._cond:
+            self.received += 1
+            self._pending.append(payload)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            if self._pending and len(self._pending) < self.max_batch and self.wait > 0:
+                # let a burst arrive so it is decoded and queued in one go
+                deadline = time.monotonic() + self.wait
+                while len(self._pending) < self.max_batch and not self._stopped:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                if self._stopped:
+                    return
+                continue
+            updates = []
+            for payload in batch:
+                update_id = payload.get("update_id") if isinstance(payload, dict) else None
+                if update_id is None:
+                    self.invalid += 1
+                    continue
+                if update_id in self._seen:
+                    self.duplicates += 1
+                    continue
+                self._seen[update_id] = None
+                if len(self._seen) > SEEN_UPDATE_IDS:
+                    self._seen.popitem(last=False)
+                try:
+                    updates.append(Update.de_json(payload, self.bot))
+                except Exception as e:
+                    self.invalid += 1
+                    logger.warning("Dropping undecodable update %s: %s", update_id, e)
+            updates.sort(key=lambda u: u.update_id)
+            for update in updates:
+                self.update_queue.put(update)
+            with self._cond:
+                self.batches += 1
+                self.dispatched += len(updates)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "received": self.received,
+                "dispatched": self.dispatched,
+                "duplicates": self.duplicates,
+                "invalid": self.invalid,
+                "batches": self.batches,
+                "pending": len(self._pending),
+            }
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    # no access-log line per update
+    def log_request(self, code="-", size="-"):
+        pass
+
+
+class WebhookServer:
+    """
+    Flask app on WEBHOOK_LISTEN:WEBHOOK_PORT (the port the Dockerfile
+    exposes), served by a threaded werkzeug server in the background.
+
+    With a `secret`, POST WEBHOOK_PATH accepts an update only with the
+    right secret header (403 otherwise) and answers 200 as soon as it is
+    queued; without one (long polling) there is no webhook route. GET
+    /healthz is for the platform's health check. `app` is public so other
+    routes (/metrics) can be mounted on the same server.
+    """
+
+    def __init__(self, bot, update_queue, secret, path=WEBHOOK_PATH,
+                 host=WEBHOOK_LISTEN, port=WEBHOOK_PORT):
+        self.secret = secret
+        self.path = path
+        self.host = host
+        self.port = port
+        self.batcher = UpdateBatcher(bot, update_queue)
+        self.rejected = 0
+        self.app = Flask(__name__)
+        if secret:
+            self.app.add_url_rule(path, "webhook", self._webhook, methods=["POST"])
+        self.app.add_url_rule("/healthz", "healthz", lambda: "ok")
+        self._server = None
+        self._thread = None
+
+    def _webhook(self):
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self.rejected += 1
+            return "forbidden", 403
+        payload = request.get_json(force=True, silent=True)
+        if payload is None:
+            return "bad request", 400
+        self.batcher.add(payload)
+        return "", 200
+
+    def start(self):
+        self.batcher.start()
+        self._server = make_server(self.host, self.port, self.app, threaded=True,
+                                   request_handler=_QuietRequestHandler)
+        self.port = self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever, name="webhook-http", daemon=True)
+        self._thread.start()
+        logger.info("HTTP server listening on %s:%d", self.host, self.port)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+        self.batcher.stop()
+
+    def stats(self):
+        return dict(self.batcher.stats(), rejected=self.rejected)